@@ -4,18 +4,20 @@
 - /api/chat/streaming : SSE でストリーミング応答
 - /api/bot/respond    : 後半課題の blocking API
 - /api/bot/stream     : 後半課題の streaming API
+- /api/search/fusion  : ハイブリッド検索の融合設定を変更
 """
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional
 import json, time, os
 from datetime import datetime
 import asyncio
 
 
 from ..services.rag_service import get_rag_service
+from ..services.llm_scheduler import LLMOverloadedError
 from ..services.logger import setup_logger
 
 router = APIRouter()
@@ -37,6 +39,21 @@ def _append_chat_log(entry: dict) -> None:
         # ログ書き込み失敗は警告に留める
         logger.warning(f"failed to write chat log: {e}")
 
+def _overloaded(retry_after: int, message: str) -> HTTPException:
+    """生成の受付が満杯の時の 503（Retry-After 付き）"""
+    return HTTPException(
+        status_code=503,
+        detail={"error": message, "type": "LLMOverloaded", "message": "現在混み合っています。しばらく後でお試しください。"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+async def _prepare_streaming(rag, prompt: str) -> dict:
+    """ストリーミング開始前の検索と受付判定（受け付けられなければレスポンスを返す前に 503）"""
+    try:
+        return await rag.aprepare_streaming(prompt, k=5)
+    except LLMOverloadedError as e:
+        raise _overloaded(e.retry_after, str(e))
+
 # ====== スキーマ ======
 class ChatRequest(BaseModel):
     prompt: str
@@ -47,6 +64,13 @@ class BotRequest(BaseModel):
 class BotResponse(BaseModel):
     reply: str
 
+class FusionConfigRequest(BaseModel):
+    """ハイブリッド検索の融合設定（指定した項目だけ変更）"""
+    method: Optional[str] = None             # "rrf" / "score"
+    weights: Optional[Dict[str, float]] = None  # {"vector": 0.6, "lexical": 0.4}
+    depths: Optional[Dict[str, int]] = None     # レトリバーごとの候補数 {"vector": 10, "lexical": 10}
+    rrf_c: Optional[int] = None
+
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "service": "chat"}
@@ -62,13 +86,23 @@ async def get_search_info():
         logger.error(f"Failed to get search info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/search/fusion")
+async def configure_fusion(req: FusionConfigRequest):
+    """融合の方式・重み・候補数を実行中に変更する"""
+    rag = get_rag_service()
+    changes = req.model_dump(exclude_none=True)
+    res = rag.configure_fusion(**changes)
+    if not res["success"]:
+        raise HTTPException(status_code=400, detail=res["error"])
+    return {"status": "success", "data": res["fusion"]}
+
 # ====== Blocking ======
 @router.post("/chat/blocking")
 async def chat_blocking(req: ChatRequest):
     try:
         logger.info(f"チャット要求受信: {req.prompt}")
         rag = get_rag_service()
-        res = rag.blocking_query(req.prompt, k=5)
+        res = await rag.ablocking_query(req.prompt, k=5)
 
         payload = {
             "response": res["response"],
@@ -77,6 +111,8 @@ async def chat_blocking(req: ChatRequest):
             "context_found": res.get("documents", 0) > 0,
             "source_documents": res.get("documents", 0),
             "mode": "blocking",
+            "cached": res.get("cached", False),
+            "confidence": res.get("confidence"),
         }
 
         # エラー情報があれば追加
@@ -96,6 +132,8 @@ async def chat_blocking(req: ChatRequest):
 
         logger.info(f"チャット要求処理完了 - 処理時間: {res['latency']:.2f}秒")
         return payload
+    except LLMOverloadedError as e:
+        raise _overloaded(e.retry_after, str(e))
     except Exception as e:
         logger.error(f"チャットAPI blocking エラー: {e}")
         import traceback
@@ -112,10 +150,19 @@ async def chat_streaming(req: ChatRequest):
     try:
         rag = get_rag_service()
         start = time.time()
+        prep = await _prepare_streaming(rag, req.prompt)
 
         async def gen():
             full = ""
-            async for chunk in rag.streaming_query(req.prompt, k=5):
+            async for chunk in rag.streaming_query(req.prompt, k=5, prep=prep):
+                if isinstance(chunk, dict):
+                    # 生成待ちの順番（queue）・受付不可（busy）の通知
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if chunk.get("type") == "busy":
+                        # 回答はないので complete もログも出さずに終える
+                        yield "data: [DONE]\n\n"
+                        return
+                    continue
                 full += chunk
                 yield f"data: {json.dumps({'type':'chunk','content':chunk}, ensure_ascii=False)}\n\n"
                 await asyncio.sleep(0)
@@ -151,6 +198,8 @@ async def chat_streaming(req: ChatRequest):
                 "X-Accel-Buffering": "no", 
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"streaming error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -159,7 +208,10 @@ async def chat_streaming(req: ChatRequest):
 @router.post("/bot/respond", response_model=BotResponse)
 async def bot_respond(req: BotRequest):
     rag = get_rag_service()
-    res = rag.blocking_query(req.prompt, k=5)
+    try:
+        res = await rag.ablocking_query(req.prompt, k=5)
+    except LLMOverloadedError as e:
+        raise _overloaded(e.retry_after, str(e))
 
     # 追加: ログ保存
     _append_chat_log({
@@ -179,10 +231,17 @@ async def bot_respond(req: BotRequest):
 async def bot_stream(req: BotRequest):
     rag = get_rag_service()
     start = time.time()
+    prep = await _prepare_streaming(rag, req.prompt)
 
     async def gen():
         full = ""
-        async for chunk in rag.streaming_query(req.prompt, k=5):
+        async for chunk in rag.streaming_query(req.prompt, k=5, prep=prep):
+            if isinstance(chunk, dict):
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if chunk.get("type") == "busy":
+                    yield "data: [DONE]\n\n"
+                    return
+                continue
             full += chunk
             yield f"data: {json.dumps({'type':'chunk','content':chunk}, ensure_ascii=False)}\n\n"
         done = {
@@ -1,8 +1,10 @@
 import os
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Dict, Any
 
 from ..services.rag_service import get_rag_service
+from ..services.ingest_jobs import get_ingest_job_manager
 
 router = APIRouter()
 
@@ -19,12 +21,13 @@ async def test_rag_service():
     except Exception as e:
         return {"status": "error", "message": f"RAGサービス初期化エラー: {str(e)}"}
 
-@router.post("/")
+@router.post("/", status_code=202)
 async def upload_file(file: UploadFile = File(...)):
     """
-    CSV/TXT をアップロードして知識ベースに取り込む
+    CSV/TXT をアップロードし、知識ベースへの取り込みジョブを登録する
     - .csv: 行を文書化して Chroma に追加
     - .txt: 全文を 1 文書として追加
+    取り込みはワーカーで実行されるため、進捗は /jobs/{job_id} で確認する
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -32,47 +35,17 @@ async def upload_file(file: UploadFile = File(...)):
     try:
         logger.info(f"アップロード開始: {file.filename}")
         
-        # まずRAGサービスが利用可能か確認
-        logger.info("RAGサービス取得中...")
-        rag = get_rag_service()
-        logger.info("RAGサービス取得完了")
-        
         save_path = os.path.join(DATA_DIR, file.filename)
         logger.info(f"ファイル保存先: {save_path}")
         
         content = await file.read()
         logger.info(f"ファイル読み込み完了: {len(content)} bytes")
         
-        with open(save_path, "wb") as f:
-            f.write(content)
+        await run_in_threadpool(_write_file, save_path, content)
         logger.info("ファイル保存完了")
 
-        if file.filename.lower().endswith(".csv"):
-            logger.info("CSV処理開始")
-            res = rag.add_csv(save_path)
-            logger.info(f"CSV処理完了: {res}")
-            
-            # BM25とアンサンブルレトリバーを再初期化
-            logger.info("レトリバー初期化開始")
-            rag._init_retrievers()
-            logger.info("レトリバー初期化完了")
-            
-            return {"status": "ok", "filename": file.filename, "ingested": res.get("count", 0)}
-        else:
-            logger.info("テキストファイル処理開始")
-            # テキスト等はそのまま 1 文書として追加
-            text = content.decode("utf-8", errors="ignore")
-            logger.info(f"テキストデコード完了: {len(text)} 文字")
-            
-            rag.vectorstore.add_texts([text], metadatas=[{"source": file.filename}])
-            logger.info("ベクトルストア追加完了")
-            
-            # BM25とアンサンブルレトリバーを再初期化
-            logger.info("レトリバー初期化開始")
-            rag._init_retrievers()
-            logger.info("レトリバー初期化完了")
-            
-            return {"status": "ok", "filename": file.filename, "ingested": 1}
+        job = get_ingest_job_manager().submit(file.filename, save_path)
+        return {"status": "accepted", "filename": file.filename, "job_id": job["job_id"], "job": job}
 
     except Exception as e:
         import traceback
@@ -81,6 +54,23 @@ async def upload_file(file: UploadFile = File(...)):
         error_detail = f"エラー: {str(e)}\nトレースバック: {traceback.format_exc()}"
         raise HTTPException(status_code=500, detail=error_detail)
 
+def _write_file(path: str, content: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+
+@router.get("/jobs")
+async def list_ingest_jobs() -> Dict[str, Any]:
+    """取り込みジョブの一覧（新しい順）"""
+    return {"jobs": get_ingest_job_manager().list()}
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str) -> Dict[str, Any]:
+    """取り込みジョブの状態（rows_parsed / rows_embedded / rows_indexed）を取得"""
+    job = get_ingest_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    return job
+
 @router.get("/files")
 async def list_uploaded_files() -> Dict[str, Any]:
     """アップロード済みファイルの一覧を取得"""
@@ -128,22 +118,18 @@ async def delete_uploaded_file(filename: str) -> Dict[str, Any]:
             raise HTTPException(status_code=404, detail=f"ファイルが見つかりません: {filename}")
         
         # RAGサービスからファイル関連のデータを削除
-        rag = get_rag_service()
+        rag = await run_in_threadpool(get_rag_service)
         logger.info("RAGサービス取得完了")
         
         # ベクトルデータベースから該当ファイルのドキュメントを削除
-        removal_result = rag.remove_documents_by_source(filename)
+        # （取り込みジョブの完了待ちでイベントループを止めないようスレッドで実行）
+        removal_result = await run_in_threadpool(rag.remove_documents_by_source, filename)
         logger.info(f"ベクトルDB削除結果: {removal_result}")
         
         # 物理ファイルを削除
         os.remove(file_path)
         logger.info(f"ファイル削除完了: {file_path}")
         
-        # レトリバーを再初期化
-        logger.info("レトリバー再初期化開始")
-        rag._init_retrievers()
-        logger.info("レトリバー再初期化完了")
-        
         return {
             "status": "success",
             "filename": filename,
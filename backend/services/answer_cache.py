@@ -0,0 +1,162 @@
+"""
+回答キャッシュ（言い換え質問の再利用）
+- (クエリ埋め込み, 検索上位の文書ID, 最終回答) を保存
+- 新しい質問の埋め込みとのコサイン類似度がしきい値以上で、かつ検索上位の文書が同じなら保存済みの回答を返す
+  （文書が同じでなければ参照データが違うので、言い回しが近くても再生成する）
+- 正規化後の質問文が同じなら埋め込みなしで引ける。検索で埋め込まなかった質問（完全一致・語彙の段階で打ち切った検索）は、
+  同じ上位文書の項目があるときだけ呼び出し側で埋め込み、埋め込みのない保存済み項目もその時にまとめて埋め込む
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ANSWER_CACHE_SIZE      = int(os.getenv("ANSWER_CACHE_SIZE", "512"))          # 0 で無効
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))  # コサイン類似度
+ANSWER_CACHE_TOP_DOCS  = int(os.getenv("ANSWER_CACHE_TOP_DOCS", "3"))        # 一致を求める検索上位件数
+
+
+class AnswerCache:
+    """埋め込みの近さ + 上位文書の一致で引く回答キャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        top_docs: int = ANSWER_CACHE_TOP_DOCS,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.top_docs = top_docs
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        # キー: (モデル, 上位文書ID) → [(正規化埋め込み or None, 回答, 生成秒数, 質問)]
+        self._entries: "OrderedDict[Tuple[str, Tuple[str, ...]], List[Tuple[Optional[np.ndarray], str, float, str]]]" = OrderedDict()
+        self._size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _key(self, model: str, doc_ids: Sequence[str]) -> Tuple[str, Tuple[str, ...]]:
+        return model, tuple(doc_ids[:self.top_docs])
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def lookup(
+        self,
+        model: str,
+        vector: Optional[Sequence[float]],
+        doc_ids: Sequence[str],
+        query: str = "",
+    ) -> Optional[Dict[str, object]]:
+        """
+        ヒットすれば {"answer", "similarity", "query", "generation_sec"} を返す
+        質問文の完全一致を先に見て、vector があれば埋め込みの近さでも探す
+        """
+        if not self.enabled or not doc_ids:
+            return None
+        key = self._key(model, doc_ids)
+        q = self._normalize(vector) if vector is not None else None
+        with self._lock:
+            self.lookups += 1
+            bucket = self._entries.get(key)
+            if not bucket:
+                return None
+            best, similarity = None, 0.0
+            if query:
+                best = next((i for i in range(len(bucket) - 1, -1, -1) if bucket[i][3] == query), None)
+                similarity = 1.0
+            if best is None and q is not None:
+                indexed = [i for i, e in enumerate(bucket) if e[0] is not None]
+                if indexed:
+                    sims = np.stack([bucket[i][0] for i in indexed]) @ q
+                    j = int(np.argmax(sims))
+                    if float(sims[j]) >= self.threshold:
+                        best, similarity = indexed[j], float(sims[j])
+            if best is None:
+                return None
+            _, answer, seconds, cached_query = bucket[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += seconds
+            return {"answer": answer, "similarity": similarity, "query": cached_query, "generation_sec": seconds}
+
+    def pending_queries(self, model: str, doc_ids: Sequence[str]) -> Optional[List[str]]:
+        """
+        同じ上位文書の項目があれば、そのうち埋め込みのない項目の質問文を返す（項目がなければ None）
+        None 以外なら、新しい質問と返した質問を埋め込んで set_vectors → lookup で言い換えを引ける
+        """
+        if not self.enabled or not doc_ids:
+            return None
+        with self._lock:
+            bucket = self._entries.get(self._key(model, doc_ids))
+            if not bucket:
+                return None
+            return list(dict.fromkeys(e[3] for e in bucket if e[0] is None and e[3]))
+
+    def set_vectors(self, model: str, doc_ids: Sequence[str], vectors: Dict[str, Sequence[float]]) -> None:
+        """埋め込みのない項目へ、質問文ごとの埋め込みを付ける"""
+        if not vectors:
+            return
+        normalized = {q: self._normalize(v) for q, v in vectors.items()}
+        with self._lock:
+            bucket = self._entries.get(self._key(model, doc_ids))
+            for i, (vec, answer, seconds, query) in enumerate(bucket or []):
+                if vec is None and query in normalized:
+                    bucket[i] = (normalized[query], answer, seconds, query)
+
+    def store(
+        self,
+        model: str,
+        vector: Optional[Sequence[float]],
+        doc_ids: Sequence[str],
+        answer: str,
+        generation_sec: float,
+        query: str = "",
+    ) -> None:
+        if not self.enabled or not doc_ids or not answer:
+            return
+        key = self._key(model, doc_ids)
+        entry = (self._normalize(vector) if vector is not None else None, answer, float(generation_sec), query)
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self._entries.move_to_end(key)
+            self._size += 1
+            while self._size > self.max_entries and self._entries:
+                oldest_key, oldest = next(iter(self._entries.items()))
+                oldest.pop(0)
+                self._size -= 1
+                if not oldest:
+                    del self._entries[oldest_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "top_docs": self.top_docs,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "saved_gpu_seconds": round(self.saved_seconds, 2),
+        }
+
+
+def replay_chunks(answer: str, size: int = 16) -> List[str]:
+    """キャッシュした回答をストリーミングと同じ細かさのチャンクへ分ける"""
+    return [answer[i:i + size] for i in range(0, len(answer), size)]
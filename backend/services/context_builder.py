@@ -0,0 +1,200 @@
+"""
+トークン予算つきの参照データ組み立てと num_ctx の決定
+- 候補は融合スコアの高い順に並んでいる前提。最上位のスコアに対する比が CONTEXT_MIN_SCORE_RATIO 未満の候補は入れない
+  （最上位の候補は必ず入れる）
+- 空欄の項目（値のない「エリア:」など）は出力しない。1候補は CONTEXT_MAX_DOC_TOKENS までに切り詰める
+- 候補の合計が CONTEXT_TOKEN_BUDGET を超えたら、そこから後ろの候補は入れない
+- トークン数は文字種ごとの係数による推定（日本語は1文字1トークン寄りに多めに見積もる）。
+  実際のプレフィル量は Ollama の prompt_eval_count でログに出る
+- num_ctx はプロンプト + 回答用の予約（LLM_ANSWER_RESERVE_TOKENS）が収まる最小のバケット。
+  予約は num_ctx の見積もりにだけ使い、回答の長さは制限しない（LLM_NUM_PREDICT を指定した場合のみ上限を付ける）
+  num_ctx が変わると Ollama はモデルを読み込み直す（プレフィックスの KV キャッシュも失われる）ため、
+  バケットは少数にし、小さいバケットへ戻るのは LLM_NUM_CTX_SHRINK_AFTER 回続けて収まった時だけにする
+"""
+
+import math
+import os
+import threading
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+CONTEXT_TOKEN_BUDGET     = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+CONTEXT_MAX_DOCS         = int(os.getenv("CONTEXT_MAX_DOCS", "8"))
+CONTEXT_MAX_DOC_TOKENS   = int(os.getenv("CONTEXT_MAX_DOC_TOKENS", "200"))
+CONTEXT_MIN_SCORE_RATIO  = float(os.getenv("CONTEXT_MIN_SCORE_RATIO", "0.5"))
+# トークン推定の係数（ASCII は約4文字で1トークン、それ以外は1文字あたり）
+TOKENS_PER_ASCII_CHAR    = float(os.getenv("TOKENS_PER_ASCII_CHAR", "0.25"))
+TOKENS_PER_NONASCII_CHAR = float(os.getenv("TOKENS_PER_NONASCII_CHAR", "1.0"))
+# チャットテンプレートがメッセージごとに足すトークン（ロール見出し・区切り）
+TOKENS_PER_MESSAGE       = 8
+
+LLM_NUM_CTX_BUCKETS      = os.getenv("LLM_NUM_CTX_BUCKETS", "2048,4096,8192")
+LLM_ANSWER_RESERVE       = int(os.getenv("LLM_ANSWER_RESERVE_TOKENS", "512"))  # num_ctx に確保する回答分
+LLM_NUM_PREDICT          = int(os.getenv("LLM_NUM_PREDICT", "-1"))  # 回答の最大トークン数（-1 で無制限）
+LLM_NUM_CTX_SHRINK_AFTER = int(os.getenv("LLM_NUM_CTX_SHRINK_AFTER", "20"))
+
+NO_CONTEXT = "関連情報が見つかりませんでした。"
+
+
+def _char_tokens(ch: str) -> float:
+    return TOKENS_PER_ASCII_CHAR if ord(ch) < 128 else TOKENS_PER_NONASCII_CHAR
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の推定（切り上げ）"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars * TOKENS_PER_ASCII_CHAR + (len(text) - ascii_chars) * TOKENS_PER_NONASCII_CHAR)
+
+
+def estimate_message_tokens(messages: Sequence[Mapping[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) + TOKENS_PER_MESSAGE for m in messages)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """推定で max_tokens に収まるよう末尾を切る（切った場合は「…」を付ける）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - _char_tokens("…")
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += _char_tokens(ch)
+        if used > budget:
+            return text[:i].rstrip() + "…"
+    return text
+
+
+def compact_document(text: str) -> str:
+    """「ラベル: 値」の行のうち値が空のものを除く"""
+    lines = []
+    for line in (text or "").strip().splitlines():
+        line = line.strip()
+        _, sep, value = line.partition(":")
+        if not line or (sep and not value.strip()):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def build_context(
+    scored: Sequence[Tuple[Document, float]],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    max_docs: int = CONTEXT_MAX_DOCS,
+    max_doc_tokens: int = CONTEXT_MAX_DOC_TOKENS,
+    min_score_ratio: float = CONTEXT_MIN_SCORE_RATIO,
+) -> Tuple[str, Dict[str, int]]:
+    """
+    (文書, 融合スコア) の降順リストから参照データを組み立てる
+    返り値: (参照データ, {"candidates", "used", "dropped_low_score", "dropped_budget", "tokens"})
+    """
+    info = {"candidates": len(scored), "used": 0, "dropped_low_score": 0, "dropped_budget": 0, "tokens": 0}
+    if not scored:
+        info["tokens"] = estimate_tokens(NO_CONTEXT)
+        return NO_CONTEXT, info
+
+    top = max(score for _, score in scored)
+    candidates = [
+        doc for rank, (doc, score) in enumerate(scored[:max_docs])
+        if rank == 0 or top <= 0 or score >= top * min_score_ratio
+    ]
+    info["dropped_low_score"] = min(len(scored), max_docs) - len(candidates)
+    chunks: List[str] = []
+    tokens = 0
+    for i, doc in enumerate(candidates):
+        header = f"[候補{len(chunks) + 1}]\n"
+        body = compact_document(doc.page_content)
+        if not body:
+            continue
+        # 候補の区切り（空行）も予算に含める
+        overhead = estimate_tokens(header) + (estimate_tokens("\n\n") if chunks else 0)
+        body_limit = max_doc_tokens if chunks else min(max_doc_tokens, max(budget - overhead, 1))
+        body = truncate_tokens(body, body_limit)
+        cost = overhead + estimate_tokens(body)
+        if chunks and tokens + cost > budget:
+            # 順位を崩さないよう、収まらなかった候補より後ろは入れない
+            info["dropped_budget"] = len(candidates) - i
+            break
+        chunks.append(header + body)
+        tokens += cost
+
+    info["used"] = len(chunks)
+    info["tokens"] = tokens
+    return ("\n\n".join(chunks) if chunks else NO_CONTEXT), info
+
+
+def _parse_buckets(spec: str) -> List[int]:
+    buckets = sorted({int(b) for b in spec.split(",") if b.strip()})
+    if not buckets or buckets[0] < 1:
+        raise ValueError(f"LLM_NUM_CTX_BUCKETS は正の整数のカンマ区切りにしてください: {spec}")
+    return buckets
+
+
+class NumCtxPlanner:
+    """プロンプトの推定トークン数から num_ctx のバケットを選ぶ（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        buckets: Optional[Sequence[int]] = None,
+        reserve: int = LLM_ANSWER_RESERVE,
+        shrink_after: int = LLM_NUM_CTX_SHRINK_AFTER,
+    ):
+        self._lock = threading.Lock()
+        self.buckets = sorted(buckets) if buckets else _parse_buckets(LLM_NUM_CTX_BUCKETS)
+        self.reserve = max(0, reserve)
+        self.shrink_after = max(1, shrink_after)
+        self.current: Optional[int] = None
+        self._fits_smaller = 0
+        self.requests = 0
+        self.switches = 0
+        self.overflows = 0
+        self.total_prompt_tokens = 0
+        self.counts: Dict[int, int] = dict.fromkeys(self.buckets, 0)
+
+    def _smallest_fit(self, needed: int) -> int:
+        for bucket in self.buckets:
+            if bucket >= needed:
+                return bucket
+        return self.buckets[-1]
+
+    def choose(self, prompt_tokens: int) -> int:
+        """今回の num_ctx。大きくする必要があれば即座に、小さくできる状態が続いたら小さくする"""
+        needed = prompt_tokens + self.reserve
+        fit = self._smallest_fit(needed)
+        with self._lock:
+            self.requests += 1
+            self.total_prompt_tokens += prompt_tokens
+            if needed > self.buckets[-1]:
+                self.overflows += 1
+            chosen = self.current
+            if chosen is None or fit > chosen:
+                chosen = fit
+                self._fits_smaller = 0
+            elif fit < chosen:
+                self._fits_smaller += 1
+                if self._fits_smaller >= self.shrink_after:
+                    chosen = fit
+                    self._fits_smaller = 0
+            else:
+                self._fits_smaller = 0
+            if chosen != self.current:
+                if self.current is not None:
+                    self.switches += 1
+                self.current = chosen
+            self.counts[chosen] += 1
+            return chosen
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            n = self.requests
+            return {
+                "buckets": list(self.buckets),
+                "answer_reserve": self.reserve,
+                "current": self.current,
+                "requests": n,
+                "switches": self.switches,
+                "overflows": self.overflows,
+                "avg_prompt_tokens": round(self.total_prompt_tokens / n, 1) if n else 0.0,
+                "by_bucket": {str(b): c for b, c in self.counts.items()},
+            }
@@ -0,0 +1,105 @@
+"""
+CSV → ドキュメント変換
+- 列名の別名（品名/品目/item, 出し方/処理方法/how, ...）はファイルごとに1回だけ解決
+- テキスト生成は列単位の文字列演算で行い、行ごとの iterrows を使わない
+- chunksize 単位で読み込むため、巨大なCSVでもメモリ使用量は一定
+"""
+
+import os
+import codecs
+import hashlib
+from typing import Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+CSV_CHUNKSIZE = int(os.getenv("CSV_CHUNKSIZE", "20000"))
+
+# (ラベル, 別名の優先順)
+FIELD_ALIASES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("品目",   ("品名", "品目", "item")),
+    ("出し方", ("出し方", "処理方法", "how")),
+    ("備考",   ("備考", "注意", "note")),
+    ("エリア", ("エリア", "地区", "area")),
+)
+
+
+def detect_encoding(filepath: str, block_size: int = 1 << 20) -> str:
+    """UTF-8 として読めるかをストリーミングで検証し、読めなければ cp932 とみなす"""
+    with open(filepath, "rb") as f:
+        head = f.read(3)
+        if head == codecs.BOM_UTF8:
+            return "utf-8-sig"
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            decoder.decode(head)
+            for block in iter(lambda: f.read(block_size), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp932"
+    return "utf-8"
+
+
+def resolve_columns(columns) -> Dict[str, List[str]]:
+    """ラベルごとに、実在する別名列を優先順に返す"""
+    present = set(columns)
+    return {label: [c for c in aliases if c in present] for label, aliases in FIELD_ALIASES}
+
+
+def row_to_text(row) -> str:
+    """1行分のテキスト化（単発処理用）。空欄・NaN は空文字として扱う"""
+    parts = []
+    for label, aliases in FIELD_ALIASES:
+        value = ""
+        for col in aliases:
+            v = row.get(col)
+            v = "" if v is None or (isinstance(v, float) and pd.isna(v)) else str(v).strip()
+            if v:
+                value = v
+                break
+        parts.append(f"{label}: {value}")
+    return "\n".join(parts).strip()
+
+
+def frame_to_texts(df: pd.DataFrame, resolved: Dict[str, List[str]]) -> pd.Series:
+    """列単位でテキストを組み立てる（文字列列・空欄は空文字前提）"""
+    text = None
+    for i, (label, _) in enumerate(FIELD_ALIASES):
+        cols = resolved[label]
+        if cols:
+            value = df[cols[0]].str.strip()
+            # 先頭の別名が空なら次の別名で埋める（row.get(a) or row.get(b) と同じ優先順）
+            for col in cols[1:]:
+                value = value.where(value != "", df[col].str.strip())
+        else:
+            value = pd.Series("", index=df.index)
+        piece = (f"{label}: " if i == 0 else f"\n{label}: ") + value
+        text = piece if text is None else text + piece
+    return text.str.strip()
+
+
+def document_id(text: str) -> str:
+    """内容ベースのドキュメントID（ファイル名は含めない）"""
+    return f"content_{hashlib.md5(text.encode('utf-8')).hexdigest()}"
+
+
+def iter_csv_documents(
+    filepath: str,
+    chunksize: int = CSV_CHUNKSIZE,
+    encoding: str = None,
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """CSVを chunksize 行ずつ読み、(テキスト一覧, doc_id一覧) を返す"""
+    encoding = encoding or detect_encoding(filepath)
+    reader = pd.read_csv(
+        filepath,
+        encoding=encoding,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunksize,
+    )
+    resolved = None
+    for chunk in reader:
+        if resolved is None:
+            resolved = resolve_columns(chunk.columns)
+        texts = frame_to_texts(chunk, resolved).tolist()
+        yield texts, [document_id(t) for t in texts]
@@ -0,0 +1,110 @@
+"""
+文書テーブル
+- Chroma のID（doc_id = 内容ハッシュ）ごとに密な整数IDを割り当て、Document を1か所で保持する
+- ベクトル検索・BM25 の結果はここで整数ID配列に変換し、重複除去・融合（fusion.py）・再ランキングは整数配列のまま行う
+  （文字列キーや json.dumps によるキー生成をしない）
+- 削除されたIDは再利用するため、IDは常に 0..容量 の範囲に収まり、特徴量配列の添字にそのまま使える
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+NO_DOC = -1
+
+
+class DocumentTable:
+    """doc_id(str) ⇔ 整数ID ⇔ Document"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids: Dict[str, int] = {}
+            self._keys: List[Optional[str]] = []
+            self._docs: List[Optional[Document]] = []
+            self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._ids
+
+    @property
+    def capacity(self) -> int:
+        """発行済みIDの上限（特徴量配列の長さの目安）"""
+        return len(self._keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"documents": len(self._ids), "capacity": len(self._keys), "free_ids": len(self._free)}
+
+    def add_many(self, items: Iterable[Tuple[str, Document]]) -> np.ndarray:
+        """登録（既存キーは Document を差し替え、同じIDを使う）し、各文書の整数IDを返す"""
+        out: List[int] = []
+        with self._lock:
+            for key, doc in items:
+                doc_id = self._ids.get(key)
+                if doc_id is None:
+                    if self._free:
+                        doc_id = self._free.pop()
+                        self._keys[doc_id] = key
+                        self._docs[doc_id] = doc
+                    else:
+                        doc_id = len(self._keys)
+                        self._keys.append(key)
+                        self._docs.append(doc)
+                    self._ids[key] = doc_id
+                else:
+                    self._docs[doc_id] = doc
+                out.append(doc_id)
+        return np.asarray(out, dtype=np.int64)
+
+    def remove_many(self, keys: Iterable[str]) -> np.ndarray:
+        """削除した文書の整数IDを返す"""
+        out: List[int] = []
+        with self._lock:
+            for key in keys:
+                doc_id = self._ids.pop(key, None)
+                if doc_id is None:
+                    continue
+                self._keys[doc_id] = None
+                self._docs[doc_id] = None
+                self._free.append(doc_id)
+                out.append(doc_id)
+        return np.asarray(out, dtype=np.int64)
+
+    def id_of(self, key: str) -> int:
+        return self._ids.get(key, NO_DOC)
+
+    def ids_of(self, keys: Sequence[str]) -> np.ndarray:
+        """キー列 → 整数ID配列（未登録のキーは除く）"""
+        ids = self._ids
+        return np.fromiter(
+            (i for i in (ids.get(k, NO_DOC) for k in keys) if i != NO_DOC), dtype=np.int64
+        )
+
+    def ids_with_scores(self, keys: Sequence[str], scores: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """(キー列, スコア列) → (整数ID配列, スコア配列)（未登録のキーは両方から除く）"""
+        ids = self._ids
+        doc_ids = np.fromiter((ids.get(k, NO_DOC) for k in keys), dtype=np.int64, count=len(keys))
+        keep = doc_ids != NO_DOC
+        return doc_ids[keep], np.asarray(scores, dtype=np.float64)[keep]
+
+    def key_of(self, doc_id: int) -> Optional[str]:
+        return self._keys[doc_id] if 0 <= doc_id < len(self._keys) else None
+
+    def docs(self, doc_ids: Iterable[int]) -> List[Document]:
+        """整数ID → Document（削除済みのIDは除く）"""
+        docs = self._docs
+        return [d for d in (docs[int(i)] for i in doc_ids) if d is not None]
+
+    def docs_with_scores(self, doc_ids: Iterable[int], scores: Iterable[float]) -> List[Tuple[Document, float]]:
+        """(整数ID, スコア) → (Document, スコア)（削除済みのIDは除く）"""
+        docs = self._docs
+        return [(docs[int(i)], float(s)) for i, s in zip(doc_ids, scores) if docs[int(i)] is not None]
+
@@ -0,0 +1,255 @@
+"""
+埋め込みキャッシュ
+- (EMBED_MODEL, page_content の md5) をキーに埋め込みベクトルを SQLite へ永続化
+- 再構築・同一CSVの再アップロード・再起動で計算済みの埋め込みを再利用する
+- 検索クエリの埋め込みはプロセス内の LRU+TTL キャッシュで再利用し、同時の同一クエリは1回の埋め込みにまとめる
+"""
+
+import os
+import sqlite3
+import hashlib
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from .logger import setup_logger
+
+# 空文字でキャッシュ無効
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./cache/embeddings.sqlite3")
+
+# クエリ埋め込みのメモリキャッシュ（件数 0 で無効）
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+QUERY_EMBED_CACHE_TTL  = float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600"))  # 秒
+
+# SQLite のバインド変数上限（999）未満に抑える
+_SQL_CHUNK = 500
+
+
+def content_hash(text: str) -> str:
+    return hashlib.md5((text or "").encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite に float32 配列として埋め込みを保存するキャッシュ"""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        self.logger = setup_logger(__name__)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model        TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                dim          INTEGER NOT NULL,
+                vector       BLOB NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[i:i + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        rows = [(model, h, len(v), array("f", v).tobytes()) for h, v in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def count(self, model: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+    def stats(self, model: str) -> Dict[str, int]:
+        return {"path": self.path, "entries": self.count(model), "hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings ラッパー: embed_documents をキャッシュ経由にし、未計算分のみ内側へ委譲"""
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache, model: str):
+        self.inner = inner
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [content_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model, hashes)
+
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        if missing:
+            # 同一バッチ内の重複テキストは1回だけ埋め込む
+            uniq = list(dict.fromkeys(hashes[i] for i in missing))
+            first_text = {}
+            for i in missing:
+                first_text.setdefault(hashes[i], texts[i])
+            vectors = self.inner.embed_documents([first_text[h] for h in uniq])
+            fresh = dict(zip(uniq, vectors))
+            self.cache.put_many(self.model, fresh.items())
+            cached.update(fresh)
+
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+
+class _InFlight:
+    """埋め込み計算中のクエリ（後から来た同一クエリはこれを待つ）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    検索クエリ用の LRU+TTL キャッシュ（キー: (model, 正規化クエリ)）
+    未キャッシュ分はまとめて1回 inner.embed_documents へ渡し、計算中の同一クエリは結果を待つ（single-flight）
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        model: str,
+        normalize: Callable[[str], str] = lambda t: t,
+        max_entries: int = QUERY_EMBED_CACHE_SIZE,
+        ttl: float = QUERY_EMBED_CACHE_TTL,
+    ):
+        self.inner = inner
+        self.model = model
+        self.normalize = normalize
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], _InFlight] = {}
+        self._lock = threading.Lock()
+
+    def _get_locked(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, vector = entry
+        if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put_locked(self, key: Tuple[str, str], vector: List[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic(), vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [(self.model, self.normalize(t)) for t in texts]
+        result: Dict[Tuple[str, str], List[float]] = {}
+        waiting: Dict[Tuple[str, str], _InFlight] = {}
+        owned: Dict[Tuple[str, str], _InFlight] = {}
+        owned_text: Dict[Tuple[str, str], str] = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in result or key in waiting or key in owned:
+                    continue
+                vector = self._get_locked(key)
+                if vector is not None:
+                    self.hits += 1
+                    result[key] = vector
+                elif key in self._inflight:
+                    self.coalesced += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    owned[key] = self._inflight[key] = _InFlight()
+                    owned_text[key] = text
+
+        if owned:
+            try:
+                vectors = self.inner.embed_documents(list(owned_text.values()))
+            except BaseException as e:
+                with self._lock:
+                    for key, flight in owned.items():
+                        self._inflight.pop(key, None)
+                        flight.error = e
+                        flight.event.set()
+                raise
+            with self._lock:
+                for (key, flight), vector in zip(owned.items(), vectors):
+                    self._put_locked(key, vector)
+                    self._inflight.pop(key, None)
+                    flight.vector = vector
+                    flight.event.set()
+                    result[key] = vector
+
+        for key, flight in waiting.items():
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            result[key] = flight.vector
+
+        return [result[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def peek(self, text: str) -> Optional[List[float]]:
+        """キャッシュ済みの埋め込みだけを返す（なければ None。新たに埋め込まない）"""
+        with self._lock:
+            return self._get_locked((self.model, self.normalize(text)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
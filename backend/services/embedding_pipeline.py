@@ -0,0 +1,125 @@
+"""
+埋め込みパイプライン
+- テキストをバッチに分割し、同時実行数を制限して Ollama の埋め込みAPIへ投げる
+- バッチごとの処理時間をログ出力
+- Ollama が遅くなった・失敗した場合は同時実行数を絞り（AIMD）、回復したら徐々に戻す
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from .logger import setup_logger
+
+EMBED_BATCH_SIZE       = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY      = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_TARGET_BATCH_SEC = float(os.getenv("EMBED_TARGET_BATCH_SEC", "5.0"))
+EMBED_MAX_RETRIES      = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+
+# sink(開始オフセット, ベクトル一覧) / progress(完了件数, 総件数)
+BatchSink = Callable[[int, List[List[float]]], None]
+ProgressCallback = Callable[[int, int], None]
+
+
+class EmbeddingPipeline:
+    """バッチ化・並列化した埋め込み処理"""
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+        target_batch_sec: float = EMBED_TARGET_BATCH_SEC,
+        max_retries: int = EMBED_MAX_RETRIES,
+    ):
+        self.logger = setup_logger(__name__)
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, concurrency)
+        self.target_batch_sec = target_batch_sec
+        self.max_retries = max(0, max_retries)
+        # 直近の実行で到達した同時実行数（次回の初期値として使う）
+        self.concurrency = self.max_concurrency
+
+    def _embed_batch(self, texts: List[str]) -> Dict[str, Any]:
+        """1バッチを埋め込む。失敗時は指数バックオフで再試行"""
+        attempt = 0
+        while True:
+            t0 = time.time()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                return {"vectors": vectors, "elapsed": time.time() - t0, "retries": attempt}
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                wait_sec = min(30.0, 0.5 * (2 ** attempt))
+                self.logger.warning(f"埋め込みバッチ失敗 ({len(texts)}件, 再試行 {attempt + 1}/{self.max_retries}, {wait_sec:.1f}秒待機): {e}")
+                time.sleep(wait_sec)
+                attempt += 1
+
+    def run(
+        self,
+        texts: List[str],
+        sink: BatchSink,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        texts を埋め込み、完了したバッチから順に sink へ渡す。
+        sink は呼び出し元スレッドで逐次呼ばれるため、ベクトルストアへの書き込みは直列になる。
+        """
+        total = len(texts)
+        stats = {"texts": total, "batches": 0, "retries": 0, "seconds": 0.0, "concurrency": self.concurrency}
+        if total == 0:
+            return stats
+
+        t_start = time.time()
+        starts = list(range(0, total, self.batch_size))
+        limit = min(self.concurrency, len(starts))
+        done_count = 0
+        pending = {}
+        next_idx = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as pool:
+            while next_idx < len(starts) or pending:
+                # 現在の上限まで投入
+                while next_idx < len(starts) and len(pending) < limit:
+                    start = starts[next_idx]
+                    fut = pool.submit(self._embed_batch, texts[start:start + self.batch_size])
+                    pending[fut] = start
+                    next_idx += 1
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    start = pending.pop(fut)
+                    res = fut.result()
+                    vectors = res["vectors"]
+                    sink(start, vectors)
+
+                    done_count += len(vectors)
+                    stats["batches"] += 1
+                    stats["retries"] += res["retries"]
+
+                    # 適応制御: 遅い/再試行ありなら半減、速ければ1つ増やす
+                    slow = res["elapsed"] > self.target_batch_sec or res["retries"] > 0
+                    if slow:
+                        limit = max(1, limit // 2)
+                    elif limit < self.max_concurrency:
+                        limit += 1
+
+                    self.logger.info(
+                        f"埋め込みバッチ完了 {done_count}/{total} | {len(vectors)}件 {res['elapsed']:.2f}秒 "
+                        f"({len(vectors) / max(res['elapsed'], 1e-6):.1f}件/秒) | 同時実行数={limit}"
+                        + (" | 遅延検知のため縮小" if slow else "")
+                    )
+                    if progress:
+                        progress(done_count, total)
+
+        self.concurrency = max(1, limit)
+        stats["seconds"] = time.time() - t_start
+        stats["concurrency"] = self.concurrency
+        self.logger.info(
+            f"埋め込み完了: {total}件 / {stats['batches']}バッチ | {stats['seconds']:.2f}秒 "
+            f"({total / max(stats['seconds'], 1e-6):.1f}件/秒) | 再試行={stats['retries']}"
+        )
+        return stats
@@ -0,0 +1,157 @@
+"""
+ハイブリッド検索の融合エンジン（EnsembleRetriever の置き換え）
+- 候補は各レトリバーの (整数ID配列, スコア配列)。レトリバーごとに候補の深さ（k）を持つ
+- 融合方式
+  rrf  : 重み付き Reciprocal Rank Fusion  Σ w / (rank + c)
+  score: レトリバーごとにスコアを min-max 正規化して重み付き和
+- 融合スコアは「全レトリバーで1位」を 1.0 とする 0〜1 に正規化して返す（回答の確信度に使う）
+  正規化は設定された全レトリバーの重みの合計で行う。一部のレトリバーだけの融合（BM25 のみの段階など）は
+  その重みの割合（既定では BM25 のみで 0.4）が上限になり、確信度を過大に見積もらない
+- 重み・深さ・方式は実行中に変更でき、変更のたびに版数が上がる（検索結果キャッシュのキーに含める）
+"""
+
+import os
+import threading
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+FUSION_METHOD         = os.getenv("FUSION_METHOD", "rrf")  # rrf / score
+FUSION_RRF_C          = int(os.getenv("FUSION_RRF_C", "60"))
+FUSION_WEIGHT_VECTOR  = float(os.getenv("FUSION_WEIGHT_VECTOR", "0.6"))
+FUSION_WEIGHT_LEXICAL = float(os.getenv("FUSION_WEIGHT_LEXICAL", "0.4"))
+FUSION_DEPTH_VECTOR   = int(os.getenv("FUSION_DEPTH_VECTOR", os.getenv("RETRIEVER_K", "10")))
+FUSION_DEPTH_LEXICAL  = int(os.getenv("FUSION_DEPTH_LEXICAL", os.getenv("RETRIEVER_K", "10")))
+
+FUSION_METHODS = ("rrf", "score")
+RETRIEVERS = ("vector", "lexical")
+
+# (整数ID配列, スコア配列)。スコアは大きいほど良い
+Ranked = Tuple[np.ndarray, np.ndarray]
+
+
+class FusionEngine:
+    """重み・深さを持つ融合器。fuse() はスレッドセーフ"""
+
+    def __init__(
+        self,
+        method: str = FUSION_METHOD,
+        weights: Optional[Mapping[str, float]] = None,
+        depths: Optional[Mapping[str, int]] = None,
+        rrf_c: int = FUSION_RRF_C,
+    ):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.method = "rrf"
+        self.rrf_c = 60
+        self.weights: Dict[str, float] = {}
+        self.depths: Dict[str, int] = {}
+        self._timings: Dict[str, Tuple[int, float]] = {}
+        self.configure(
+            method=method,
+            weights=weights or {"vector": FUSION_WEIGHT_VECTOR, "lexical": FUSION_WEIGHT_LEXICAL},
+            depths=depths or {"vector": FUSION_DEPTH_VECTOR, "lexical": FUSION_DEPTH_LEXICAL},
+            rrf_c=rrf_c,
+        )
+
+    def configure(
+        self,
+        method: Optional[str] = None,
+        weights: Optional[Mapping[str, float]] = None,
+        depths: Optional[Mapping[str, int]] = None,
+        rrf_c: Optional[int] = None,
+    ) -> Dict[str, object]:
+        """設定を部分的に更新する（不正な値は ValueError）"""
+        if method is not None and method not in FUSION_METHODS:
+            raise ValueError(f"method は {FUSION_METHODS} のいずれかにしてください: {method}")
+        for name in list(weights or {}) + list(depths or {}):
+            if name not in RETRIEVERS:
+                raise ValueError(f"レトリバー名は {RETRIEVERS} のいずれかにしてください: {name}")
+        if weights is not None and any(w < 0 for w in weights.values()):
+            raise ValueError(f"重みは0以上にしてください: {dict(weights)}")
+        if depths is not None and any(d < 1 for d in depths.values()):
+            raise ValueError(f"候補の深さは1以上にしてください: {dict(depths)}")
+        if rrf_c is not None and rrf_c < 0:
+            raise ValueError(f"rrf_c は0以上にしてください: {rrf_c}")
+        with self._lock:
+            if method is not None:
+                self.method = method
+            if weights is not None:
+                self.weights = {**self.weights, **{k: float(v) for k, v in weights.items()}}
+            if depths is not None:
+                self.depths = {**self.depths, **{k: int(v) for k, v in depths.items()}}
+            if rrf_c is not None:
+                self.rrf_c = int(rrf_c)
+            self.version += 1
+        return self.config()
+
+    def config(self) -> Dict[str, object]:
+        return {
+            "method": self.method,
+            "weights": dict(self.weights),
+            "depths": dict(self.depths),
+            "rrf_c": self.rrf_c,
+            "version": self.version,
+        }
+
+    def depth(self, retriever: str, default: int) -> int:
+        return self.depths.get(retriever, default)
+
+    def record_timing(self, retriever: str, seconds: float) -> None:
+        with self._lock:
+            count, total = self._timings.get(retriever, (0, 0.0))
+            self._timings[retriever] = (count + 1, total + seconds)
+
+    def stats(self) -> Dict[str, object]:
+        timings = {
+            name: {"calls": count, "avg_ms": round(total / count * 1000, 2)}
+            for name, (count, total) in self._timings.items() if count
+        }
+        return {**self.config(), "timings": timings}
+
+    def fuse(self, ranked: Mapping[str, Ranked]) -> Ranked:
+        """
+        レトリバー名 → (ID配列, スコア配列) を融合し、(ID配列, 0〜1の融合スコア) を降順で返す
+        渡されなかったレトリバーの重みも分母に含める（BM25 のみなら上限はその重みの割合）
+        """
+        with self._lock:
+            method, rrf_c = self.method, self.rrf_c
+            weights = {name: self.weights.get(name, 0.0) for name in ranked}
+            max_total = sum(self.weights.values())
+        parts = [(ids, scores, weights[name]) for name, (ids, scores) in ranked.items() if len(ids)]
+        if not parts or max_total <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        ids = np.concatenate([np.asarray(p[0], dtype=np.int64) for p in parts])
+        if method == "score":
+            contrib = np.concatenate([w * _minmax(np.asarray(s, dtype=np.float64)) for _, s, w in parts])
+            best = max_total
+        else:
+            contrib = np.concatenate([w / (np.arange(1, len(i) + 1) + rrf_c) for i, _, w in parts])
+            best = max_total / (1 + rrf_c)
+
+        uniq, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        fused = np.bincount(inverse, weights=contrib, minlength=uniq.size)
+        # 同点は初出順（EnsembleRetriever と同じ安定ソート）
+        order = np.lexsort((first, -fused))
+        return uniq[order], fused[order] / best
+
+
+def _minmax(scores: np.ndarray) -> np.ndarray:
+    if scores.size == 0:
+        return scores
+    lo, hi = float(scores.min()), float(scores.max())
+    if hi - lo <= 1e-12:
+        return np.ones_like(scores)
+    return (scores - lo) / (hi - lo)
+
+
+def unique_max(ids: np.ndarray, scores: np.ndarray) -> Ranked:
+    """初出順を保った重複除去。同じ文書のスコアは最大値を採る"""
+    if ids.size == 0:
+        return ids, scores
+    uniq, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    best = np.full(uniq.size, -np.inf)
+    np.maximum.at(best, inverse, scores)
+    order = np.argsort(first)
+    return uniq[order], best[order]
@@ -0,0 +1,106 @@
+"""
+同一生成の相乗り（single-flight）
+- キー（モデル, 正規化質問, 検索文脈のハッシュ）が同じ生成が実行中なら、新たに LLM を呼ばずにそれに相乗りする
+- 生成は1本のタスクとして走り、出力（トークン・待ち行列の通知）を履歴に積みながら全購読者へ配信する
+  後から来た購読者も履歴の先頭から受け取るので、全員が同じ回答を最初から得る
+- 購読者が全員いなくなったら生成を取り消す（GPU を空ける）
+- asyncio 専用（イベントループのスレッドからのみ呼ぶこと）
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """実行中の生成1本（出力履歴 + 完了・例外）"""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        # 待っている購読者を起こし、次の変化用に新しい Event に差し替える
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class GenerationFlights:
+    """キー → 実行中の生成"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
+
+    def in_flight(self, key: Hashable) -> bool:
+        """同じキーの生成が実行中か（相乗りできるか）"""
+        return key in self._flights
+
+    def _join(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight
+        flight = self._flights[key] = _Flight()
+        self.started += 1
+        flight.task = asyncio.get_running_loop().create_task(self._run(key, flight, produce))
+        return flight
+
+    async def _run(self, key: Hashable, flight: _Flight, produce: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for item in produce():
+                flight.items.append(item)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.notify()
+
+    async def subscribe(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        同じキーの生成に相乗りし（なければ produce() で開始し）、出力を先頭から順に返す
+        生成が例外で終わった場合は、全購読者に同じ例外を送出する
+        """
+        flight = self._join(key, produce)
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                while i < len(flight.items):
+                    yield flight.items[i]
+                    i += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight._changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                # 取り消し中の生成に新しい要求が相乗りしないよう、先に登録を外す
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                self.cancelled += 1
+                flight.task.cancel()
+
+    async def collect(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]]) -> List[Any]:
+        """subscribe の出力をすべて待って返す（blocking 呼び出し元向け）"""
+        return [item async for item in self.subscribe(key, produce)]
@@ -0,0 +1,113 @@
+"""
+取り込みジョブ管理
+- アップロードされたファイルの取り込み（CSV解析・埋め込み・索引登録）をワーカースレッドで実行
+- /api/upload はジョブIDを即時返却し、進捗はステータスAPIで確認する
+"""
+
+import os
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .logger import setup_logger
+
+INGEST_WORKERS  = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "100"))  # 保持するジョブ履歴の上限
+
+
+class IngestJobManager:
+    """取り込みジョブをワーカーで実行し、状態を保持する"""
+
+    def __init__(self, max_workers: int = INGEST_WORKERS, max_jobs: int = INGEST_MAX_JOBS):
+        self.logger = setup_logger(__name__)
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+
+    def submit(self, filename: str, path: str) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "rows_parsed": 0,
+            "rows_embedded": 0,
+            "rows_indexed": 0,
+            "ingested": 0,
+            "duplicates": 0,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest["status"] in ("queued", "running"):
+                    break
+                self._jobs.pop(oldest_id)
+        self._executor.submit(self._run, job_id, filename, path)
+        self.logger.info(f"取り込みジョブ登録: {job_id} ({filename})")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values())]
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _run(self, job_id: str, filename: str, path: str) -> None:
+        # 循環importを避けるためここで取得
+        from .rag_service import get_rag_service
+
+        self._update(job_id, status="running", started_at=datetime.now().isoformat())
+        try:
+            rag = get_rag_service()
+            if filename.lower().endswith(".csv"):
+                res = rag.add_csv(path, progress=lambda counts: self._update(job_id, **counts))
+            else:
+                # テキスト等はそのまま 1 文書として追加
+                with open(path, "rb") as f:
+                    text = f.read().decode("utf-8", errors="ignore")
+                self._update(job_id, rows_parsed=1)
+                res = rag.add_text(text, filename)
+                self._update(job_id, rows_embedded=res.get("count", 0), rows_indexed=res.get("count", 0))
+
+            if not res.get("success", False):
+                raise RuntimeError(res.get("error", "取り込みに失敗しました"))
+            self._update(
+                job_id,
+                status="completed",
+                ingested=res.get("count", 0),
+                duplicates=res.get("duplicates", 0),
+                finished_at=datetime.now().isoformat(),
+            )
+            self.logger.info(f"取り込みジョブ完了: {job_id} ({filename}) | {res}")
+        except Exception as e:
+            self.logger.error(f"取り込みジョブ失敗: {job_id} ({filename}): {e}")
+            self.logger.error(f"トレースバック: {traceback.format_exc()}")
+            self._update(job_id, status="failed", error=str(e), finished_at=datetime.now().isoformat())
+
+
+# ======= シングルトン =======
+_manager = None
+def get_ingest_job_manager() -> IngestJobManager:
+    global _manager
+    if _manager is None:
+        _manager = IngestJobManager()
+    return _manager
@@ -0,0 +1,135 @@
+"""
+品目名の完全一致インデックス
+- 取り込み時に「品目: 〇〇」から正規化した品目名（括弧書きを除いた基本名も含む）→ 文書 を登録
+- 同義語辞書の表記揺れ（TV → テレビ など）は別名として登録名へ対応付ける
+- 「〇〇の捨て方」の〇〇が完全一致すれば、ハイブリッド検索を経ずにその行を返せる
+"""
+
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+_ITEM_LINE_RE = re.compile(r"品目:\s*(.+)")
+_PAREN_RE = re.compile(r"\(.*?\)")
+_SPACE_RE = re.compile(r"[\s\u200b\u200c\u200d\u2060\ufeff]+")
+
+
+def normalize_item_name(name: str) -> str:
+    """NFKC・小文字化し、空白を除いた比較用の品目名"""
+    if not name:
+        return ""
+    return _SPACE_RE.sub("", unicodedata.normalize("NFKC", name)).lower()
+
+
+def item_name_of(text: str) -> str:
+    """ドキュメント本文の「品目:」行から品目名を取り出す"""
+    m = _ITEM_LINE_RE.search(text or "")
+    return m.group(1).strip() if m else ""
+
+
+def item_name_keys(name: str) -> Tuple[str, str]:
+    """(正規化した品目名, 括弧書きを除いた基本名)"""
+    full = normalize_item_name(name)
+    base = _PAREN_RE.sub("", full)
+    return full, base
+
+
+class ItemIndex:
+    """正規化品目名 → 文書 のハッシュ索引"""
+
+    def __init__(self, synonyms: Optional[Mapping[str, Iterable[str]]] = None):
+        self._lock = threading.RLock()
+        self._synonyms: Dict[str, List[str]] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.clear()
+        self.set_synonyms(synonyms or {})
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs: Dict[str, Document] = {}
+            self._doc_names: Dict[str, Tuple[str, str]] = {}
+            self._exact: Dict[str, Dict[str, None]] = {}   # 正規化名 → 文書キー（挿入順）
+            self._base: Dict[str, Dict[str, None]] = {}    # 基本名 → 文書キー
+
+    def set_synonyms(self, synonyms: Mapping[str, Iterable[str]]) -> None:
+        """同義語辞書（見出し語 → 表記揺れ）から 表記 → 同じグループの他の表記 を作る"""
+        related: Dict[str, Set[str]] = {}
+        for key, values in synonyms.items():
+            group = {normalize_item_name(key), *(normalize_item_name(v) for v in values)}
+            group.discard("")
+            for form in group:
+                related.setdefault(form, set()).update(group - {form})
+        with self._lock:
+            self._synonyms = {form: sorted(others) for form, others in related.items()}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self._docs),
+            "names": len(self._exact),
+            "base_names": len(self._base),
+            "lookups": self.lookups,
+            "hits": self.hits,
+        }
+
+    def add_many(self, items: Iterable[Tuple[str, Document]]) -> None:
+        with self._lock:
+            for key, doc in items:
+                name = item_name_of(doc.page_content)
+                if not name:
+                    continue
+                if key in self._docs:
+                    self._remove_locked(key)
+                full, base = item_name_keys(name)
+                self._docs[key] = doc
+                self._doc_names[key] = (full, base)
+                self._exact.setdefault(full, {})[key] = None
+                if base:
+                    self._base.setdefault(base, {})[key] = None
+
+    def remove_many(self, keys: Iterable[str]) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._remove_locked(key))
+
+    def _remove_locked(self, key: str) -> bool:
+        names = self._doc_names.pop(key, None)
+        if names is None:
+            return False
+        self._docs.pop(key, None)
+        for table, name in ((self._exact, names[0]), (self._base, names[1])):
+            bucket = table.get(name)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del table[name]
+        return True
+
+    def _keys_for(self, name: str) -> List[str]:
+        if name in self._exact:
+            return list(self._exact[name])
+        if name in self._base:
+            return list(self._base[name])
+        return []
+
+    def lookup(self, item: str) -> List[Document]:
+        """品目名が完全一致（または基本名・同義語で一致）した文書を返す"""
+        name = normalize_item_name(item)
+        if not name:
+            return []
+        with self._lock:
+            self.lookups += 1
+            keys = self._keys_for(name)
+            if not keys:
+                for form in self._synonyms.get(name, ()):
+                    keys = self._keys_for(form)
+                    if keys:
+                        break
+            if keys:
+                self.hits += 1
+            return [self._docs[k] for k in keys]
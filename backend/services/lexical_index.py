@@ -0,0 +1,305 @@
+"""
+語彙検索インデックス（BM25）
+- 日本語向けに文字 bi-gram / tri-gram で分かち書き（空白のない「品目: アイスピック 出し方: 家庭ごみ」でも効く）
+- 転置リストは numpy の CSR 形式（語 → 文書スロット, tf）で保持し、
+  クエリは該当語の転置リストを連結して 1 回の bincount（疎行列×ベクトル）で採点する
+- ドキュメント単位で追加・削除でき、コストは変更分の大きさに比例する
+  （追加は差分セグメントへ、削除は墓標で表し、一定量たまったら CSR へ併合する）
+"""
+
+import re
+import math
+import threading
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# 記号・空白で区切った連続文字列ごとに n-gram を作る
+_SPLIT_RE = re.compile(r"[\s　、。，．・：:;；/（）()「」『』【】\[\]{}<>＜＞!！?？\"'`~\-_=+*&%$#@^|\\,\.]+")
+
+# 併合の閾値: 差分セグメントの転置要素数がCSRのこの割合を超えたら併合
+_MERGE_RATIO = 0.25
+_MERGE_MIN_POSTINGS = 4096
+# この件数以上の一括追加は差分セグメントを経由せず、直接CSRを作り直す
+_BULK_MIN_DOCS = 256
+
+
+def ngram_tokenize(text: str, n_min: int = 2, n_max: int = 3) -> List[str]:
+    """NFKC正規化・小文字化した上で、文字 n-gram（既定 2〜3）を返す。1文字の語はそのまま使う"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in _SPLIT_RE.split(text):
+        if not run:
+            continue
+        if len(run) < n_min:
+            tokens.append(run)
+            continue
+        for n in range(n_min, n_max + 1):
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def whitespace_tokenize(text: str) -> List[str]:
+    """BM25Retriever の既定と同じ空白区切り（比較用）"""
+    return (text or "").split()
+
+
+class IncrementalBM25Index:
+    """CSR転置リスト + 差分セグメントによる BM25"""
+
+    def __init__(
+        self,
+        tokenizer: Callable[[str], List[str]] = ngram_tokenize,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vocab: Dict[str, int] = {}
+            self._df = np.zeros(1024, dtype=np.int32)
+            # 文書スロット
+            self._key_to_slot: Dict[str, int] = {}
+            self._slot_keys: List[Optional[str]] = []
+            self._slot_docs: List[Optional[Document]] = []
+            self._slot_terms: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+            self._doc_len = np.zeros(1024, dtype=np.float32)
+            self._alive = np.zeros(1024, dtype=bool)
+            self._n_docs = 0
+            self._total_len = 0.0
+            self._dead_slots = 0
+            # CSR（語ID → スロット/tf）と差分セグメント
+            self._indptr = np.zeros(1, dtype=np.int64)
+            self._post_slot = np.zeros(0, dtype=np.int32)
+            self._post_tf = np.zeros(0, dtype=np.float32)
+            self._delta: Dict[int, List[Tuple[int, float]]] = {}
+            self._delta_size = 0
+            self._free_slots: List[int] = []
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._key_to_slot
+
+    def get(self, key: str) -> Optional[Document]:
+        slot = self._key_to_slot.get(key)
+        return self._slot_docs[slot] if slot is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": self._n_docs,
+            "terms": len(self._vocab),
+            "postings": int(self._post_slot.size) + self._delta_size,
+            "delta_postings": self._delta_size,
+            "dead_slots": self._dead_slots,
+        }
+
+    # ----- 更新 -----
+    @staticmethod
+    def _grow(arr: np.ndarray, size: int) -> np.ndarray:
+        if size <= arr.size:
+            return arr
+        out = np.zeros(max(size, arr.size * 2), dtype=arr.dtype)
+        out[:arr.size] = arr
+        return out
+
+    def _term_ids(self, tf: Counter) -> Tuple[np.ndarray, np.ndarray]:
+        tids = np.empty(len(tf), dtype=np.int32)
+        tfs = np.empty(len(tf), dtype=np.float32)
+        for i, (term, count) in enumerate(tf.items()):
+            tid = self._vocab.get(term)
+            if tid is None:
+                tid = self._vocab[term] = len(self._vocab)
+            tids[i] = tid
+            tfs[i] = count
+        self._df = self._grow(self._df, len(self._vocab))
+        return tids, tfs
+
+    def add(self, key: str, doc: Document) -> None:
+        self.add_many([(key, doc)])
+
+    def add_many(self, items: Iterable[Tuple[str, Document]]) -> None:
+        items = list(items)
+        bulk = len(items) >= _BULK_MIN_DOCS
+        with self._lock:
+            for key, doc in items:
+                self._add_locked(key, doc, to_delta=not bulk)
+            # 併合判定はまとめて1回（一括取り込みで何度も併合しない）
+            if bulk:
+                self._merge()
+            else:
+                self._maybe_merge()
+
+    def _add_locked(self, key: str, doc: Document, to_delta: bool = True) -> None:
+        tf = Counter(self.tokenizer(doc.page_content))
+        if key in self._key_to_slot:
+            self._remove_locked(key)
+        tids, tfs = self._term_ids(tf)
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = key
+            self._slot_docs[slot] = doc
+            self._slot_terms[slot] = (tids, tfs)
+        else:
+            slot = len(self._slot_keys)
+            self._slot_keys.append(key)
+            self._slot_docs.append(doc)
+            self._slot_terms.append((tids, tfs))
+            self._doc_len = self._grow(self._doc_len, slot + 1)
+            self._alive = self._grow(self._alive, slot + 1)
+
+        self._key_to_slot[key] = slot
+        self._alive[slot] = True
+        length = float(tfs.sum())
+        self._doc_len[slot] = length
+        self._total_len += length
+        self._n_docs += 1
+        self._df[tids] += 1
+        if to_delta:
+            for tid, count in zip(tids.tolist(), tfs.tolist()):
+                self._delta.setdefault(tid, []).append((slot, count))
+            self._delta_size += len(tids)
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            removed = self._remove_locked(key)
+            self._maybe_merge()
+            return removed
+
+    def remove_many(self, keys: Iterable[str]) -> int:
+        with self._lock:
+            removed = sum(1 for key in keys if self._remove_locked(key))
+            self._maybe_merge()
+            return removed
+
+    def _remove_locked(self, key: str) -> bool:
+        slot = self._key_to_slot.pop(key, None)
+        if slot is None:
+            return False
+        tids, _ = self._slot_terms[slot]
+        self._df[tids] -= 1
+        self._total_len -= float(self._doc_len[slot])
+        self._doc_len[slot] = 0.0
+        self._alive[slot] = False
+        # 転置リスト上の要素は併合まで墓標として残す（スロットも併合まで再利用しない）
+        self._slot_keys[slot] = None
+        self._slot_docs[slot] = None
+        self._n_docs -= 1
+        self._dead_slots += 1
+        return True
+
+    def _maybe_merge(self) -> None:
+        main = int(self._post_slot.size)
+        threshold = max(_MERGE_MIN_POSTINGS, int(main * _MERGE_RATIO))
+        if self._delta_size > threshold or self._dead_slots > max(64, len(self._slot_keys) // 4):
+            self._merge()
+
+    def _merge(self) -> None:
+        """生存文書から CSR を作り直し、差分と墓標を解消する（償却コスト）"""
+        slots, tids, tfs = [], [], []
+        free: List[int] = []
+        for slot, key in enumerate(self._slot_keys):
+            if key is None:
+                self._slot_terms[slot] = None
+                free.append(slot)
+                continue
+            t, f = self._slot_terms[slot]
+            tids.append(t)
+            tfs.append(f)
+            slots.append(np.full(t.size, slot, dtype=np.int32))
+        n_terms = len(self._vocab)
+        if tids:
+            all_tids = np.concatenate(tids)
+            order = np.argsort(all_tids, kind="stable")
+            self._post_slot = np.concatenate(slots)[order]
+            self._post_tf = np.concatenate(tfs)[order]
+            counts = np.bincount(all_tids, minlength=n_terms)
+        else:
+            self._post_slot = np.zeros(0, dtype=np.int32)
+            self._post_tf = np.zeros(0, dtype=np.float32)
+            counts = np.zeros(n_terms, dtype=np.int64)
+        self._indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._indptr[1:])
+        self._delta = {}
+        self._delta_size = 0
+        self._dead_slots = 0
+        self._free_slots = free
+
+    # ----- 検索 -----
+    def _top_slots(self, qtf: Counter, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """上位k件の (スロット, スコア)。呼び出し側でロックを取ること"""
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        n = self._n_docs
+        if n == 0 or not qtf:
+            return empty
+        avgdl = (self._total_len / n) or 1.0
+        n_main_terms = self._indptr.size - 1
+
+        slot_parts, tf_parts, w_parts = [], [], []
+        for term, q_count in qtf.items():
+            tid = self._vocab.get(term)
+            if tid is None or self._df[tid] <= 0:
+                continue
+            df = float(self._df[tid])
+            weight = q_count * math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            if tid < n_main_terms:
+                lo, hi = self._indptr[tid], self._indptr[tid + 1]
+                if hi > lo:
+                    slot_parts.append(self._post_slot[lo:hi])
+                    tf_parts.append(self._post_tf[lo:hi])
+                    w_parts.append(np.full(hi - lo, weight, dtype=np.float32))
+            delta = self._delta.get(tid)
+            if delta:
+                arr = np.asarray(delta, dtype=np.float64)
+                slot_parts.append(arr[:, 0].astype(np.int32))
+                tf_parts.append(arr[:, 1].astype(np.float32))
+                w_parts.append(np.full(len(delta), weight, dtype=np.float32))
+        if not slot_parts:
+            return empty
+
+        slots = np.concatenate(slot_parts)
+        tfs = np.concatenate(tf_parts)
+        weights = np.concatenate(w_parts)
+        norm = tfs + self.k1 * (1.0 - self.b + self.b * self._doc_len[slots] / avgdl)
+        contrib = weights * tfs * (self.k1 + 1.0) / norm
+        scores = np.bincount(slots, weights=contrib, minlength=len(self._slot_keys))
+        scores[~self._alive[:scores.size]] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates, scores[candidates]
+
+    def search_with_scores(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        qtf = Counter(self.tokenizer(query))
+        with self._lock:
+            slots, scores = self._top_slots(qtf, k)
+            return [(self._slot_docs[s], float(x)) for s, x in zip(slots.tolist(), scores.tolist())]
+
+    def search(self, query: str, k: int) -> List[Document]:
+        return [doc for doc, _ in self.search_with_scores(query, k)]
+
+    def search_keys_with_scores(self, query: str, k: int) -> Tuple[List[str], np.ndarray]:
+        """上位k件の (文書キー, BM25スコア配列)（Document を組み立てない）"""
+        qtf = Counter(self.tokenizer(query))
+        with self._lock:
+            slots, scores = self._top_slots(qtf, k)
+            return [self._slot_keys[s] for s in slots.tolist()], scores
+
+    def search_keys(self, query: str, k: int) -> List[str]:
+        """上位k件の文書キー（Document を組み立てない）"""
+        return self.search_keys_with_scores(query, k)[0]
+
@@ -0,0 +1,163 @@
+"""
+LLM 生成の受付制御（GPU 1枚に同時に載せる生成数を制限する）
+- 同時実行数 LLM_MAX_CONCURRENCY を超えた要求は FIFO の待ち行列に入る
+- 待ち行列が LLM_MAX_QUEUE 件で満杯なら即座に LLMQueueFullError（API は 503 + Retry-After）
+- LLM_MAX_QUEUE_WAIT_SEC を超えて待った要求は LLMQueueTimeoutError
+- Retry-After は直近の生成時間の移動平均と待ち件数から見積もる
+- asyncio 専用（イベントループのスレッドからのみ呼ぶこと）
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "1"))
+LLM_MAX_QUEUE       = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_MAX_QUEUE_WAIT  = float(os.getenv("LLM_MAX_QUEUE_WAIT_SEC", "60"))
+# 待ち行列の順番を確認する間隔（streaming の順番通知）
+LLM_QUEUE_POSITION_INTERVAL = float(os.getenv("LLM_QUEUE_POSITION_INTERVAL_SEC", "0.5"))
+
+# 生成時間の実績がまだない時の見積もり（秒）
+_INITIAL_SERVICE_SEC = 10.0
+_EMA_ALPHA = 0.2
+
+
+class LLMOverloadedError(Exception):
+    """生成を受け付けられない（retry_after 秒後の再試行を促す）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMQueueFullError(LLMOverloadedError):
+    pass
+
+
+class LLMQueueTimeoutError(LLMOverloadedError):
+    pass
+
+
+class LLMScheduler:
+    """同時実行数の上限 + 有界 FIFO 待ち行列"""
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        max_wait: float = LLM_MAX_QUEUE_WAIT,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_sec = _INITIAL_SERVICE_SEC
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_sec = 0.0
+
+    # ----- 見積もり・統計 -----
+    def retry_after(self) -> int:
+        """今並んだ場合に生成が始まるまでの見積もり秒数（Retry-After 用、1秒以上）"""
+        ahead = len(self._waiters) + 1
+        return max(1, math.ceil(self._service_sec * ahead / self.max_concurrency))
+
+    def is_full(self) -> bool:
+        return self.active >= self.max_concurrency and len(self._waiters) >= self.max_queue
+
+    def check_admission(self) -> None:
+        """今並べるか（並べなければ LLMQueueFullError）。ストリーミングのレスポンス開始前の判定用"""
+        if self.is_full():
+            self.rejected += 1
+            raise LLMQueueFullError(f"LLM queue is full ({len(self._waiters)} waiting)", self.retry_after())
+
+    def position(self, waiter: asyncio.Future) -> int:
+        """待ち行列での順番（1始まり）。受付済みなら 0"""
+        try:
+            return self._waiters.index(waiter) + 1
+        except ValueError:
+            return 0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_sec": self.max_wait,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_sec": round(self.total_wait_sec / self.admitted, 3) if self.admitted else 0.0,
+            "avg_generation_sec": round(self._service_sec, 3),
+        }
+
+    # ----- 受付 -----
+    def enqueue(self) -> Optional[asyncio.Future]:
+        """空きがあれば即座に受け付けて None、なければ待ち行列に並んだ Future を返す（満杯なら例外）"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+        self.check_admission()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        return waiter
+
+    async def wait_turn(self, waiter: Optional[asyncio.Future]) -> AsyncIterator[int]:
+        """受け付けられるまで待ち、順番が変わるたびに順番（1始まり）を返す。時間切れは例外"""
+        if waiter is None:
+            return
+        t0 = time.monotonic()
+        deadline = t0 + self.max_wait
+        last = None
+        try:
+            while not waiter.done():
+                pos = self.position(waiter)
+                if pos != last:
+                    last = pos
+                    yield pos
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(waiter), timeout=min(LLM_QUEUE_POSITION_INTERVAL, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # 受付と同時に中断された場合は枠を返す
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise LLMQueueTimeoutError(
+                    f"LLM queue wait exceeded {self.max_wait:g}s", self.retry_after()
+                ) from None
+            raise
+        self.total_wait_sec += time.monotonic() - t0
+
+    def release(self, generation_sec: Optional[float] = None) -> None:
+        """生成の枠を返し、待ち行列の先頭へ引き渡す"""
+        if generation_sec is not None:
+            self._service_sec += _EMA_ALPHA * (generation_sec - self._service_sec)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # 枠はそのまま引き渡す（active は減らさない）
+                self.admitted += 1
+                waiter.set_result(None)
+                return
+        self.active = max(0, self.active - 1)
@@ -1,7 +1,8 @@
 # backend/services/llm_service.py
 import os
+import threading
 import time
-from typing import Generator, List, Dict, Any
+from typing import Generator, List, Dict, Any, Mapping, Optional
 import ollama
 
 DEFAULT_LLM = os.getenv("LLM_MODEL", "hf.co/mmnga/Llama-3.1-Swallow-8B-Instruct-v0.5-gguf:Q4_K_M")   # Llama-3.1-Swallow-8B モデル
@@ -13,6 +14,61 @@ SYSTEM_JA = (
     "不明な場合は『申し訳ございませんが、該当する情報が見つかりません。』と答えてください。"
 )
 
+# RAG 用の固定システムプロンプト。毎回同じ先頭になるので Ollama がプレフィックスの KV キャッシュを再利用できる
+# （質問・参照データはユーザーメッセージに入れ、ここには可変部分を入れないこと）
+SYSTEM_RAG_JA = (
+    "あなたは北九州市のごみ分別案内の専門AIです。"
+    "参照データの範囲内で、日本語で簡潔かつ正確に回答してください。"
+    "最優先で「出し方」を特定して、そのままの表記で出力する。次に「備考」があれば補足する。"
+    "重要なルール:"
+    "1. 質問された品目に関連する情報のみを回答してください（関係ない品目の情報は含めないでください）"
+    "2. データベースに該当する情報がない場合は「申し訳ございませんが、該当する情報がありません。北九州市のホームページでご確認いただくか、お住まいの区役所にお問い合わせください。」と回答してください"
+    "3. 回答は簡潔で分かりやすく、出し方と備考を含めてください"
+    "4. 推測や一般的なアドバイスは避け、データに基づいた正確な情報のみを提供してください"
+    "5. 複数の関連品目がある場合は、質問に最も関連するもののみを優先して回答してください"
+)
+
+
+class PrefillStats:
+    """Ollama の応答に含まれる prompt_eval_count / prompt_eval_duration（プレフィル）の集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_eval_count = 0
+        self.prompt_eval_ns = 0
+        self.eval_count = 0
+        self.eval_ns = 0
+
+    def record(self, res: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        """最終応答（done=True のチャンク、または非ストリーミングの応答）から1件分を記録して返す"""
+        if res.get("prompt_eval_count") is None and res.get("eval_count") is None:
+            return None
+        usage = {
+            "prompt_eval_count": int(res.get("prompt_eval_count") or 0),
+            "prompt_eval_ms": (res.get("prompt_eval_duration") or 0) / 1e6,
+            "eval_count": int(res.get("eval_count") or 0),
+            "eval_ms": (res.get("eval_duration") or 0) / 1e6,
+        }
+        with self._lock:
+            self.requests += 1
+            self.prompt_eval_count += usage["prompt_eval_count"]
+            self.prompt_eval_ns += int(res.get("prompt_eval_duration") or 0)
+            self.eval_count += usage["eval_count"]
+            self.eval_ns += int(res.get("eval_duration") or 0)
+        return usage
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.requests
+            return {
+                "requests": n,
+                "avg_prompt_eval_count": round(self.prompt_eval_count / n, 1) if n else 0.0,
+                "avg_prompt_eval_ms": round(self.prompt_eval_ns / n / 1e6, 1) if n else 0.0,
+                "avg_eval_count": round(self.eval_count / n, 1) if n else 0.0,
+                "avg_eval_ms": round(self.eval_ns / n / 1e6, 1) if n else 0.0,
+            }
+
 class LLMService:
     def __init__(self, model: str = None):
         self.model = model or DEFAULT_LLM
@@ -1,29 +1,51 @@
 """
 北九州市ごみ分別チャットボット RAG サービス
 - Embeddings: Ollama (bge-m3:latest)
-- Vector DB: Chroma (./chroma_db に永続化)
+- Vector DB: Chroma (./chroma_db に永続化、マニフェストで差分埋め込み)
 - LLM: Ollama (Swallow v0.5 gguf)
 """
 
 import os
 import re
-import json
+import hashlib
 import shutil
 import time
+import threading
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Callable, Iterable, Optional, Set, Tuple, Union
 import asyncio
 
+import numpy as np
 import pandas as pd
 import ollama
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 
 from .logger import setup_logger
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_cache import EMBED_CACHE_PATH, EmbeddingCache, CachedEmbeddings, QueryEmbeddingCache
+from .source_manifest import SourceManifest
+from .csv_loader import detect_encoding, iter_csv_documents, row_to_text, document_id
+from .lexical_index import IncrementalBM25Index
+from .item_index import ItemIndex
+from .synonyms import SynonymDictionary
+from .retrieval_cache import RetrievalCache
+from .answer_cache import AnswerCache, replay_chunks
+from .vector_index import VECTOR_BACKEND, NumpyVectorIndex
+from .rerank import RerankFeatures
+from .doc_table import DocumentTable
+from .fusion import FusionEngine, Ranked, unique_max
+from .retrieval_planner import PLANNER_EARLY_EXIT, StageStats, stage_threshold
+from .llm_scheduler import LLMOverloadedError, LLMScheduler
+from .generation_flight import GenerationFlights
+from .llm_service import SYSTEM_RAG_JA, PrefillStats
+from .context_builder import (
+    CONTEXT_MAX_DOC_TOKENS, CONTEXT_MAX_DOCS, CONTEXT_MIN_SCORE_RATIO, CONTEXT_TOKEN_BUDGET, LLM_NUM_PREDICT,
+    NumCtxPlanner, build_context, estimate_message_tokens,
+)
 
 # ===== 環境変数 / 既定値 =====
 EMBED_MODEL = os.getenv("EMBED_MODEL", "bge-m3")
@@ -31,11 +53,27 @@ LLM_MODEL   = os.getenv("LLM_MODEL", "hf.co/mmnga/Llama-3.1-Swallow-8B-Instruct-
 CHROMA_DIR  = os.getenv("CHROMA_DIR", "./chroma_db")
 DATA_DIR    = os.getenv("DATA_DIR", "./data")
 
+# 永続インデックス（再起動時は新規・変更行のみ埋め込む）
+PERSIST_INDEX     = os.getenv("PERSIST_INDEX", "true").lower() in ("1", "true", "yes", "on")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "kitakyushu_waste")
+MANIFEST_FILE     = "index_manifest.sqlite3"
+LEGACY_MANIFEST   = "index_manifest.json"
+
 # 召回強度（環境変数で可調整）
 DEFAULT_K   = int(os.getenv("RETRIEVER_K", "10"))
 K_MAX       = int(os.getenv("RETRIEVER_K_MAX", "12"))
 K_MIN       = int(os.getenv("RETRIEVER_K_MIN", "5"))
 
+# 検索サブクエリ（ベクトル一括検索・クエリごとのBM25）の並列実行
+RETRIEVAL_WORKERS  = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+RETRIEVAL_DEADLINE = float(os.getenv("RETRIEVAL_DEADLINE_SEC", "10"))  # 1検索あたりの締め切り（秒）
+
+# 生成後もモデルを常駐させる時間（アンロードされるとプレフィックスの KV キャッシュも失われる）
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+
+# 非同期API（chat の blocking / streaming）から同期処理（検索・回答キャッシュ照会）を逃がすスレッド数
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", "8"))
+
 # ===== 軽量クレンジング =====
 _ZERO_WIDTH_TRANS = dict.fromkeys([0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF], None)
 
@@ -50,20 +88,22 @@ def clean_text(text: str) -> str:
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
+# 「〜の捨て方」「〜はどう」「〜を捨てる」の順に試す（事前コンパイル）
+# 1本の選択にまとめると最左の一致が優先され、抽出される品目名が変わるため順番に照合する
+_ITEM_QUERY_PATTERNS = tuple(re.compile(p) for p in (
+    r'(.+?)の(?:捨て方|分別|処理|出し方)',
+    r'(.+?)は(?:どう|どのように|どこに)',
+    r'(.+?)を(?:捨てる|分別|処理)',
+))
+
 def extract_item_like(query: str) -> str:
     """クエリからアイテム名を抽出"""
     if not query:
         return ""
     
     # 「〜の捨て方」「〜はどう」などのパターンからアイテム名を抽出
-    patterns = [
-        r'(.+?)の(?:捨て方|分別|処理|出し方)',
-        r'(.+?)は(?:どう|どのように|どこに)',
-        r'(.+?)を(?:捨てる|分別|処理)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, query)
+    for pattern in _ITEM_QUERY_PATTERNS:
+        match = pattern.search(query)
         if match:
             return clean_text(match.group(1))
     
@@ -97,29 +137,37 @@ SYNONYMS_MAP = {
     "乾電池": ["電池", "でんち", "バッテリー"],
 }
 
+# 組み込み辞書 + SYNONYMS_FILE（JSON）をオートマトンへコンパイルしたもの
+_synonyms = SynonymDictionary(SYNONYMS_MAP)
+
 def expand_query_with_synonyms(query: str) -> List[str]:
     """
-    クエリを同義語で拡張
+    クエリを同義語で拡張（見出し語→表記揺れ、表記揺れ→見出し語）
     """
-    queries = [query]
-    query_lower = query.lower()
-    
-    # 完全一致での同義語展開
-    for key, synonyms in SYNONYMS_MAP.items():
-        if key in query:
-            for synonym in synonyms:
-                new_query = query.replace(key, synonym)
-                if new_query not in queries:
-                    queries.append(new_query)
-        
-        # 同義語からキーへの展開
-        for synonym in synonyms:
-            if synonym in query:
-                new_query = query.replace(synonym, key)
-                if new_query not in queries:
-                    queries.append(new_query)
-    
-    return queries
+    return _synonyms.expand(query)
+
+# ===== プロンプト =====
+def format_context(docs: List[Document], limit_each: int = 320, max_docs: int = 8) -> str:
+    """参照データ（[候補n] + 本文）"""
+    if not docs:
+        return "関連情報が見つかりませんでした。"
+    chunks = []
+    for i, d in enumerate(docs[:max_docs], start=1):
+        txt = (d.page_content or "").strip()
+        if len(txt) > limit_each:
+            txt = txt[:limit_each] + "…"
+        chunks.append(f"[候補{i}]\n{txt}")
+    return "\n\n".join(chunks)
+
+def build_chat_messages(question: str, context: str) -> List[Dict[str, str]]:
+    """
+    固定のシステムプロンプト → 参照データ → 質問 の順に並べる
+    （変化しにくいものを前に置き、Ollama がプレフィックスの KV キャッシュを再利用できるようにする）
+    """
+    return [
+        {"role": "system", "content": SYSTEM_RAG_JA},
+        {"role": "user", "content": f"参照データ:\n{context}\n\n質問:\n{question}"},
+    ]
 
 # ===== 本体 =====
 class KitakyushuWasteRAGService:
@@ -146,58 +194,204 @@ class KitakyushuWasteRAGService:
         except (ImportError, AttributeError):
             pass
 
-        self.embeddings = OllamaEmbeddings(model=EMBED_MODEL)
+        # 埋め込みキャッシュ（再構築・再アップロード・再起動時に計算済みベクトルを再利用）
+        self.embedding_cache = None
+        if EMBED_CACHE_PATH:
+            try:
+                self.embedding_cache = EmbeddingCache(EMBED_CACHE_PATH)
+            except Exception as e:
+                self.logger.warning(f"埋め込みキャッシュを開けないため無効化します: {e}")
+        base_embeddings = OllamaEmbeddings(model=EMBED_MODEL)
+        if self.embedding_cache is not None:
+            self.embeddings = CachedEmbeddings(base_embeddings, self.embedding_cache, EMBED_MODEL)
+        else:
+            self.embeddings = base_embeddings
+        self.embed_pipeline = EmbeddingPipeline(self.embeddings)
+        # 検索クエリの埋め込みは文書キャッシュを通さず、全バリエーションを1回の embed 呼び出しで行う
+        # （正規化クエリ単位の LRU+TTL キャッシュを挟み、同時の同一クエリは1回にまとめる）
+        self.query_embeddings = QueryEmbeddingCache(base_embeddings, EMBED_MODEL, normalize=clean_text)
+        # 独立したサブ検索を同時に投げるための有界スレッドプール
+        self._retrieval_executor = ThreadPoolExecutor(
+            max_workers=max(2, RETRIEVAL_WORKERS), thread_name_prefix="retrieval"
+        )
+        # 非同期API用: 検索はこのスレッドプールで、生成は AsyncClient で行いイベントループを塞がない
+        self._query_executor = ThreadPoolExecutor(max_workers=max(1, QUERY_WORKERS), thread_name_prefix="rag-query")
+        self._ollama = ollama.AsyncClient()
+        # 非同期APIの生成は同時実行数・待ち行列を制限する（満杯なら 503 + Retry-After）
+        self.llm_scheduler = LLMScheduler()
+        # 同じ質問・同じ検索文脈の生成は実行中の1本に相乗りする
+        self.generations = GenerationFlights()
+        # プレフィル（prompt_eval_count / prompt_eval_duration）の集計
+        self.prefill_stats = PrefillStats()
+        # プロンプトの推定トークン数に合わせた num_ctx の選択
+        self.num_ctx_planner = NumCtxPlanner()
 
-        # 永続化ディレクトリが存在する場合は削除（重複防止とメモリベースに移行）
-        if os.path.isdir(CHROMA_DIR):
-            self.logger.info("既存の永続化ChromaDBを削除してインメモリに移行します。")
-            shutil.rmtree(CHROMA_DIR, ignore_errors=True)
-        
         # 重複防止のためのドキュメント管理
         self.document_ids = set()  # 重複防止用のドキュメントIDセット
-        
+        # 取り込みジョブ（ワーカースレッド）と削除APIの更新処理を直列化
+        self._write_lock = threading.RLock()
+
+        # 文書テーブル（doc_id ⇔ 整数ID）。検索結果の重複除去・融合・再ランキングは整数IDで行う
+        self.doc_table = DocumentTable()
+        # BM25 / 品目名の完全一致索引
+        self.lexical_index = IncrementalBM25Index()
+        # VECTOR_BACKEND=numpy の場合はメモリ上の行列で検索する（Chroma は永続化用に書き込みを続ける）
+        self.vector_index = NumpyVectorIndex() if VECTOR_BACKEND == "numpy" else None
+        self.item_index = ItemIndex(_synonyms.mapping)
+        _synonyms.add_listener(self.item_index.set_synonyms)
+        # 再ランキング用の品目名ID・同義語グループID（取り込み時に1回だけ計算）
+        self.rerank_features = RerankFeatures(clean_text, _synonyms.canonical_id)
+        _synonyms.add_listener(self.rerank_features.regroup)
+        # ハイブリッド検索（BGE-M3 + BM25）の融合。重み・候補の深さは実行中に変更できる
+        self.fusion = FusionEngine()
+        self.hybrid_enabled = False
+        # 段階的検索の段階ごとのヒット率
+        self.stage_stats = StageStats()
+        # 検索結果キャッシュ。インデックスを変更するたびに版数を上げ、古い結果を参照させない
+        self.index_version = 0
+        self.retrieval_cache = RetrievalCache()
+        # 言い換え質問への回答キャッシュ（埋め込みの近さ + 検索上位文書の一致）
+        self.answer_cache = AnswerCache()
+
+        if PERSIST_INDEX:
+            # マニフェスト（ソースファイル → 内容ハッシュ, EMBED_MODEL）を読み込む
+            os.makedirs(CHROMA_DIR, exist_ok=True)
+            manifest = self._open_manifest()
+            model = manifest.embed_model if manifest is not None else None
+            if model != EMBED_MODEL:
+                self.logger.info(
+                    f"EMBED_MODELが変更されたため永続インデックスを作り直します: {model} -> {EMBED_MODEL}"
+                )
+                if manifest is not None:
+                    manifest.close()
+                shutil.rmtree(CHROMA_DIR, ignore_errors=True)
+                os.makedirs(CHROMA_DIR, exist_ok=True)
+                manifest = SourceManifest(self._manifest_path(), EMBED_MODEL)
+            self.manifest = manifest
+            self.document_ids.update(self.manifest.all_doc_ids())
+        else:
+            # 永続化ディレクトリが存在する場合は削除（重複防止とメモリベースに移行）
+            if os.path.isdir(CHROMA_DIR):
+                self.logger.info("既存の永続化ChromaDBを削除してインメモリに移行します。")
+                shutil.rmtree(CHROMA_DIR, ignore_errors=True)
+            # ソース → ID 索引はインメモリモードでも同じものを使う（保存はしない）
+            self.manifest = SourceManifest(":memory:", EMBED_MODEL)
+
         try:
-            # ChromaDBをインメモリで初期化（永続化無効）
-            self.vectorstore = Chroma(
-                embedding_function=self.embeddings
-            )
-            self.logger.info("ChromaDBをインメモリモードで初期化しました（永続化無効）")
+            self.vectorstore = self._new_vectorstore()
+            self.logger.info(f"ChromaDBを初期化しました（{self._mode_label()}）")
         except Exception as e:
             self.logger.error(f"ChromaDB初期化エラー: {e}")
             # 再試行
-            self.vectorstore = Chroma(
-                embedding_function=self.embeddings
-            )
+            self.vectorstore = self._new_vectorstore()
+
+        if PERSIST_INDEX and self.document_ids:
+            # マニフェストとコレクションの食い違い（ディレクトリ破損など）は作り直して回復
+            stored = self.vectorstore._collection.count()
+            if stored != len(self.document_ids):
+                self.logger.warning(
+                    f"マニフェスト({len(self.document_ids)}件)とChroma({stored}件)が一致しないため再構築します"
+                )
+                self.document_ids.clear()
+                self.manifest.clear(EMBED_MODEL)
+                self._reset_vectorstore()
 
-        # BM25とアンサンブルレトリバーの初期化
-        self.bm25_retriever = None
-        self.ensemble_retriever = None
+        # 語彙インデックスは起動時に1回だけ全件構築し、以降は追加・削除分だけ更新する
+        self._init_retrievers()
 
         os.makedirs(DATA_DIR, exist_ok=True)
         self._load_csv_dir()
-        self._init_retrievers()
 
         self.logger.info(
-            f"RAG ready (インメモリモード) | EMBED_MODEL={EMBED_MODEL} | LLM_MODEL={LLM_MODEL} | "
+            f"RAG ready ({self._mode_label()}) | EMBED_MODEL={EMBED_MODEL} | LLM_MODEL={LLM_MODEL} | "
             f"DATA_DIR={DATA_DIR} | 重複防止機能=有効"
         )
 
-    def clear_all_data(self) -> Dict[str, Any]:
-        """全てのデータをクリアする（インメモリなので再初期化）"""
+    # ========= 永続インデックス / マニフェスト =========
+    def _mode_label(self) -> str:
+        return f"永続モード: {CHROMA_DIR}" if PERSIST_INDEX else "インメモリモード"
+
+    def _new_vectorstore(self) -> Chroma:
+        """モードに応じたChromaを生成"""
+        if PERSIST_INDEX:
+            return Chroma(
+                collection_name=CHROMA_COLLECTION,
+                embedding_function=self.embeddings,
+                persist_directory=CHROMA_DIR,
+            )
+        # ChromaDBをインメモリで初期化（永続化無効）
+        return Chroma(embedding_function=self.embeddings)
+
+    def _reset_vectorstore(self) -> None:
+        """ベクトルストアを空にして作り直す（永続モードではコレクションも削除）"""
+        if PERSIST_INDEX:
+            try:
+                self.vectorstore.delete_collection()
+            except Exception as e:
+                self.logger.warning(f"コレクション削除エラー: {e}")
+        self.vectorstore = self._new_vectorstore()
+        # 旧ベクトルストアを参照するレトリバーと語彙インデックスも破棄
+        self._index_clear()
+        self.hybrid_enabled = False
+
+    def _manifest_path(self) -> str:
+        return os.path.join(CHROMA_DIR, MANIFEST_FILE)
+
+    def _open_manifest(self) -> Optional[SourceManifest]:
+        """永続マニフェストを開く（壊れている場合は None を返し、インデックスごと作り直させる）"""
         try:
-            # ドキュメントIDセットをクリア
-            self.document_ids.clear()
-            
-            # ベクトルストアを再初期化
-            self.vectorstore = Chroma(
-                embedding_function=self.embeddings
+            return SourceManifest(
+                self._manifest_path(), EMBED_MODEL, legacy_json=os.path.join(CHROMA_DIR, LEGACY_MANIFEST)
             )
+        except Exception as e:
+            self.logger.warning(f"マニフェスト読み込みエラーのため作り直します: {e}")
+            return None
+
+    @staticmethod
+    def _file_hash(filepath: str) -> str:
+        h = hashlib.md5()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _record_source(self, source: str, doc_ids: List[str], file_hash: str = None) -> None:
+        """ソースが所有するドキュメントIDをマニフェストへ記録（このソースの行だけを書き換える）"""
+        self.manifest.record(source, doc_ids, file_hash)
+
+    def _source_ids(self, source: str) -> Optional[List[str]]:
+        """ソースが所有するID一覧（索引にないソースは None）"""
+        return self.manifest.doc_ids(source)
+
+    def _forget_source(self, source: str) -> None:
+        self.manifest.forget(source)
+
+    def _releasable_ids(self, source: str, ids: Iterable[str]) -> List[str]:
+        """source が手放すIDのうち、他のどのソースも所有していない（削除してよい）もの"""
+        ids = list(ids)
+        elsewhere = self.manifest.owned_elsewhere(source, ids)
+        return [i for i in ids if i not in elsewhere]
+
+    def _delete_ids(self, ids: List[str]) -> None:
+        """ベクトルストアとdocument_idsから指定IDを削除"""
+        if not ids:
+            return
+        self.vectorstore.delete(ids=list(ids))
+        self._index_remove(ids)
+        self.document_ids.difference_update(ids)
+
+    def clear_all_data(self) -> Dict[str, Any]:
+        """全てのデータをクリアする（ベクトルストアとマニフェストを再初期化）"""
+        try:
+            with self._write_lock:
+                # ドキュメントIDセットをクリア
+                self.document_ids.clear()
+
+                # ベクトルストアを再初期化
+                self._reset_vectorstore()
+                self.manifest.clear(EMBED_MODEL)
             
-            # レトリバーもリセット
-            self.bm25_retriever = None
-            self.ensemble_retriever = None
-            
-            self.logger.info("全データをクリアしました（インメモリモード）")
+            self.logger.info(f"全データをクリアしました（{self._mode_label()}）")
             return {"success": True, "message": "全データをクリアしました"}
         except Exception as e:
             self.logger.error(f"データクリアエラー: {e}")
@@ -205,14 +399,16 @@ class KitakyushuWasteRAGService:
 
     def cleanup_on_shutdown(self) -> None:
         """サーバー終了時のクリーンアップ処理"""
+        if PERSIST_INDEX:
+            # 永続モードでは次回起動で再利用するためインデックスを残す
+            self.logger.info("永続モードのためインデックスとCSVを保持します")
+            return
         try:
             self.logger.info("サーバー終了時のクリーンアップを開始します...")
             
             # ベクトルデータベースを初期化
             self.document_ids.clear()
-            self.vectorstore = Chroma(embedding_function=self.embeddings)
-            self.bm25_retriever = None
-            self.ensemble_retriever = None
+            self._reset_vectorstore()
             self.logger.info("ベクトルデータベースを初期化しました")
             
             # ChromaDBディレクトリが存在する場合は削除
@@ -291,60 +487,58 @@ class KitakyushuWasteRAGService:
 
     def remove_documents_by_source(self, source_filename: str) -> Dict[str, Any]:
         """指定されたソースファイルのドキュメントをベクトルデータベースから削除"""
+        with self._write_lock:
+            return self._remove_documents_by_source(source_filename)
+
+    def _remove_documents_by_source(self, source_filename: str) -> Dict[str, Any]:
         try:
             self.logger.info(f"ソースファイル {source_filename} のドキュメント削除を開始")
-            
-            # 現在のドキュメントを取得
-            all_docs = self.vectorstore.get()
-            if not all_docs or not all_docs.get('documents'):
-                self.logger.warning("ベクトルデータベースにドキュメントが存在しません")
+            t0 = time.time()
+
+            # ソース → ID 索引から削除対象を特定（コレクション全件は走査しない）
+            ids_to_remove = self._source_ids(source_filename)
+            if ids_to_remove is None:
+                # 索引にないソース（旧形式で登録されたデータ）はメタデータのwhereフィルタで特定
+                found = self.vectorstore.get(where={"source": source_filename}, include=["metadatas"])
+                found_doc_ids = [(m or {}).get("doc_id") for m in found.get("metadatas") or []]
+                elsewhere = self.manifest.owned_elsewhere(
+                    source_filename, [*found.get("ids", []), *(d for d in found_doc_ids if d)]
+                )
+                ids_to_remove = [i for i in found.get("ids", []) if i not in elsewhere]
+                removed_doc_ids = [d for d in found_doc_ids if d and d not in elsewhere]
+                self.logger.info(f"索引にないためwhereフィルタで特定: {len(ids_to_remove)} 件")
+            else:
+                # 他のソースにも同じ行があるIDは残す
+                ids_to_remove = self._releasable_ids(source_filename, ids_to_remove)
+                removed_doc_ids = ids_to_remove
+
+            if not ids_to_remove:
+                self.logger.warning(f"{source_filename} のドキュメントが存在しません")
+                self._forget_source(source_filename)
                 return {"success": True, "removed_count": 0, "message": "削除対象のドキュメントが見つかりませんでした"}
-            
-            documents = all_docs['documents']
-            metadatas = all_docs.get('metadatas', [])
-            ids = all_docs.get('ids', [])
-            
-            self.logger.info(f"削除前: 総ドキュメント数={len(documents)}, metadata数={len(metadatas)}, ID数={len(ids)}")
-            
-            # 削除対象のIDを特定
-            ids_to_remove = []
-            removed_doc_ids = set()
-            
-            for i, metadata in enumerate(metadatas):
-                if metadata and metadata.get('source') == source_filename:
-                    if i < len(ids):
-                        ids_to_remove.append(ids[i])
-                        self.logger.debug(f"削除対象ID追加: {ids[i]}")
-                        # document_idsからも削除するためのdoc_idを特定
-                        if i < len(documents):
-                            import hashlib
-                            content_hash = hashlib.md5(documents[i].encode('utf-8')).hexdigest()
-                            doc_id = f"content_{content_hash}"
-                            removed_doc_ids.add(doc_id)
-                            self.logger.debug(f"削除対象doc_id追加: {doc_id}")
-            
+
             self.logger.info(f"削除対象: {len(ids_to_remove)} 件のドキュメント")
             
             # ベクトルデータベースから削除
-            if ids_to_remove:
-                try:
-                    self.vectorstore.delete(ids=ids_to_remove)
-                    self.logger.info(f"ベクトルデータベースから {len(ids_to_remove)} 件のドキュメントを削除")
-                except Exception as delete_error:
-                    self.logger.error(f"ベクトルDB削除時エラー: {delete_error}")
-                    # ChromaDBの削除に失敗した場合、全体を再構築
-                    self.logger.info("ベクトルDB削除失敗のため、全体を再構築します")
-                    self._rebuild_vectorstore_without_source(source_filename)
+            try:
+                self.vectorstore.delete(ids=ids_to_remove)
+                self._index_remove(ids_to_remove)
+                self.logger.info(f"ベクトルデータベースから {len(ids_to_remove)} 件のドキュメントを削除")
+            except Exception as delete_error:
+                self.logger.error(f"ベクトルDB削除時エラー: {delete_error}")
+                # ChromaDBの削除に失敗した場合、全体を再構築
+                self.logger.info("ベクトルDB削除失敗のため、全体を再構築します")
+                self._rebuild_vectorstore_without_source(source_filename, ids_to_remove)
                     
             # document_idsセットからも削除
-            removed_count = 0
-            for doc_id in removed_doc_ids:
-                if doc_id in self.document_ids:
-                    self.document_ids.discard(doc_id)
-                    removed_count += 1
+            before = len(self.document_ids)
+            self.document_ids.difference_update(removed_doc_ids)
+            removed_count = before - len(self.document_ids)
             
             self.logger.info(f"document_idsから {removed_count} 件を削除")
-            self.logger.info(f"ソースファイル {source_filename} の削除完了: {len(ids_to_remove)} 件")
+            self._forget_source(source_filename)
+            self._refresh_retrievers()
+            self.logger.info(f"ソースファイル {source_filename} の削除完了: {len(ids_to_remove)} 件 ({(time.time() - t0) * 1000:.1f} ms)")
             
             return {
                 "success": True,
@@ -358,8 +552,8 @@ class KitakyushuWasteRAGService:
             self.logger.error(f"トレースバック: {traceback.format_exc()}")
             return {"success": False, "error": str(e)}
 
-    def _rebuild_vectorstore_without_source(self, exclude_source: str) -> None:
-        """指定されたソースを除外してベクトルストアを再構築"""
+    def _rebuild_vectorstore_without_source(self, exclude_source: str, exclude_ids: Iterable[str]) -> None:
+        """指定されたソースの文書（exclude_ids）を除外してベクトルストアを再構築"""
         try:
             self.logger.info(f"ベクトルストア再構築開始（除外: {exclude_source}）")
             
@@ -372,12 +566,13 @@ class KitakyushuWasteRAGService:
             documents = all_docs['documents']
             metadatas = all_docs.get('metadatas', [])
             
-            # 除外するソース以外のドキュメントを収集
+            # 除外するソース以外のドキュメントを収集（他のソースと共有している文書は残す）
+            exclude_ids = set(exclude_ids)
             keep_docs = []
             keep_doc_ids = set()
             
             for i, metadata in enumerate(metadatas):
-                if metadata and metadata.get('source') != exclude_source:
+                if metadata and metadata.get('doc_id') not in exclude_ids:
                     if i < len(documents):
                         doc_content = documents[i]
                         # Document オブジェクトを作成
@@ -391,17 +586,18 @@ class KitakyushuWasteRAGService:
                         keep_doc_ids.add(doc_id)
             
             # 新しいベクトルストアを作成
-            self.vectorstore = Chroma(embedding_function=self.embeddings)
+            self._reset_vectorstore()
             
             # ドキュメントを再追加
             if keep_docs:
-                self.vectorstore.add_documents(keep_docs)
+                self._add_documents(keep_docs)
                 self.logger.info(f"ベクトルストア再構築完了: {len(keep_docs)} 件のドキュメントを保持")
             else:
                 self.logger.info("保持するドキュメントがないため、空のベクトルストアを作成")
             
             # document_idsを更新
             self.document_ids = keep_doc_ids
+            self._forget_source(exclude_source)
             self.logger.info(f"document_ids更新完了: {len(self.document_ids)} 件")
             
         except Exception as e:
@@ -411,61 +607,147 @@ class KitakyushuWasteRAGService:
 
     # ========= CSV 読み込み =========
     def _row_to_text(self, row: pd.Series) -> str:
-        item  = row.get("品名") or row.get("品目") or row.get("item") or ""
-        how   = row.get("出し方") or row.get("処理方法") or row.get("how") or ""
-        note  = row.get("備考") or row.get("注意") or row.get("note") or ""
-        area  = row.get("エリア") or row.get("地区") or row.get("area") or ""
-        return "\n".join([
-            f"品目: {str(item).strip()}",
-            f"出し方: {str(how).strip()}",
-            f"備考: {str(note).strip()}",
-            f"エリア: {str(area).strip()}",
-        ]).strip()
+        # 一括取り込みは csv_loader の列単位変換を使う。ここは単発処理用
+        return row_to_text(row)
 
     def _generate_document_id(self, text: str, source: str) -> str:
         """ドキュメントの一意IDを生成（重複防止用）
         内容ベースでの重複判定を行うため、ファイル名は除外
         """
-        import hashlib
         # ファイル名を除外して、内容のみでハッシュを生成
-        content_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-        return f"content_{content_hash}"
+        return document_id(text)
+
+    def _chroma_ids(self, docs: List[Document]) -> List[str]:
+        """Chroma側のIDを内容ハッシュ（doc_id）に揃える"""
+        return [
+            (d.metadata or {}).get("doc_id") or self._generate_document_id(d.page_content, "")
+            for d in docs
+        ]
+
+    def _add_documents(
+        self,
+        docs: List[Document],
+        progress: Optional[Callable[[str, int], None]] = None,
+    ) -> Dict[str, Any]:
+        """埋め込みパイプライン経由でドキュメントをベクトルストアへ追加
+        progress(段階, 件数) は "rows_embedded" / "rows_indexed" の増分で呼ばれる
+        """
+        ids = self._chroma_ids(docs)
+        texts = [d.page_content for d in docs]
+        metadatas = [d.metadata or {} for d in docs]
+        written = [0]
+
+        def sink(start: int, vectors: List[List[float]]) -> None:
+            end = start + len(vectors)
+            if progress:
+                progress("rows_embedded", len(vectors))
+            self.vectorstore._collection.upsert(
+                ids=ids[start:end],
+                embeddings=vectors,
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+            )
+            self._index_add(zip(ids[start:end], docs[start:end]), vectors)
+            written[0] += len(vectors)
+            if progress:
+                progress("rows_indexed", len(vectors))
+
+        try:
+            return self.embed_pipeline.run(texts, sink)
+        except Exception:
+            # 書き込めなかった分は次回の取り込みで再試行できるようにIDを戻す
+            stored = set(self.vectorstore.get(ids=ids, include=[])["ids"]) if written[0] else set()
+            self.document_ids.difference_update(i for i in ids if i not in stored)
+            raise
 
-    def add_csv(self, filepath: str) -> Dict[str, Any]:
+    def add_csv(
+        self,
+        filepath: str,
+        progress: Optional[Callable[[Dict[str, int]], None]] = None,
+    ) -> Dict[str, Any]:
+        """CSVを取り込む。progress には処理済み件数（rows_parsed / rows_embedded / rows_indexed）が渡される"""
+        with self._write_lock:
+            return self._add_csv(filepath, progress)
+
+    def _add_csv(
+        self,
+        filepath: str,
+        progress: Optional[Callable[[Dict[str, int]], None]] = None,
+    ) -> Dict[str, Any]:
         if not os.path.exists(filepath):
             return {"success": False, "error": f"CSVが見つかりません: {filepath}"}
-        try:
-            df = pd.read_csv(filepath, encoding="utf-8")
-        except UnicodeDecodeError:
-            df = pd.read_csv(filepath, encoding="cp932")
 
-        docs: List[Document] = []
+        source = os.path.basename(filepath)
+        file_hash = None
+        if PERSIST_INDEX:
+            file_hash = self._file_hash(filepath)
+            if self.manifest.file_hash(source) == file_hash:
+                self.logger.info(f"CSV未変更のため埋め込みをスキップ: {filepath} | 既存文書数={len(self._source_ids(source) or [])}")
+                return {"success": True, "count": 0, "duplicates": 0, "unchanged": True}
+
+        # 文字コードは1回だけ判定し、chunksize単位で読み込み・埋め込みを行う
+        encoding = detect_encoding(filepath)
+        added = 0
         duplicates = 0
+        owned_ids = set(self._source_ids(source) or [])
+        kept_ids: List[str] = []
+        counts = {"rows_parsed": 0, "rows_embedded": 0, "rows_indexed": 0}
+
+        def report(stage: str, n: int) -> None:
+            counts[stage] += n
+            if progress:
+                progress(dict(counts))
+
+        completed = False
+        try:
+            for texts, doc_ids in iter_csv_documents(filepath, encoding=encoding):
+                report("rows_parsed", len(texts))
+                docs: List[Document] = []
+                for text, doc_id in zip(texts, doc_ids):
+                    if not text:
+                        continue
+                    # このファイルが所有する行として記録する（他のファイルと同じ行も共有で所有する）
+                    kept_ids.append(doc_id)
+                    # 重複チェック（前回取り込み済みの行・他のファイルの同じ行はここでスキップされる）
+                    if doc_id in self.document_ids:
+                        duplicates += 1
+                        continue
+
+                    # 新しいドキュメントとして追加
+                    self.document_ids.add(doc_id)
+                    docs.append(Document(
+                        page_content=text,
+                        metadata={"source": source, "doc_id": doc_id}
+                    ))
+                if docs:
+                    self._add_documents(docs, progress=report)
+                    added += len(docs)
+            completed = True
+        finally:
+            if not completed:
+                # 途中で失敗した場合も、書き込み済みの行は所有を記録して削除・再取り込みの対象に残す
+                # （ハッシュは記録しないので次回は再取り込みされる。旧来の所有分はまだ除去しない）
+                written = [i for i in dict.fromkeys([*owned_ids, *kept_ids]) if i in self.document_ids]
+                self._record_source(source, written)
+                if added:
+                    self._refresh_retrievers()
+
+        # 前回から消えた行（変更・削除された行）をインデックスから除去（他のファイルにもある行は残す）
+        stale_ids = self._releasable_ids(source, owned_ids.difference(kept_ids))
+        if stale_ids:
+            self._delete_ids(stale_ids)
+            self.logger.info(f"変更・削除された行をインデックスから除去: {source} | {len(stale_ids)} 件")
         
-        for _, row in df.iterrows():
-            text = self._row_to_text(row)
-            if text:
-                source = os.path.basename(filepath)
-                doc_id = self._generate_document_id(text, source)
-                
-                # 重複チェック
-                if doc_id in self.document_ids:
-                    duplicates += 1
-                    continue
-                
-                # 新しいドキュメントとして追加
-                self.document_ids.add(doc_id)
-                docs.append(Document(
-                    page_content=text, 
-                    metadata={"source": source, "doc_id": doc_id}
-                ))
-        
-        if docs:
-            self.vectorstore.add_documents(docs)
-            # CSVが追加されたらレトリバーを再初期化
-            self._init_retrievers()
-            self.logger.info(f"CSV取り込み完了: {filepath} | 新規文書数={len(docs)} | 重複スキップ={duplicates} | ハイブリッド検索を再初期化")
-            return {"success": True, "count": len(docs), "duplicates": duplicates}
+        # ソース → ID 索引はインメモリモードでも保持する（保存は永続モードのみ）
+        self._record_source(source, list(dict.fromkeys(kept_ids)), file_hash)
+
+        if added or stale_ids:
+            # 語彙インデックスは差分更新済み。ハイブリッド検索が未構築なら用意する
+            self._refresh_retrievers()
+
+        if added:
+            self.logger.info(f"CSV取り込み完了: {filepath} ({encoding}) | 新規文書数={added} | 重複スキップ={duplicates} | 語彙インデックス文書数={len(self.lexical_index)}")
+            return {"success": True, "count": added, "duplicates": duplicates}
         
         if duplicates > 0:
             self.logger.info(f"CSV処理完了: {filepath} | 全て重複データでした | 重複スキップ={duplicates}")
@@ -473,201 +755,347 @@ class KitakyushuWasteRAGService:
         
         return {"success": True, "count": 0}
 
+    def add_text(self, text: str, source: str) -> Dict[str, Any]:
+        """テキスト全文を1文書として追加"""
+        text = text or ""
+        doc_id = self._generate_document_id(text, source)
+        with self._write_lock:
+            if doc_id in self.document_ids:
+                return {"success": True, "count": 0, "duplicates": 1}
+
+            # 同名ファイルの再アップロードは以前の内容を置き換える（他のソースにもある文書は残す）
+            self._delete_ids(self._releasable_ids(source, self._source_ids(source) or []))
+            self.document_ids.add(doc_id)
+            self._add_documents([Document(page_content=text, metadata={"source": source, "doc_id": doc_id})])
+            self._record_source(source, [doc_id])
+            self._refresh_retrievers()
+        return {"success": True, "count": 1, "duplicates": 0}
+
     def _load_csv_dir(self) -> None:
+        # 永続モード: DATA_DIRから消えたソースの文書をインデックスから除去
+        for source in self.manifest.sources():
+            if not os.path.exists(os.path.join(DATA_DIR, source)):
+                stale = self._releasable_ids(source, self._source_ids(source) or [])
+                self.logger.info(f"ファイルが存在しないためインデックスから除去: {source} | {len(stale)} 件")
+                self._delete_ids(stale)
+                self._forget_source(source)
+
         total = 0
         for fn in os.listdir(DATA_DIR):
             if fn.lower().endswith(".csv"):
                 res = self.add_csv(os.path.join(DATA_DIR, fn))
                 total += int(res.get("count", 0))
-        self.logger.info(f"初期CSV取り込み完了: {total} 文書")
+        self.logger.info(f"初期CSV取り込み完了: 新規埋め込み {total} 文書 | 総文書数 {len(self.document_ids)}")
 
     def _init_retrievers(self) -> None:
-        """BM25とアンサンブルレトリバーを初期化"""
+        """ベクトルストアの全件から語彙インデックスを構築し、ハイブリッド検索を初期化（起動時・復旧用）"""
         try:
-            # ベクトルストアから全ドキュメントを取得
-            all_docs = self.vectorstore.get()
+            self._index_clear()
+            self.hybrid_enabled = False
+            include = ["documents", "metadatas"] + (["embeddings"] if self.vector_index is not None else [])
+            all_docs = self.vectorstore.get(include=include)
             if all_docs and all_docs.get('documents'):
-                # Documentオブジェクトのリストを作成
-                documents = [Document(page_content=doc) for doc in all_docs['documents']]
-                
-                # BM25レトリバーを初期化
-                if len(documents) > 0:
-                    self.bm25_retriever = BM25Retriever.from_documents(documents)
-                    self.bm25_retriever.k = DEFAULT_K
-                    
-                    # ベクトルストアのレトリバー
-                    vector_retriever = self.vectorstore.as_retriever(search_kwargs={"k": DEFAULT_K})
-                    
-                    # アンサンブルレトリバー（BGE-M3ベクトル検索とBM25を組み合わせ）
-                    # 重み: BGE-M3=0.6, BM25=0.4 (セマンティック検索を重視)
-                    self.ensemble_retriever = EnsembleRetriever(
-                        retrievers=[vector_retriever, self.bm25_retriever],
-                        weights=[0.6, 0.4]  # BGE-M3を重視したハイブリッド検索
-                    )
-                    
-                    self.logger.info(f"ハイブリッド検索を初期化しました (BGE-M3 + BM25)。ドキュメント数: {len(documents)}")
-                    self.logger.info(f"重み設定 - BGE-M3: 0.6, BM25: 0.4")
-                else:
-                    self.logger.warning("ドキュメントが見つからないため、BM25レトリバーは初期化されませんでした。")
-            else:
-                self.logger.warning("ベクトルストアにドキュメントがないため、BM25レトリバーは初期化されませんでした。")
-                # 空の場合でもレトリバーを後で再初期化できるようにNoneを設定
-                self.bm25_retriever = None
-                self.ensemble_retriever = None
+                metadatas = all_docs.get('metadatas') or [None] * len(all_docs['documents'])
+                self._index_add(
+                    [
+                        (doc_key, Document(page_content=text, metadata=meta or {}))
+                        for doc_key, text, meta in zip(all_docs['ids'], all_docs['documents'], metadatas)
+                    ],
+                    all_docs.get('embeddings'),
+                )
+            self._refresh_retrievers()
         except Exception as e:
             self.logger.error(f"レトリバー初期化エラー: {e}")
-            self.bm25_retriever = None
-            self.ensemble_retriever = None
+            self.hybrid_enabled = False
+
+    # ----- ベクトルストア以外の索引（語彙・品目名）の同期 -----
+    def _bump_index_version(self) -> None:
+        self.index_version += 1
+
+    def _index_add(self, items, vectors=None) -> None:
+        items = list(items)
+        doc_ids = self.doc_table.add_many(items)
+        self.lexical_index.add_many(items)
+        self.item_index.add_many(items)
+        self.rerank_features.add_many(doc_ids, (doc for _, doc in items))
+        if self.vector_index is not None and vectors is not None:
+            self.vector_index.add_many(items, vectors)
+        self._bump_index_version()
+
+    def _index_remove(self, keys) -> None:
+        keys = list(keys)
+        self.rerank_features.remove_many(self.doc_table.remove_many(keys))
+        self.lexical_index.remove_many(keys)
+        self.item_index.remove_many(keys)
+        if self.vector_index is not None:
+            self.vector_index.remove_many(keys)
+        self._bump_index_version()
+
+    def _index_clear(self) -> None:
+        self.doc_table.clear()
+        self.lexical_index.clear()
+        self.item_index.clear()
+        self.rerank_features.clear()
+        if self.vector_index is not None:
+            self.vector_index.clear()
+        self._bump_index_version()
+
+    def _refresh_retrievers(self) -> None:
+        """語彙インデックスの件数に合わせてハイブリッド検索を有効化・無効化する（全件再構築はしない）"""
+        if len(self.lexical_index) == 0:
+            if self.hybrid_enabled:
+                self.logger.warning("ドキュメントがないため、ハイブリッド検索を無効化しました。")
+            self.hybrid_enabled = False
+            self._bump_index_version()
+            return
+        if self.hybrid_enabled:
+            return
+
+        self.hybrid_enabled = True
+        self._bump_index_version()
+
+        config = self.fusion.config()
+        self.logger.info(f"ハイブリッド検索を初期化しました (BGE-M3 + BM25)。ドキュメント数: {len(self.lexical_index)}")
+        self.logger.info(
+            f"融合設定 - 方式: {config['method']}, 重み: {config['weights']}, 候補数: {config['depths']}"
+        )
+
+    def configure_fusion(self, **changes) -> Dict[str, Any]:
+        """融合の方式・重み・候補の深さ・RRF定数を実行中に変更する（検索結果キャッシュは版数で無効化される）"""
+        try:
+            config = self.fusion.configure(**changes)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        self.logger.info(f"融合設定を変更しました: {config}")
+        return {"success": True, "fusion": config}
+
+    # ========= バッチ検索 =========
+    def _vector_search_many(self, queries: List[str], k: int) -> List[Ranked]:
+        """全クエリを1回の embed 呼び出しで埋め込み、1回の複数クエリ検索を行う（NumPy索引 または Chroma）"""
+        if not queries:
+            return []
+        t0 = time.time()
+        vectors = self.query_embeddings.embed_documents(queries)
+        if self.vector_index is not None:
+            hits = self.vector_index.search_many_keys_with_scores(vectors, k)
+        else:
+            # IDと距離だけ受け取り、本文・メタデータは文書テーブルから引く
+            res = self.vectorstore._collection.query(query_embeddings=vectors, n_results=k, include=["distances"])
+            # 正規化済み埋め込みの二乗L2距離 → コサイン類似度
+            hits = [
+                (keys, 1.0 - np.asarray(dists, dtype=np.float64) / 2.0)
+                for keys, dists in zip(res.get("ids") or [], res.get("distances") or [])
+            ]
+        self.fusion.record_timing("vector", time.time() - t0)
+        return [self.doc_table.ids_with_scores(keys, scores) for keys, scores in hits]
+
+    def _lexical_search(self, query: str, k: int) -> Ranked:
+        t0 = time.time()
+        keys, scores = self.lexical_index.search_keys_with_scores(query, k)
+        self.fusion.record_timing("lexical", time.time() - t0)
+        return self.doc_table.ids_with_scores(keys, scores)
+
+    def _hybrid_search_many(
+        self, queries: List[str], k: int, lexical: Optional[Dict[str, Ranked]] = None
+    ) -> Dict[str, Ranked]:
+        """
+        クエリごとのハイブリッド検索結果（文書テーブルの整数ID配列, 0〜1の融合スコア）
+        ベクトル一括検索とクエリごとのBM25を同時に実行し、全件そろうか締め切りを過ぎた時点で融合する
+        lexical に前段で検索済みの BM25 結果があれば、そのクエリの BM25 は再実行しない
+        """
+        if not queries:
+            return {}
+        hybrid = self.hybrid_enabled
+        # ハイブリッド時はレトリバーごとの候補の深さ、ベクトルのみの時は k 件
+        n_vec = self.fusion.depth("vector", DEFAULT_K) if hybrid else k
+        n_lex = self.fusion.depth("lexical", DEFAULT_K)
+
+        t0 = time.time()
+        vector_future = self._retrieval_executor.submit(self._vector_search_many, queries, n_vec)
+        lexical_futures = {}
+        lexical = lexical or {}
+        if hybrid:
+            lexical_futures = {
+                query: self._retrieval_executor.submit(self._lexical_search, query, n_lex)
+                for query in queries if query not in lexical
+            }
+        _, pending = wait([vector_future, *lexical_futures.values()], timeout=RETRIEVAL_DEADLINE)
+        if pending:
+            self.logger.warning(
+                f"Retrieval deadline ({RETRIEVAL_DEADLINE:.1f}s) exceeded: {len(pending)} sub-searches dropped"
+            )
+            for future in pending:
+                future.cancel()
+
+        def result_of(future, label: str, default):
+            if future in pending:
+                return default
+            try:
+                return future.result()
+            except Exception as e:
+                self.logger.warning(f"{label} failed: {e}")
+                return default
+
+        no_docs = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        vector_lists = result_of(vector_future, f"Batched vector search ({len(queries)} queries)", None)
+        if vector_lists is None:
+            vector_lists = [no_docs for _ in queries]
+
+        if not hybrid:
+            self.logger.warning("Hybrid search not available, using vector search only")
+            return {query: self.fusion.fuse({"vector": ranked}) for query, ranked in zip(queries, vector_lists)}
+
+        results = {}
+        for query, vector_ranked in zip(queries, vector_lists):
+            if query in lexical:
+                lexical_ranked = lexical[query]
+            else:
+                lexical_ranked = result_of(lexical_futures[query], f"BM25 search for '{query}'", no_docs)
+            results[query] = self.fusion.fuse({"vector": vector_ranked, "lexical": lexical_ranked})
+        self.logger.info(
+            f"Parallel hybrid search: {len(queries)} queries | {(time.time() - t0) * 1000:.1f} ms"
+        )
+        return results
 
     # ========= 検索（強化版） =========
     def _format_docs(self, docs: List[Document], limit_each: int = 320, max_docs: int = 8) -> str:
-        if not docs:
-            return "関連情報が見つかりませんでした。"
-        chunks = []
-        for i, d in enumerate(docs[:max_docs], start=1):
-            txt = (d.page_content or "").strip()
-            if len(txt) > limit_each:
-                txt = txt[:limit_each] + "…"
-            chunks.append(f"[候補{i}]\n{txt}")
-        return "\n\n".join(chunks)
+        return format_context(docs, limit_each, max_docs)
 
     def similarity_search(self, query: str, k: int = DEFAULT_K) -> List[Document]:
+        doc_ids, _ = self._search(query, k)
+        return self.doc_table.docs(doc_ids)
+
+    def similarity_search_with_scores(self, query: str, k: int = DEFAULT_K) -> List[Tuple[Document, float]]:
+        """検索結果と融合スコア（0〜1、品目名の完全一致は 1.0）"""
+        doc_ids, scores = self._search(query, k)
+        return self.doc_table.docs_with_scores(doc_ids.tolist(), scores.tolist())
+
+    def _search(self, query: str, k: int) -> Ranked:
         k = max(K_MIN, min(k or DEFAULT_K, K_MAX))
         q_clean = clean_text(query)
-        
-        # 同義語拡張クエリを生成
-        expanded_queries = expand_query_with_synonyms(q_clean)
-        self.logger.info(f"Expanded queries: {expanded_queries}")
-        
+        if not self.retrieval_cache.enabled:
+            return self._similarity_search(q_clean, k)
+
+        # 同一インデックス版・同一辞書版・同一融合設定での同じ検索は、埋め込み・検索を行わずに前回の順位を返す
+        _synonyms.maybe_reload()
+        cache_key = (q_clean, k, self.index_version, _synonyms.version, self.fusion.version)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            # 同じ版数である限り整数IDは同じ文書を指す
+            self.logger.info(f"Retrieval cache hit for '{q_clean}' (k={k}, version={cache_key[2]})")
+            return np.asarray(cached[0], dtype=np.int64), np.asarray(cached[1], dtype=np.float64)
+
+        doc_ids, scores = self._similarity_search(q_clean, k)
+        # 検索中に取り込み・削除・設定変更が走った場合は、どちらの版の結果か分からないため保存しない
+        if cache_key[2:] == (self.index_version, _synonyms.version, self.fusion.version):
+            self.retrieval_cache.put(cache_key, (doc_ids.tolist(), scores.tolist()))
+        return doc_ids, scores
+
+    def _similarity_search(self, q_clean: str, k: int) -> Ranked:
+        """
+        検索結果（文書テーブルの整数ID配列, 融合スコア配列、上位k件）
+        安い段階から順に実行し、品目名の合う候補の融合スコアが閾値に達したらそこで打ち切る
+        （exact → lexical → hybrid → expansion → item。retrieval_planner.py 参照）
+        """
         item_q = extract_item_like(q_clean)
-        
-        # ハイブリッド検索（BGE-M3 + BM25）を実行
-        all_docs = []
-        
-        # アンサンブルレトリバーが利用可能な場合はそれを使用（メイン検索）
-        if self.ensemble_retriever is not None:
-            for expanded_query in expanded_queries:
-                try:
-                    docs = self.ensemble_retriever.get_relevant_documents(expanded_query)
-                    all_docs.extend(docs)
-                    self.logger.info(f"Hybrid search (BGE-M3 + BM25) returned {len(docs)} documents for query: {expanded_query}")
-                except Exception as e:
-                    self.logger.warning(f"Ensemble retriever failed for '{expanded_query}': {e}")
-                    # フォールバックとしてベクトル検索のみを実行
-                    try:
-                        docs_fallback = self.vectorstore.similarity_search(expanded_query, k=k)
-                        all_docs.extend(docs_fallback)
-                        self.logger.info(f"Fallback vector search returned {len(docs_fallback)} documents")
-                    except Exception as e2:
-                        self.logger.error(f"Fallback vector search also failed: {e2}")
-        else:
-            self.logger.warning("Ensemble retriever not available, using vector search only")
-            # アンサンブルレトリバーが利用できない場合はベクトル検索のみ
-            for expanded_query in expanded_queries:
-                try:
-                    docs_main = self.vectorstore.similarity_search(expanded_query, k=k)
-                    all_docs.extend(docs_main)
-                    self.logger.info(f"Vector-only search returned {len(docs_main)} documents for query: {expanded_query}")
-                except Exception as e:
-                    self.logger.warning(f"Vector search failed for '{expanded_query}': {e}")
-
-        def item_match_score(txt: str, item: str) -> int:
-            if not txt:
-                return 0
-            m = re.search(r"品目:\s*(.+)", txt)
-            name = (m.group(1) if m else "").strip()
-            if not name:
-                return 0
-            n1 = clean_text(name)
-            n2 = clean_text(item)
-            
-            # 同義語も考慮したマッチング
-            if n1 == n2:
-                return 3
-            
-            # 同義語チェック
-            for key, synonyms in SYNONYMS_MAP.items():
-                if (n1 == key and n2 in synonyms) or (n2 == key and n1 in synonyms):
-                    return 2
-                if n1 in synonyms and n2 in synonyms:
-                    return 2
-            
-            return 1 if (n2 and (n2 in n1 or n1 in n2)) else 0
+        no_docs = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+        def merge(parts: List[Ranked]) -> Ranked:
+            if not parts:
+                return no_docs
+            return unique_max(np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]))
 
-        def rerank_by_item(docs, item):
-            return sorted(docs, key=lambda d: item_match_score((d.page_content or ""), item), reverse=True)
+        def rerank_by_item(ranked: Ranked, item: str) -> Ranked:
+            ids, fused = ranked
+            order = np.argsort(-self.rerank_features.scores(ids, item), kind="stable")
+            return ids[order], fused[order]
 
-        def poor(dlist: List[Document], item_hint: str) -> bool:
-            if not dlist:
+        def poor(ids: np.ndarray, item_hint: str) -> bool:
+            if ids.size == 0:
                 return True
-            heads = sum(1 for d in dlist if "品目:" in (d.page_content or ""))
-            has_item = any(item_match_score((d.page_content or ""), item_hint) > 0 for d in dlist)
-            return heads < max(1, len(dlist)//3) or not has_item
-
-        def merge_dedup(lists):
-            seen = set()
-            out = []
-            for lst in lists:
-                for d in lst or []:
-                    key = ((d.page_content or "").strip(), json.dumps(getattr(d, "metadata", {}), ensure_ascii=False, sort_keys=True))
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    out.append(d)
-            return out
-
-        def merge_dedup(lists):
-            seen = set()
-            out = []
-            for lst in lists:
-                for d in lst or []:
-                    key = ((d.page_content or "").strip(), json.dumps(getattr(d, "metadata", {}), ensure_ascii=False, sort_keys=True))
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    out.append(d)
-            return out
+            heads = int(self.rerank_features.has_heading(ids).sum())
+            has_item = bool((self.rerank_features.scores(ids, item_hint) > 0).any())
+            return heads < max(1, ids.size // 3) or not has_item
 
-        # 重複を除去
-        all_docs = merge_dedup([all_docs])
-        all_docs = rerank_by_item(all_docs, item_q)
-        
-        # 十分な結果が得られた場合はここで終了
-        if not poor(all_docs, item_q) and len(all_docs) >= k//2:
-            self.logger.info(f"Hybrid search completed successfully with {len(all_docs[:k])} documents")
-            return all_docs[:k]
-
-        # 追加検索（アイテム名での検索）- ハイブリッド検索で実行
-        if item_q:
-            # アイテム名も同義語拡張
-            expanded_items = expand_query_with_synonyms(item_q)
-            for expanded_item in expanded_items:
-                if self.ensemble_retriever is not None:
-                    try:
-                        docs_item = self.ensemble_retriever.get_relevant_documents(expanded_item)
-                        all_docs.extend(docs_item)
-                        self.logger.info(f"Hybrid item search returned {len(docs_item)} documents for: {expanded_item}")
-                    except Exception as e:
-                        self.logger.warning(f"Hybrid item search failed for '{expanded_item}': {e}")
-                        # フォールバック
-                        try:
-                            docs_item = self.vectorstore.similarity_search(expanded_item, k=k)
-                            all_docs.extend(docs_item)
-                        except Exception as e2:
-                            self.logger.warning(f"Fallback item search failed for '{expanded_item}': {e2}")
-                else:
-                    try:
-                        docs_item = self.vectorstore.similarity_search(expanded_item, k=k)
-                        all_docs.extend(docs_item)
-                    except Exception as e:
-                        self.logger.warning(f"Vector item search failed for '{expanded_item}': {e}")
+        def confidence(ranked: Ranked) -> float:
+            """品目名の合う（一致・同じ同義語グループ・部分一致）候補の融合スコアの最大値"""
+            ids, fused = ranked
+            if ids.size == 0:
+                return 0.0
+            if item_q:
+                fused = fused[self.rerank_features.scores(ids, item_q) > 0]
+            return float(fused.max()) if fused.size else 0.0
+
+        def finish(stage: str, ranked: Ranked, conf: float) -> Ranked:
+            self.logger.info(
+                f"Retrieval stage '{stage}' accepted {min(ranked[0].size, k)} documents (confidence {conf:.3f})"
+            )
+            if self.stage_stats.record(stage):
+                self.logger.info(f"Retrieval stage hit rates: {self.stage_stats.summary()}")
+            return ranked[0][:k], ranked[1][:k]
+
+        def accept(stage: str, ranked: Ranked) -> Tuple[bool, float]:
+            conf = confidence(ranked)
+            enough = not poor(ranked[0], item_q) and ranked[0].size >= k // 2
+            if not PLANNER_EARLY_EXIT:
+                # 無効時は従来どおり、同義語展開の結果が十分かどうかだけで品目名の再検索を判断する
+                return enough and stage == "expansion", conf
+            return enough and conf >= stage_threshold(stage, self.fusion.config()["weights"]), conf
+
+        # 1. 品目名が完全一致すれば、その行をそのまま返す（同義語拡張・ハイブリッド検索を省略）
+        exact = self.item_index.lookup(item_q)
+        if exact:
+            self.logger.info(f"Exact item match for '{item_q}': {len(exact)} documents")
+            doc_ids = self.doc_table.ids_of(self._chroma_ids(exact[:k]))
+            return finish("exact", (doc_ids, np.ones(doc_ids.size, dtype=np.float64)), 1.0)
+
+        # 2. 元クエリの BM25 のみ（埋め込み不要）
+        lexical: Dict[str, Ranked] = {}
+        if self.hybrid_enabled:
+            lexical[q_clean] = self._lexical_search(q_clean, self.fusion.depth("lexical", DEFAULT_K))
+            ranked = rerank_by_item(self.fusion.fuse({"lexical": lexical[q_clean]}), item_q)
+            ok, conf = accept("lexical", ranked)
+            if ok:
+                return finish("lexical", ranked, conf)
+
+        # 3. 元クエリのハイブリッド検索（BM25 は前段の結果を使う）
+        main = self._hybrid_search_many([q_clean], k, lexical).get(q_clean, no_docs)
+        self.logger.info(f"Hybrid search returned {main[0].size} documents for query: {q_clean}")
+        ranked = rerank_by_item(main, item_q)
+        ok, conf = accept("hybrid", ranked)
+        if ok:
+            return finish("hybrid", ranked, conf)
+
+        # 4. 同義語展開クエリ（元クエリ以外を1回の埋め込み・1回のベクトル検索で処理）
+        expanded_queries = expand_query_with_synonyms(q_clean)
+        self.logger.info(f"Expanded queries: {expanded_queries}")
+        variants = [q for q in expanded_queries if q != q_clean]
+        results = self._hybrid_search_many(variants, k)
+        parts = [main]
+        for expanded_query in variants:
+            part = results.get(expanded_query, no_docs)
+            parts.append(part)
+            self.logger.info(f"Hybrid search returned {part[0].size} documents for query: {expanded_query}")
+
+        # 重複を除去（初出順、スコアは最大値）して品目名で再ランキング
+        ranked = rerank_by_item(merge(parts), item_q)
+        ok, conf = accept("expansion", ranked)
+        if ok:
+            return finish("expansion", ranked, conf)
+
+        # 5. 品目名（とその同義語）での再検索。検索済みのクエリは結果を使い回す
+        expanded_items = expand_query_with_synonyms(item_q) if item_q else []
+        searched = {q_clean: main, **results}
+        item_results = self._hybrid_search_many([q for q in expanded_items if q not in searched], k)
+        parts = [ranked]
+        for expanded_item in expanded_items:
+            part = searched.get(expanded_item, item_results.get(expanded_item, no_docs))
+            parts.append(part)
+            self.logger.info(f"Hybrid item search returned {part[0].size} documents for: {expanded_item}")
 
         # 最終的な重複除去とランキング
-        final_docs = merge_dedup([all_docs])
-        final_docs = rerank_by_item(final_docs, item_q)
-        
-        self.logger.info(f"Final hybrid search result: {len(final_docs[:k])} documents")
-        return final_docs[:k]
+        ranked = rerank_by_item(merge(parts), item_q)
+        return finish("item", ranked, confidence(ranked))
 
     def format_documents(self, docs: List[Document], limit_each: int = 150) -> str:
         return self._format_docs(docs, limit_each)
@@ -676,15 +1104,45 @@ class KitakyushuWasteRAGService:
         """検索システムの情報を返す"""
         info = {
             "embedding_model": EMBED_MODEL,
-            "vector_store": "ChromaDB (In-Memory)",
-            "persistence": "Disabled",
+            "vector_store": "ChromaDB (Persistent)" if PERSIST_INDEX else "ChromaDB (In-Memory)",
+            "persistence": "Enabled" if PERSIST_INDEX else "Disabled",
             "deduplication": "Enabled",
-            "bm25_available": self.bm25_retriever is not None,
-            "hybrid_search_available": self.ensemble_retriever is not None,
+            "bm25_available": len(self.lexical_index) > 0,
+            "hybrid_search_available": self.hybrid_enabled,
             "total_documents": 0,
             "unique_document_ids": len(self.document_ids),
-            "vectorstore_document_count": 0  # 実際のベクトルストアのドキュメント数
+            "vectorstore_document_count": 0,  # 実際のベクトルストアのドキュメント数
+            "embedding_cache": None,
+            "query_embedding_cache": self.query_embeddings.stats(),
+            "index_version": self.index_version,
+            "retrieval_cache": self.retrieval_cache.stats(),
+            "answer_cache": self.answer_cache.stats(),
+            "lexical_index": self.lexical_index.stats(),
+            "fusion": self.fusion.stats(),
+            "retrieval_planner": self.stage_stats.stats(),
+            "llm_queue": self.llm_scheduler.stats(),
+            "generation_flights": self.generations.stats(),
+            "llm_prefill": self.prefill_stats.stats(),
+            "llm_context": {
+                "token_budget": CONTEXT_TOKEN_BUDGET,
+                "max_docs": CONTEXT_MAX_DOCS,
+                "max_doc_tokens": CONTEXT_MAX_DOC_TOKENS,
+                "min_score_ratio": CONTEXT_MIN_SCORE_RATIO,
+                "num_predict": LLM_NUM_PREDICT,
+                "num_ctx": self.num_ctx_planner.stats(),
+            },
+            "vector_backend": VECTOR_BACKEND if self.vector_index is not None else "chroma",
+            "vector_index": self.vector_index.stats() if self.vector_index is not None else None,
+            "item_index": self.item_index.stats(),
+            "rerank_features": self.rerank_features.stats(),
+            "synonyms": _synonyms.stats(),
         }
+
+        if self.embedding_cache is not None:
+            try:
+                info["embedding_cache"] = self.embedding_cache.stats(EMBED_MODEL)
+            except Exception as e:
+                self.logger.warning(f"Failed to get embedding cache stats: {e}")
         
         try:
             all_docs = self.vectorstore.get()
@@ -702,8 +1160,9 @@ class KitakyushuWasteRAGService:
             info["data_inconsistency"] = False
         
         if info["hybrid_search_available"]:
-            info["search_type"] = "Hybrid (BGE-M3 + BM25)"
-            info["weights"] = {"BGE-M3": 0.6, "BM25": 0.4}
+            info["search_type"] = "Hybrid (BGE-M3 + BM25 n-gram)"
+            weights = self.fusion.config()["weights"]
+            info["weights"] = {"BGE-M3": weights.get("vector", 0.0), "BM25": weights.get("lexical", 0.0)}
         elif info["bm25_available"]:
             info["search_type"] = "BM25 only"
         else:
@@ -712,125 +1171,257 @@ class KitakyushuWasteRAGService:
         return info
 
     # ========= LLM 呼び出し =========
-    def _call_llm(self, prompt: str) -> str:
-        try:
-            self.logger.info(f"LLM呼び出し開始 - モデル: {LLM_MODEL}")
-            res = ollama.chat(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0.1, "num_ctx": 4096},
+    @staticmethod
+    def _chat_request(model: str, messages: List[Dict[str, str]], num_ctx: int) -> Dict[str, Any]:
+        options = {"temperature": 0.1, "num_ctx": num_ctx}
+        if LLM_NUM_PREDICT > 0:
+            options["num_predict"] = LLM_NUM_PREDICT
+        return {
+            "model": model,
+            "messages": messages,
+            "options": options,
+            "keep_alive": LLM_KEEP_ALIVE,
+        }
+
+    def _record_prefill(self, res: Dict[str, Any]) -> None:
+        usage = self.prefill_stats.record(res)
+        if usage:
+            self.logger.info(
+                f"LLM prefill: prompt_eval_count={usage['prompt_eval_count']} "
+                f"prompt_eval={usage['prompt_eval_ms']:.0f}ms | eval_count={usage['eval_count']} "
+                f"eval={usage['eval_ms']:.0f}ms"
             )
-            response = (res.get("message", {}) or {}).get("content", "")
-            self.logger.info(f"LLM呼び出し成功 - レスポンス長: {len(response)}")
-            return response
-        except Exception as e:
-            self.logger.error(f"LLM呼び出しエラー: {e}")
-            self.logger.error(f"使用モデル: {LLM_MODEL}")
-            # フォールバックとしてllama3.1:8bを試す
+
+    async def _astream_llm(self, messages: List[Dict[str, str]], num_ctx: int) -> AsyncGenerator[str, None]:
+        """AsyncClient によるトークン列。最初のトークンより前に失敗したらフォールバックモデルで再試行する"""
+        models = [LLM_MODEL, "llama3.1:8b"]
+        for model in models:
+            started = False
             try:
-                self.logger.info("フォールバックモデル llama3.1:8b を試行")
-                res = ollama.chat(
-                    model="llama3.1:8b",
-                    messages=[{"role": "user", "content": prompt}],
-                    options={"temperature": 0.1, "num_ctx": 4096},
-                )
-                response = (res.get("message", {}) or {}).get("content", "")
-                self.logger.info(f"フォールバックモデル成功 - レスポンス長: {len(response)}")
-                return response
-            except Exception as fallback_error:
-                self.logger.error(f"フォールバックモデルもエラー: {fallback_error}")
-                return f"申し訳ございませんが、現在AIサービスが利用できません。しばらく後でお試しください。エラー: {str(e)}"
+                self.logger.info(f"LLM呼び出し開始 - モデル: {model}")
+                stream = await self._ollama.chat(**self._chat_request(model, messages, num_ctx), stream=True)
+                async for chunk in stream:
+                    # 正确处理流结束信号（最後のチャンクにプレフィル・生成の統計が入る）
+                    if chunk.get("done"):
+                        self._record_prefill(chunk)
+                        break
+                    msg = chunk.get("message") or {}
+                    content = msg.get("content", "")
+                    if content:
+                        started = True
+                        yield content
+                return
+            except Exception as e:
+                if started or model == models[-1]:
+                    raise
+                self.logger.error(f"LLM呼び出しエラー: {e}")
+                self.logger.info(f"フォールバックモデル {models[-1]} を試行")
+
+    async def _generate(self, query: str, prep: Dict[str, Any]) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
+        """
+        生成1本: 受付待ち（順番の通知）→ トークン → 回答キャッシュへの保存
+        同じ質問・同じ検索文脈の要求はこの1本に相乗りする（generation_flight.py）
+        """
+        waiter = self.llm_scheduler.enqueue()
+        async for position in self.llm_scheduler.wait_turn(waiter):
+            yield {"type": "queue", "position": position}
+        t_gen = time.time()
+        try:
+            parts = []
+            async for content in self._astream_llm(prep["messages"], prep["num_ctx"]):
+                parts.append(content)
+                yield content
+            answer = "".join(parts).strip()
+            self.logger.info(f"LLM呼び出し成功 - レスポンス長: {len(answer)}")
+            self._store_answer(query, prep, answer, time.time() - t_gen)
+        finally:
+            self.llm_scheduler.release(time.time() - t_gen)
+
+    def _flight_key(self, query: str, prep: Dict[str, Any]) -> Tuple[str, str, str]:
+        return (LLM_MODEL, clean_text(query), prep["context_hash"])
+
+    def _probe_answer_cache(
+        self, query: str, docs: List[Document]
+    ) -> Tuple[Optional[List[float]], List[str], Optional[Dict[str, Any]]]:
+        """
+        (クエリ埋め込み, 検索上位の文書ID, キャッシュヒット) を返す
+        埋め込みは検索で計算済みのものを使う。完全一致・語彙の段階で打ち切った検索は埋め込んでいないため、
+        同じ上位文書の回答があるときだけここで1回埋め込む（保存済みの埋め込みのない質問も同じ呼び出しで埋め込む）
+        """
+        if not self.answer_cache.enabled or not docs:
+            return None, [], None
+        q_clean = clean_text(query)
+        vector = self.query_embeddings.peek(q_clean)
+        doc_ids = self._chroma_ids(docs[:self.answer_cache.top_docs])
+        pending = self.answer_cache.pending_queries(LLM_MODEL, doc_ids) if vector is None else None
+        if pending is not None:
+            try:
+                vectors = self.query_embeddings.embed_documents([q_clean, *pending])
+                vector = vectors[0]
+                self.answer_cache.set_vectors(LLM_MODEL, doc_ids, dict(zip(pending, vectors[1:])))
+            except Exception as e:
+                # 埋め込めなくても質問文の完全一致では引ける
+                self.logger.warning(f"回答キャッシュ照会用の埋め込みエラー: {e}")
+        hit = self.answer_cache.lookup(LLM_MODEL, vector, doc_ids, q_clean)
+        if hit:
+            self.logger.info(
+                f"回答キャッシュヒット: '{query}' ≈ '{hit['query']}' "
+                f"(類似度 {hit['similarity']:.3f}, 節約 {hit['generation_sec']:.1f}秒)"
+            )
+        return vector, doc_ids, hit
+
+    def _build_messages(
+        self, query: str, scored: List[Tuple[Document, float]]
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """トークン予算内の参照データでプロンプトを組み、推定トークン数から num_ctx を決める"""
+        context, info = build_context(scored)
+        messages = build_chat_messages(clean_text(query), context)
+        prompt_tokens = estimate_message_tokens(messages)
+        num_ctx = self.num_ctx_planner.choose(prompt_tokens)
+        self.logger.info(
+            f"プロンプト: 推定 {prompt_tokens} トークン (参照データ {info['tokens']}, "
+            f"候補 {info['used']}/{info['candidates']}, スコア不足 {info['dropped_low_score']}, "
+            f"予算超過 {info['dropped_budget']}) → num_ctx {num_ctx}"
+        )
+        return messages, num_ctx
+
+    def _prepare_query(self, query: str, k: int) -> Dict[str, Any]:
+        """生成の手前まで（検索・確信度・回答キャッシュ照会・プロンプト組み立て）。同期処理"""
+        scored = self.similarity_search_with_scores(query, k=k)
+        docs = [doc for doc, _ in scored]
+        # 確信度: 検索結果の融合スコアの最大値（0〜1。全レトリバーで1位なら 1.0）
+        confidence = max((score for _, score in scored), default=0.0)
+        self.logger.info(f"検索結果: {len(docs)}件のドキュメントを取得 (確信度 {confidence:.3f})")
+        vector, doc_ids, hit = self._probe_answer_cache(query, docs)
+        messages, num_ctx = (None, None) if hit else self._build_messages(query, scored)
+        return {
+            "docs": docs,
+            # 同一生成の相乗り判定に使う検索文脈のハッシュ（プロンプトに入る文書の並び）
+            "context_hash": hashlib.sha1("\0".join(self._chroma_ids(docs)).encode("utf-8")).hexdigest(),
+            "confidence": confidence,
+            "vector": vector,
+            "doc_ids": doc_ids,
+            "hit": hit,
+            "messages": messages,
+            "num_ctx": num_ctx,
+        }
+
+    async def _aprepare_query(self, query: str, k: int) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._query_executor, self._prepare_query, query, k)
+
+    def _store_answer(self, query: str, prep: Dict[str, Any], answer: str, generation_sec: float) -> None:
+        if prep["doc_ids"]:
+            self.answer_cache.store(LLM_MODEL, prep["vector"], prep["doc_ids"], answer, generation_sec, clean_text(query))
+
+    def _blocking_result(self, prep: Dict[str, Any], answer: str, t0: float, cached: bool) -> Dict[str, Any]:
+        return {
+            "response": answer,
+            "documents": len(prep["docs"]),
+            "latency": time.time() - t0,
+            "timestamp": datetime.now().isoformat(),
+            "cached": cached,
+            "confidence": prep["confidence"],
+        }
+
+    def _blocking_error(self, e: Exception, t0: float) -> Dict[str, Any]:
+        self.logger.error(f"ablocking_query エラー: {e}")
+        import traceback
+        self.logger.error(f"トレースバック: {traceback.format_exc()}")
+        return {
+            "response": f"申し訳ございませんが、処理中にエラーが発生しました。しばらく後でお試しください。",
+            "documents": 0,
+            "latency": time.time() - t0,
+            "timestamp": datetime.now().isoformat(),
+            "error": str(e)
+        }
 
     # ========= ユーザーAPI =========
-    def blocking_query(self, query: str, k: int = DEFAULT_K) -> Dict[str, Any]:
+    async def ablocking_query(self, query: str, k: int = DEFAULT_K) -> Dict[str, Any]:
+        """
+        一括応答。検索はスレッドプール、生成は受付制御・相乗りを経て AsyncClient で行う
+        生成の受付が満杯・待ち時間切れの場合は LLMOverloadedError を送出する（API で 503 にする）
+        """
         t0 = time.time()
         try:
             self.logger.info(f"質問受信: {query}")
-            docs = self.similarity_search(query, k=k)
-            self.logger.info(f"検索結果: {len(docs)}件のドキュメントを取得")
-            ctx = self._format_docs(docs)
-
-            prompt = (
-                "あなたは北九州市のごみ分別案内の専門AIです。"
-                "以下の参照データの範囲内で、日本語で簡潔かつ正確に回答してください。"
-                "最優先で「出し方」を特定して、そのままの表記で出力する。次に「備考」があれば補足する。"
-                "重要なルール:"
-                "1. 質問された品目に関連する情報のみを回答してください（関係ない品目の情報は含めないでください）"
-                "2. データベースに該当する情報がない場合は「申し訳ございませんが、該当する情報がありません。北九州市のホームページでご確認いただくか、お住まいの区役所にお問い合わせください。」と回答してください"
-                "3. 回答は簡潔で分かりやすく、出し方と備考を含めてください"
-                "4. 推測や一般的なアドバイスは避け、データに基づいた正確な情報のみを提供してください"
-                "5. 複数の関連品目がある場合は、質問に最も関連するもののみを優先して回答してください"
-                "\n\n質問:\n"
-                f"{clean_text(query)}\n\n参照データ:\n{ctx}\n\n回答:"
-            )
-            
-            answer = self._call_llm(prompt).strip()
-            result = {
-                "response": answer,
-                "documents": len(docs),
-                "latency": time.time() - t0,
-                "timestamp": datetime.now().isoformat(),
-            }
+            prep = await self._aprepare_query(query, k)
+            if prep["hit"]:
+                return self._blocking_result(prep, prep["hit"]["answer"], t0, cached=True)
+
+            # 同じ質問・同じ検索文脈の生成が実行中なら、その結果を待つ
+            try:
+                items = await self.generations.collect(
+                    self._flight_key(query, prep), lambda: self._generate(query, prep)
+                )
+                answer = "".join(item for item in items if isinstance(item, str)).strip()
+            except LLMOverloadedError:
+                raise
+            except Exception as e:
+                self.logger.error(f"LLM呼び出しエラー: {e}")
+                answer = f"申し訳ございませんが、現在AIサービスが利用できません。しばらく後でお試しください。エラー: {str(e)}"
+            result = self._blocking_result(prep, answer, t0, cached=False)
             self.logger.info(f"回答生成完了 - 処理時間: {result['latency']:.2f}秒")
             return result
-            
+        except LLMOverloadedError as e:
+            self.logger.warning(f"LLM受付を拒否: {e} (Retry-After {e.retry_after}s)")
+            raise
         except Exception as e:
-            self.logger.error(f"blocking_query エラー: {e}")
-            import traceback
-            self.logger.error(f"トレースバック: {traceback.format_exc()}")
-            return {
-                "response": f"申し訳ございませんが、処理中にエラーが発生しました。しばらく後でお試しください。",
-                "documents": 0,
-                "latency": time.time() - t0,
-                "timestamp": datetime.now().isoformat(),
-                "error": str(e)
-            }
+            return self._blocking_error(e, t0)
 
-    async def streaming_query(self, query: str, k: int = DEFAULT_K) -> AsyncGenerator[str, None]:
-        docs = self.similarity_search(query, k=k)
-        ctx = self._format_docs(docs)
-
-        prompt = (
-            "あなたは北九州市のごみ分別案内の専門AIです。"
-            "以下の参照データの範囲内で、日本語で簡潔かつ正確に回答してください。"
-            "最優先で「出し方」を特定して、そのままの表記で出力する。次に「備考」があれば補足する。"
-            "重要なルール:"
-            "1. 質問された品目に関連する情報のみを回答してください（関係ない品目の情報は含めないでください）"
-            "2. データベースに該当する情報がない場合は「申し訳ございませんが、該当する情報がありません。北九州市のホームページでご確認いただくか、お住まいの区役所にお問い合わせください。」と回答してください"
-            "3. 回答は簡潔で分かりやすく、出し方と備考を含めてください"
-            "4. 推測や一般的なアドバイスは避け、データに基づいた正確な情報のみを提供してください"
-            "5. 複数の関連品目がある場合は、質問に最も関連するもののみを優先して回答してください"
-            f"\n\n質問:\n{clean_text(query)}\n\n参照データ:\n{ctx}\n\n回答:"
-        )
+    async def aprepare_streaming(self, query: str, k: int = DEFAULT_K) -> Dict[str, Any]:
+        """
+        ストリーミング開始前の検索・回答キャッシュ照会と受付判定（レスポンスを返す前に 503 を決めるため）
+        キャッシュヒット・実行中の同じ生成への相乗りは待ち行列が満杯でも受け付ける。受け付けられなければ LLMOverloadedError
+        """
+        prep = await self._aprepare_query(query, k)
+        if not prep["hit"] and not self.generations.in_flight(self._flight_key(query, prep)):
+            self.llm_scheduler.check_admission()
+        return prep
+
+    async def streaming_query(
+        self, query: str, k: int = DEFAULT_K, prep: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
+        """
+        回答のトークン（str）を順に返す。生成待ちの間は待ち行列の順番を
+        {"type": "queue", "position": n}、受付できなかった場合は {"type": "busy", "retry_after": 秒} で返す
+        prep は aprepare_streaming の結果（省略時はここで検索する）
+        """
+        # 検索はスレッドプールで行い、トークンは AsyncClient から受け取る（他のリクエストと交互に進む）
+        if prep is None:
+            prep = await self._aprepare_query(query, k)
+        if prep["hit"]:
+            # キャッシュ済みの回答を通常のストリーミングと同じ形で再送する
+            for chunk in replay_chunks(prep["hit"]["answer"]):
+                yield chunk
+            return
 
+        # 同じ質問・同じ検索文脈の生成が実行中なら、そのトークン列を先頭から受け取る
         try:
-            stream = ollama.chat(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                options={"temperature": 0.1, "num_ctx": 4096},
-            )
-            for chunk in stream:
-                # 正确处理流结束信号
-                if chunk.get("done"):
-                    break
-                msg = chunk.get("message") or {}
-                content = msg.get("content", "")
-                if content:
-                    yield content
+            async for item in self.generations.subscribe(
+                self._flight_key(query, prep), lambda: self._generate(query, prep)
+            ):
+                yield item
+        except LLMOverloadedError as e:
+            self.logger.warning(f"LLM受付を拒否: {e} (Retry-After {e.retry_after}s)")
+            yield {"type": "busy", "retry_after": e.retry_after, "message": str(e)}
         except Exception as e:
             yield f"エラー: {e}"
 # ======= シングルトン =======
 _rag = None
+_rag_lock = threading.Lock()
 def get_rag_service() -> KitakyushuWasteRAGService:
     global _rag
     if _rag is None:
-        try:
-            _rag = KitakyushuWasteRAGService()
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"RAGサービス初期化エラー: {e}")
-            logger.error(f"トレースバック: {__import__('traceback').format_exc()}")
-            raise e
+        # 取り込みワーカーとAPIから同時に初期化されないようにする
+        with _rag_lock:
+            if _rag is None:
+                try:
+                    _rag = KitakyushuWasteRAGService()
+                except Exception as e:
+                    import logging
+                    logger = logging.getLogger(__name__)
+                    logger.error(f"RAGサービス初期化エラー: {e}")
+                    logger.error(f"トレースバック: {__import__('traceback').format_exc()}")
+                    raise e
     return _rag
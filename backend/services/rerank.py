@@ -0,0 +1,122 @@
+"""
+品目名による再ランキング用の特徴量
+- 取り込み時に文書ごとの正規化品目名を名前IDへ、名前IDごとに同義語グループIDを求めて保持する
+- 特徴量は文書テーブルの整数IDを添字にした配列で持ち、
+  再ランキングは候補の整数ID配列から (名前ID, グループID) を引いてクエリの ID と整数比較で採点する
+  3: 品目名が一致 / 2: 同じ同義語グループ / 1: 品目名の部分一致 / 0: それ以外
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .item_index import item_name_of
+
+_NO_ID = -1
+
+
+def _grow(arr: np.ndarray, size: int, fill) -> np.ndarray:
+    if size <= arr.size:
+        return arr
+    out = np.full(max(size, arr.size * 2, 64), fill, dtype=arr.dtype)
+    out[:arr.size] = arr
+    return out
+
+
+class RerankFeatures:
+    """文書ID → (名前ID, 「品目:」行の有無)、名前ID → (正規化品目名, 同義語グループID)"""
+
+    def __init__(self, normalize: Callable[[str], str], canonical_of: Callable[[str], int]):
+        self.normalize = normalize
+        self.canonical_of = canonical_of
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._name_ids: Dict[str, int] = {}
+            self._names: List[str] = []
+            self._groups = np.zeros(0, dtype=np.int32)
+            self._doc_name = np.zeros(0, dtype=np.int32)
+            self._doc_head = np.zeros(0, dtype=bool)
+            self._doc_live = np.zeros(0, dtype=bool)
+
+    def stats(self) -> Dict[str, int]:
+        return {"documents": int(self._doc_live.sum()), "names": len(self._names)}
+
+    def _name_id_locked(self, name: str) -> int:
+        nid = self._name_ids.get(name)
+        if nid is None:
+            nid = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+            self._groups = _grow(self._groups, nid + 1, _NO_ID)
+            self._groups[nid] = self.canonical_of(name)
+        return nid
+
+    def add_many(self, doc_ids: np.ndarray, docs: Iterable[Document]) -> None:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if doc_ids.size == 0:
+            return
+        with self._lock:
+            size = int(doc_ids.max()) + 1
+            self._doc_name = _grow(self._doc_name, size, _NO_ID)
+            self._doc_head = _grow(self._doc_head, size, False)
+            self._doc_live = _grow(self._doc_live, size, False)
+            for doc_id, doc in zip(doc_ids.tolist(), docs):
+                text = doc.page_content or ""
+                name = item_name_of(text)
+                name = self.normalize(name) if name else ""
+                self._doc_name[doc_id] = self._name_id_locked(name) if name else _NO_ID
+                # 名前が空でも「品目:」行があれば見出しありとして数える（poor 判定用）
+                self._doc_head[doc_id] = "品目:" in text
+                self._doc_live[doc_id] = True
+
+    def remove_many(self, doc_ids: np.ndarray) -> None:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        with self._lock:
+            doc_ids = doc_ids[doc_ids < self._doc_name.size]
+            self._doc_name[doc_ids] = _NO_ID
+            self._doc_head[doc_ids] = False
+            self._doc_live[doc_ids] = False
+
+    def regroup(self, *_args) -> None:
+        """同義語辞書の再読み込み後にグループIDを引き直す"""
+        with self._lock:
+            for nid, name in enumerate(self._names):
+                self._groups[nid] = self.canonical_of(name)
+
+    def has_heading(self, doc_ids: np.ndarray) -> np.ndarray:
+        """「品目:」行を持つ文書か"""
+        with self._lock:
+            return self._doc_head[np.asarray(doc_ids, dtype=np.int64)]
+
+    def scores(self, doc_ids: np.ndarray, item: str) -> np.ndarray:
+        """候補（文書ID配列）ごとの品目一致スコア"""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        scores = np.zeros(doc_ids.size, dtype=np.int8)
+        query_name = self.normalize(item) if item else ""
+        if not query_name or doc_ids.size == 0:
+            return scores
+        with self._lock:
+            query_nid = self._name_ids.get(query_name, _NO_ID)
+            query_group = self.canonical_of(query_name)
+            nids = self._doc_name[doc_ids]
+            named = nids >= 0
+            if self._groups.size:
+                groups = np.where(named, self._groups[np.maximum(nids, 0)], _NO_ID)
+            else:
+                groups = np.full(nids.size, _NO_ID, dtype=np.int32)
+            names = self._names
+
+        if query_nid >= 0:
+            scores[nids == query_nid] = 3
+        if query_group >= 0:
+            scores[(scores == 0) & (groups == query_group)] = 2
+        # 部分一致だけは文字列で判定する（対象は名前のある未一致の候補のみ）
+        for i in np.flatnonzero((scores == 0) & named).tolist():
+            name = names[nids[i]]
+            if query_name in name or name in query_name:
+                scores[i] = 1
+        return scores
@@ -0,0 +1,63 @@
+"""
+検索結果キャッシュ
+- キーは (正規化クエリ, k, インデックス版数, 同義語辞書版数, 融合設定版数)、
+  値は順位付きの (文書テーブルの整数ID列, 融合スコア列)
+- 取り込み・削除・全消去でインデックス版数が上がるため、古い結果が返ることはない
+  （古い版数のエントリは参照されなくなり、LRU で追い出される）
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# (文書ID列, スコア列)
+Ranked = Tuple[List[int], List[float]]
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))  # 0 で無効
+
+
+class RetrievalCache:
+    """検索キー → (文書ID列, スコア列) の LRU キャッシュ"""
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Ranked]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[Ranked]:
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ids
+
+    def put(self, key: Hashable, ranked: Ranked) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (list(ranked[0]), list(ranked[1]))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,81 @@
+"""
+段階的検索（安い順に実行し、確信度が閾値に達した段階で打ち切る）
+  exact     : 品目名の完全一致索引
+  lexical   : 元クエリの BM25（埋め込み不要）
+  hybrid    : 元クエリのベクトル検索 + BM25 の融合
+  expansion : 同義語展開したクエリ群のハイブリッド検索
+  item      : 品目名（とその同義語）での再検索
+- 確信度は融合スコア（0〜1）のうち、クエリの品目名と合う候補（一致・同義語・部分一致）の最大値
+- lexical の融合スコアは BM25 の重みの割合（既定 0.4）が上限なので、閾値は PLANNER_MIN_CONFIDENCE ではなく
+  その割合に対する比 PLANNER_MIN_CONFIDENCE_LEXICAL で判定する（1.0 = BM25 で1位の候補だけ）
+- 段階ごとに「到達回数 / そこで打ち切った回数」を数え、ヒット率を定期的にログへ出す
+"""
+
+import os
+import threading
+from typing import Dict, Mapping
+
+PLANNER_EARLY_EXIT             = os.getenv("PLANNER_EARLY_EXIT", "true").lower() in ("1", "true", "yes", "on")
+PLANNER_MIN_CONFIDENCE         = float(os.getenv("PLANNER_MIN_CONFIDENCE", "0.9"))
+# BM25 のみの段階の閾値（BM25 の重みの割合に対する比。RRF 既定では 0.95 で BM25 の4位まで）
+PLANNER_MIN_CONFIDENCE_LEXICAL = float(os.getenv("PLANNER_MIN_CONFIDENCE_LEXICAL", "0.95"))
+PLANNER_LOG_EVERY              = int(os.getenv("PLANNER_LOG_EVERY", "100"))  # 何検索ごとにヒット率をログに出すか
+
+STAGES = ("exact", "lexical", "hybrid", "expansion", "item")
+
+
+
+def stage_threshold(stage: str, weights: Mapping[str, float]) -> float:
+    """段階の打ち切り閾値（融合スコアの尺度）。lexical は BM25 の重みの割合で上限を揃える"""
+    if stage != "lexical":
+        return PLANNER_MIN_CONFIDENCE
+    total = sum(weights.values())
+    share = weights.get("lexical", 0.0) / total if total > 0 else 0.0
+    # BM25 の重みが 0 なら lexical の段階では打ち切らない
+    return PLANNER_MIN_CONFIDENCE_LEXICAL * share if share > 0 else float("inf")
+
+
+class StageStats:
+    """段階ごとの到達回数・打ち切り回数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.reached: Dict[str, int] = dict.fromkeys(STAGES, 0)
+        self.exits: Dict[str, int] = dict.fromkeys(STAGES, 0)
+
+    def record(self, exit_stage: str) -> bool:
+        """exit_stage で打ち切った検索を記録する。ヒット率をログに出す回なら True"""
+        with self._lock:
+            self.searches += 1
+            for stage in STAGES:
+                self.reached[stage] += 1
+                if stage == exit_stage:
+                    break
+            self.exits[exit_stage] += 1
+            return PLANNER_LOG_EVERY > 0 and self.searches % PLANNER_LOG_EVERY == 0
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stages = {
+                stage: {
+                    "reached": self.reached[stage],
+                    "exits": self.exits[stage],
+                    # その段階まで進んだ検索のうち、そこで打ち切れた割合
+                    "hit_rate": round(self.exits[stage] / self.reached[stage], 3) if self.reached[stage] else 0.0,
+                }
+                for stage in STAGES
+            }
+            return {
+                "early_exit": PLANNER_EARLY_EXIT,
+                "min_confidence": PLANNER_MIN_CONFIDENCE,
+                "min_confidence_lexical": PLANNER_MIN_CONFIDENCE_LEXICAL,
+                "searches": self.searches,
+                "stages": stages,
+            }
+
+    def summary(self) -> str:
+        stages = self.stats()["stages"]
+        return " | ".join(
+            f"{stage} {s['exits']}/{s['reached']} ({s['hit_rate']:.0%})" for stage, s in stages.items()
+        )
@@ -0,0 +1,175 @@
+"""
+ソース → ドキュメントID の所有索引（マニフェスト）
+- (source, doc_id) を1行として SQLite に保存する。doc_id にも索引を張り、
+  「他のソースも所有しているか」はそのIDだけを引いて判定する（索引全体は読まない）
+- 更新・削除は対象ソースの行だけを書き換える（マニフェスト全体の書き直しはしない）
+- 永続モードは CHROMA_DIR 内のファイル、インメモリモードは ":memory:" で同じ索引を使う
+- 旧形式の index_manifest.json があれば初回に取り込んで削除する
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+
+from .logger import setup_logger
+
+MANIFEST_VERSION = 1
+
+# SQLite のバインド変数上限（999）未満に抑える
+_SQL_CHUNK = 500
+
+
+class SourceManifest:
+    """ソースごとの内容ハッシュと所有ドキュメントID（スレッドセーフ）"""
+
+    def __init__(self, path: str, embed_model: str, legacy_json: Optional[str] = None):
+        self.logger = setup_logger(__name__)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sources (
+                source     TEXT PRIMARY KEY,
+                file_hash  TEXT,
+                updated_at TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS source_docs (
+                source TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                PRIMARY KEY (source, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS source_docs_doc_id ON source_docs (doc_id);
+            """
+        )
+        self._conn.commit()
+        if self._meta("version") is None:
+            # 新規作成（旧形式のJSONがあれば引き継ぐ）
+            model = embed_model
+            if legacy_json and os.path.exists(legacy_json):
+                model = self._import_json(legacy_json)
+            self._set_meta("version", str(MANIFEST_VERSION))
+            self._set_meta("embed_model", model)
+        elif self._meta("version") != str(MANIFEST_VERSION):
+            raise ValueError(f"unsupported manifest: version={self._meta('version')}")
+
+    # ========= メタ情報 =========
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: Optional[str]) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self._conn.commit()
+
+    @property
+    def embed_model(self) -> Optional[str]:
+        """索引を作った EMBED_MODEL（読み込めなかった旧マニフェストは None）"""
+        with self._lock:
+            return self._meta("embed_model")
+
+    def _import_json(self, path: str) -> Optional[str]:
+        """旧形式のJSONマニフェストを取り込み、その EMBED_MODEL を返す（壊れていれば None）"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION or not isinstance(manifest.get("sources"), dict):
+                raise ValueError(f"unsupported manifest: version={manifest.get('version')}")
+            for source, entry in manifest["sources"].items():
+                self._write(source, entry.get("doc_ids", []), entry.get("file_hash"), entry.get("updated_at"))
+            self._conn.commit()
+            model = manifest.get("embed_model")
+        except Exception as e:
+            self.logger.warning(f"旧マニフェスト読み込みエラーのため作り直します: {e}")
+            # インデックスとの対応が取れないので無効扱い（呼び出し側で作り直す）
+            self._conn.rollback()
+            model = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return model
+
+    # ========= 参照 =========
+    def sources(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT source FROM sources")]
+
+    def file_hash(self, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT file_hash FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def doc_ids(self, source: str) -> Optional[List[str]]:
+        """ソースが所有するID一覧（索引にないソースは None）"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM sources WHERE source = ?", (source,)).fetchone() is None:
+                return None
+            return [r[0] for r in self._conn.execute("SELECT doc_id FROM source_docs WHERE source = ?", (source,))]
+
+    def all_doc_ids(self) -> Set[str]:
+        """いずれかのソースが所有するID（起動時の document_ids 復元用）"""
+        with self._lock:
+            return {r[0] for r in self._conn.execute("SELECT DISTINCT doc_id FROM source_docs")}
+
+    def owned_elsewhere(self, source: str, ids: Iterable[str]) -> Set[str]:
+        """ids のうち source 以外のソースも所有しているもの（doc_id の索引で該当IDだけを引く）"""
+        keys = list(dict.fromkeys(ids))
+        owned: Set[str] = set()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[i:i + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT doc_id FROM source_docs WHERE doc_id IN ({placeholders}) AND source != ?",
+                    [*chunk, source],
+                )
+                owned.update(r[0] for r in rows)
+        return owned
+
+    # ========= 更新 =========
+    def _write(self, source: str, doc_ids: Iterable[str], file_hash: Optional[str], updated_at: Optional[str]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources (source, file_hash, updated_at) VALUES (?, ?, ?)",
+            (source, file_hash, updated_at or datetime.now().isoformat()),
+        )
+        self._conn.execute("DELETE FROM source_docs WHERE source = ?", (source,))
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO source_docs (source, doc_id) VALUES (?, ?)",
+            ((source, doc_id) for doc_id in doc_ids),
+        )
+
+    def record(self, source: str, doc_ids: Iterable[str], file_hash: Optional[str] = None) -> None:
+        """source の所有IDを置き換える（このソースの行だけを書き換える）"""
+        with self._lock:
+            self._write(source, doc_ids, file_hash, None)
+            self._conn.commit()
+
+    def forget(self, source: str) -> bool:
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM sources WHERE source = ?", (source,)).rowcount
+            self._conn.execute("DELETE FROM source_docs WHERE source = ?", (source,))
+            self._conn.commit()
+        return removed > 0
+
+    def clear(self, embed_model: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sources")
+            self._conn.execute("DELETE FROM source_docs")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embed_model', ?)", (embed_model,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
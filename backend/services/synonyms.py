@@ -0,0 +1,231 @@
+"""
+同義語辞書
+- 見出し語・表記揺れをすべて Aho-Corasick オートマトンへコンパイルし、クエリを1回走査するだけで
+  含まれる辞書語をすべて見つける（辞書が数千語に増えてもクエリあたりのコストはほぼ一定）
+- 辞書は JSON ファイル（{"見出し語": ["表記揺れ", ...]}）から読み込み、更新時刻が変わると自動で再読み込みする
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .logger import setup_logger
+
+SYNONYMS_FILE            = os.getenv("SYNONYMS_FILE", "")  # 空なら組み込み辞書のみ
+SYNONYMS_RELOAD_INTERVAL = float(os.getenv("SYNONYMS_RELOAD_INTERVAL", "5"))  # 更新確認の間隔（秒）
+
+
+class AhoCorasick:
+    """複数パターンの同時検索（重なりを含む全出現を返す）"""
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for idx, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(idx)
+
+        # 幅優先で失敗遷移を張り、出力を継承する
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """(終了位置, パターン番号) の一覧"""
+        found: List[Tuple[int, int]] = []
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for idx in out[state]:
+                found.append((pos + 1, idx))
+        return found
+
+
+class _CompiledSynonyms:
+    """辞書1版分のコンパイル結果（不変。再読み込み時は丸ごと差し替える）"""
+
+    def __init__(self, mapping: Mapping[str, Sequence[str]]):
+        self.mapping: Dict[str, List[str]] = {k: list(v) for k, v in mapping.items()}
+        surfaces: Dict[str, int] = {}
+        # 表記 → (適用順, 置換先)。適用順は 見出し語→表記揺れ、表記揺れ→見出し語 の辞書順
+        rules: Dict[str, List[Tuple[int, str]]] = {}
+        order = 0
+        for key, synonyms in self.mapping.items():
+            for synonym in synonyms:
+                rules.setdefault(key, []).append((order, synonym))
+                order += 1
+            for synonym in synonyms:
+                rules.setdefault(synonym, []).append((order, key))
+                order += 1
+        for surface in rules:
+            surfaces.setdefault(surface, len(surfaces))
+        self.surfaces = list(surfaces)
+        self.rules = [rules[s] for s in self.surfaces]
+        self.automaton = AhoCorasick(self.surfaces)
+        self.canonical = self._canonical_ids(self.mapping)
+
+    @staticmethod
+    def _canonical_ids(mapping: Mapping[str, Sequence[str]]) -> Dict[str, int]:
+        """表記 → 同義語グループID。表記を共有するグループは1つにまとめる（Union-Find）"""
+        parent: Dict[str, str] = {}
+
+        def find(x: str) -> str:
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for key, synonyms in mapping.items():
+            root = find(key)
+            for synonym in synonyms:
+                other = find(synonym)
+                if other != root:
+                    parent[other] = root
+        roots: Dict[str, int] = {}
+        return {surface: roots.setdefault(find(surface), len(roots)) for surface in list(parent)}
+
+    def matched_surfaces(self, query: str) -> List[str]:
+        seen = dict.fromkeys(idx for _, idx in self.automaton.find_all(query))
+        return [self.surfaces[i] for i in seen]
+
+    def expand(self, query: str) -> List[str]:
+        hits = {idx for _, idx in self.automaton.find_all(query)}
+        if not hits:
+            return [query]
+        planned = sorted(
+            (order, self.surfaces[idx], target)
+            for idx in hits
+            for order, target in self.rules[idx]
+        )
+        queries = [query]
+        for _, surface, target in planned:
+            new_query = query.replace(surface, target)
+            if new_query not in queries:
+                queries.append(new_query)
+        return queries
+
+
+class SynonymDictionary:
+    """組み込み辞書 + 任意の JSON ファイル。ファイルの更新時刻を見て自動で再読み込み"""
+
+    def __init__(
+        self,
+        default: Mapping[str, Sequence[str]],
+        path: str = SYNONYMS_FILE,
+        reload_interval: float = SYNONYMS_RELOAD_INTERVAL,
+    ):
+        self.logger = setup_logger(__name__)
+        self.default = {k: list(v) for k, v in default.items()}
+        self.path = path
+        self.reload_interval = reload_interval
+        self.version = 0
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, List[str]]], None]] = []
+        self._compiled = _CompiledSynonyms(self._load())
+
+    def _load(self) -> Dict[str, List[str]]:
+        mapping = {k: list(v) for k, v in self.default.items()}
+        if not self.path:
+            return mapping
+        try:
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            if not isinstance(loaded, dict):
+                raise ValueError("同義語ファイルは {\"見出し語\": [\"表記揺れ\", ...]} 形式のJSONにしてください")
+            for key, values in loaded.items():
+                values = [values] if isinstance(values, str) else list(values)
+                merged = mapping.setdefault(str(key), [])
+                merged.extend(str(v) for v in values if str(v) not in merged)
+            self.logger.info(f"同義語辞書を読み込みました: {self.path} | 見出し語 {len(mapping)} 件")
+        except FileNotFoundError:
+            self.logger.warning(f"同義語ファイルが見つからないため組み込み辞書を使用します: {self.path}")
+        except Exception as e:
+            self.logger.error(f"同義語ファイル読み込みエラー（組み込み辞書を使用）: {e}")
+        return mapping
+
+    def add_listener(self, callback: Callable[[Dict[str, List[str]]], None]) -> None:
+        """再読み込み時に新しい辞書（見出し語 → 表記揺れ）で呼ばれる"""
+        self._listeners.append(callback)
+
+    def reload(self) -> None:
+        compiled = _CompiledSynonyms(self._load())
+        with self._lock:
+            self._compiled = compiled
+            self.version += 1
+        for callback in self._listeners:
+            try:
+                callback(compiled.mapping)
+            except Exception as e:
+                self.logger.warning(f"同義語辞書の更新通知エラー: {e}")
+
+    def maybe_reload(self) -> None:
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.logger.info(f"同義語ファイルの更新を検知したため再読み込みします: {self.path}")
+            self.reload()
+
+    @property
+    def mapping(self) -> Dict[str, List[str]]:
+        return self._compiled.mapping
+
+    def expand(self, query: str) -> List[str]:
+        self.maybe_reload()
+        return self._compiled.expand(query)
+
+    def matched_surfaces(self, query: str) -> List[str]:
+        self.maybe_reload()
+        return self._compiled.matched_surfaces(query)
+
+    def canonical_id(self, surface: str) -> int:
+        """同義語グループID（辞書にない表記は -1）"""
+        return self._compiled.canonical.get(surface, -1)
+
+    def stats(self) -> Dict[str, object]:
+        compiled = self._compiled
+        return {
+            "source": self.path or "builtin",
+            "entries": len(compiled.mapping),
+            "surfaces": len(compiled.surfaces),
+            "groups": len(set(compiled.canonical.values())),
+            "version": self.version,
+        }
@@ -0,0 +1,172 @@
+"""
+NumPy 総当たりベクトル索引（小〜中規模コーパス向け）
+- L2正規化した float32 埋め込みを1枚の連続した行列に保持し、
+  検索は (クエリ行列 × 文書行列ᵀ) の1回の行列積 + argpartition で上位k件を求める
+- 複数クエリを1回でまとめて検索できる（同義語展開したクエリ群を一括処理）
+- 数千〜数万件なら HNSW（Chroma）を経由するよりも速く、結果も厳密（近似なし）
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# "chroma"（既定）: Chroma の HNSW で検索 / "numpy": この索引で検索（Chroma は永続化用に引き続き書き込む）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+
+# 削除済み行がこの割合を超えたら詰め直す
+_COMPACT_RATIO = 0.25
+
+
+class NumpyVectorIndex:
+    """連続行列 + 行スロットによる厳密コサイン類似度検索"""
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dim: Optional[int] = None
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+            self._alive = np.zeros(0, dtype=bool)
+            self._key_to_row: Dict[str, int] = {}
+            self._row_keys: List[Optional[str]] = []
+            self._row_docs: List[Optional[Document]] = []
+            self._dead_rows = 0
+
+    def __len__(self) -> int:
+        return len(self._key_to_row)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self._key_to_row),
+            "dim": self._dim or 0,
+            "rows": len(self._row_keys),
+            "capacity": int(self._matrix.shape[0]),
+            "dead_rows": self._dead_rows,
+            "matrix_bytes": int(self._matrix.nbytes),
+        }
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        mat = np.asarray(vectors, dtype=np.float32)
+        if mat.ndim == 1:
+            mat = mat[None, :]
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return mat / norms
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self._matrix.shape[0]:
+            return
+        capacity = max(rows, self._matrix.shape[0] * 2, self._initial_capacity)
+        grown = np.zeros((capacity, self._dim), dtype=np.float32)
+        grown[:len(self._row_keys)] = self._matrix[:len(self._row_keys)]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._alive.size] = self._alive
+        self._matrix, self._alive = grown, alive
+
+    # ----- 更新 -----
+    def add_many(self, items: Iterable[Tuple[str, Document]], vectors: Sequence[Sequence[float]]) -> None:
+        items = list(items)
+        if not items:
+            return
+        mat = self._normalize(vectors)
+        if mat.shape[0] != len(items):
+            raise ValueError(f"文書数とベクトル数が一致しません: {len(items)} != {mat.shape[0]}")
+        with self._lock:
+            if self._dim is None:
+                self._dim = int(mat.shape[1])
+                self._matrix = np.zeros((0, self._dim), dtype=np.float32)
+            elif mat.shape[1] != self._dim:
+                raise ValueError(f"埋め込み次元が一致しません: {mat.shape[1]} != {self._dim}")
+            for key, _ in items:
+                self._remove_locked(key)
+            if self._dead_rows > max(64, int(len(self._row_keys) * _COMPACT_RATIO)):
+                self._compact()
+            start = len(self._row_keys)
+            self._ensure_capacity(start + len(items))
+            self._matrix[start:start + len(items)] = mat
+            self._alive[start:start + len(items)] = True
+            for offset, (key, doc) in enumerate(items):
+                self._key_to_row[key] = start + offset
+                self._row_keys.append(key)
+                self._row_docs.append(doc)
+
+    def remove_many(self, keys: Iterable[str]) -> int:
+        with self._lock:
+            removed = sum(1 for key in keys if self._remove_locked(key))
+            if self._dead_rows > max(64, int(len(self._row_keys) * _COMPACT_RATIO)):
+                self._compact()
+            return removed
+
+    def _remove_locked(self, key: str) -> bool:
+        row = self._key_to_row.pop(key, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self._row_keys[row] = None
+        self._row_docs[row] = None
+        self._dead_rows += 1
+        return True
+
+    def _compact(self) -> None:
+        """生存行だけを前に詰める"""
+        n = len(self._row_keys)
+        rows = np.flatnonzero(self._alive[:n])
+        self._matrix[:rows.size] = self._matrix[rows]
+        self._matrix[rows.size:n] = 0.0
+        self._alive[:n] = False
+        self._alive[:rows.size] = True
+        self._row_keys = [self._row_keys[r] for r in rows.tolist()]
+        self._row_docs = [self._row_docs[r] for r in rows.tolist()]
+        self._key_to_row = {key: i for i, key in enumerate(self._row_keys)}
+        self._dead_rows = 0
+
+    # ----- 検索 -----
+    def _top_rows(self, query_vectors, k: int) -> List[List[Tuple[int, float]]]:
+        """クエリごとの上位k件 (行, コサイン類似度)。呼び出し側でロックを取ること"""
+        queries = self._normalize(query_vectors)
+        n = len(self._row_keys)
+        if n == 0 or len(self._key_to_row) == 0 or k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+        scores = queries @ self._matrix[:n].T
+        if self._dead_rows:
+            scores[:, ~self._alive[:n]] = -np.inf
+        k = min(k, len(self._key_to_row))
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(n), (queries.shape[0], n))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(r, s) for r, s in zip(rows.tolist(), row_scores.tolist()) if s != -np.inf]
+            for rows, row_scores in zip(top, top_scores)
+        ]
+
+    def search_many_with_scores(self, query_vectors, k: int) -> List[List[Tuple[Document, float]]]:
+        """クエリごとの上位k件 (文書, コサイン類似度)"""
+        with self._lock:
+            return [[(self._row_docs[r], s) for r, s in hits] for hits in self._top_rows(query_vectors, k)]
+
+    def search_many(self, query_vectors, k: int) -> List[List[Document]]:
+        return [[doc for doc, _ in hits] for hits in self.search_many_with_scores(query_vectors, k)]
+
+    def search_many_keys_with_scores(self, query_vectors, k: int) -> List[Tuple[List[str], np.ndarray]]:
+        """クエリごとの上位k件の (文書キー, コサイン類似度配列)（Document を組み立てない）"""
+        with self._lock:
+            return [
+                ([self._row_keys[r] for r, _ in hits], np.asarray([s for _, s in hits], dtype=np.float64))
+                for hits in self._top_rows(query_vectors, k)
+            ]
+
+    def search_many_keys(self, query_vectors, k: int) -> List[List[str]]:
+        """クエリごとの上位k件の文書キー（Document を組み立てない）"""
+        return [keys for keys, _ in self.search_many_keys_with_scores(query_vectors, k)]
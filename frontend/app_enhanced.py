@@ -38,6 +38,7 @@ BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")  # 環境変数
 CHAT_STREAM_URL = f"{BACKEND_URL}/api/chat/streaming"
 CHAT_BLOCKING_URL = f"{BACKEND_URL}/api/chat/blocking"
 UPLOAD_URL = f"{BACKEND_URL}/api/upload"
+UPLOAD_JOB_MAX_WAIT = int(os.getenv("UPLOAD_JOB_MAX_WAIT", "1800"))  # 取り込みジョブの進捗を待つ最大秒数
 
 # セッション状態の初期化
 def initialize_session():
@@ -90,6 +91,8 @@ TRANSLATIONS = {
         "streaming_off": "完全応答待機",
         "streaming_send": "ストリーミング送信",
         "blocking_send": "ブロッキング送信",
+        "queue_position": "混み合っています。順番待ち: {position}番目",
+        "server_busy": "現在混み合っています。約{seconds}秒後にもう一度お試しください。",
     },
     "en": {
         "title": "Kitakyushu Waste Sorting Chatbot",
@@ -108,6 +111,8 @@ TRANSLATIONS = {
         "streaming_off": "Complete Response Wait",
         "streaming_send": "Streaming Send",
         "blocking_send": "Blocking Send",
+        "queue_position": "The server is busy. Position in queue: {position}",
+        "server_busy": "The server is busy. Please try again in about {seconds} seconds.",
     }
 }
 
@@ -682,6 +687,21 @@ class MessageManager:
         return False
 
 # API通信
+def _retry_after(response) -> Optional[int]:
+    """503（生成の受付が満杯）の Retry-After 秒数。それ以外は None"""
+    if response.status_code != 503:
+        return None
+    try:
+        return int(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return 0
+
+
+def busy_message(retry_after: Optional[int]) -> str:
+    # Retry-After が読めなかった場合は控えめに10秒と案内する
+    return t("server_busy").format(seconds=retry_after or 10)
+
+
 class APIClient:
     """API通信クラス (FR-06, FR-15)"""
     
@@ -737,6 +757,8 @@ class APIClient:
                     "success": False,
                     "error": error_msg,
                     "status_code": response.status_code,
+                    # 503（生成の受付が満杯）なら再試行までの秒数
+                    "retry_after": _retry_after(response),
                     "response_time": response_time
                 }
                 
@@ -778,8 +800,7 @@ class APIClient:
             st.session_state.metrics["interactions"] += 1
             
             if response.status_code == 200:
-                st.session_state.metrics["successful_requests"] += 1
-                
+                # 成功数は complete を受け取った時に数える（busy で終わった場合は数えない）
                 # SSEストリームを解析
                 full_response = ""
                 response_time = 0
@@ -799,6 +820,16 @@ class APIClient:
                                 full_response += content
                                 yield {"type": "chunk", "content": content}
                                 
+                            elif data.get("type") == "queue":
+                                # 生成待ちの順番
+                                yield {"type": "queue", "position": data.get("position", 0)}
+
+                            elif data.get("type") == "busy":
+                                # 生成を受け付けられなかった（complete は来ない）
+                                st.session_state.metrics["errors"] += 1
+                                yield {"type": "busy", "retry_after": data.get("retry_after")}
+                                break
+
                             elif data.get("type") == "complete":
                                 response_time = data.get("latency", time.time() - start_time)
                                 st.session_state.metrics["total_response_time"] += response_time
@@ -821,6 +852,10 @@ class APIClient:
                 except:
                     pass
                     
+                retry_after = _retry_after(response)
+                if retry_after is not None:
+                    yield {"type": "busy", "retry_after": retry_after}
+                    return
                 yield {
                     "type": "error",
                     "error": error_msg,
@@ -1599,6 +1634,8 @@ def process_blocking_response(message: str):
         # エラー処理
         st.session_state.metrics["errors"] += 1
         error_msg = result.get('error', 'Unknown error')
+        if result.get("retry_after") is not None:
+            error_msg = busy_message(result["retry_after"])
         print(f"[DEBUG] API呼び出しエラー: {error_msg}")
         
         error_message = create_error_message(error_msg, message)
@@ -1639,6 +1676,16 @@ def process_streaming_response(message: str):
                         </div>
                         """, unsafe_allow_html=True)
                         
+                    elif chunk_type == "queue":
+                        # 生成待ちの順番を表示（トークンが届き始めたら上書きされる）
+                        streaming_placeholder.info(t("queue_position").format(position=chunk_data.get("position", 0)))
+
+                    elif chunk_type == "busy":
+                        print(f"[DEBUG] 生成の受付不可: Retry-After={chunk_data.get('retry_after')}")
+                        error_message = create_error_message(busy_message(chunk_data.get("retry_after")), message)
+                        MessageManager.update_message(streaming_msg_id, error_message)
+                        break
+
                     elif chunk_type == "complete":
                         response_time = chunk_data.get("response_time", 0)
                         final_response = chunk_data.get("response", accumulated_response)
@@ -1705,22 +1752,30 @@ def upload_csv_file(uploaded_file):
         
         files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "text/csv")}
         
-        # タイムアウトを10分（600秒）に延長
-        status_text.text("⚙️ サーバーで処理中（最大10分）...")
-        progress_bar.progress(50)
-        
-        response = requests.post(UPLOAD_URL, files=files, timeout=600)
-        
-        progress_bar.progress(75)
-        status_text.text("✅ レスポンス処理中...")
-        
-        if response.status_code == 200:
-            progress_bar.progress(100)
-            result = response.json()
-            ingested_count = result.get("ingested", 0)
-            st.success(f"✅ {uploaded_file.name} をアップロードしました（{ingested_count} 件のデータを追加）")
-            status_text.empty()
+        # 取り込みはサーバー側のジョブで実行されるため、登録後は進捗をポーリングする
+        response = requests.post(UPLOAD_URL, files=files, timeout=60)
+        
+        if response.status_code in (200, 202):
+            job = response.json().get("job") or {}
+            job_id = job.get("job_id") or response.json().get("job_id")
+            deadline = time.time() + UPLOAD_JOB_MAX_WAIT
+            while job.get("status") in ("queued", "running") and time.time() < deadline:
+                parsed = job.get("rows_parsed", 0)
+                indexed = job.get("rows_indexed", 0)
+                status_text.text(f"⚙️ サーバーで処理中... 解析 {parsed:,} 行 / 埋め込み {job.get('rows_embedded', 0):,} 件 / 登録 {indexed:,} 件")
+                progress_bar.progress(50 + (40 * indexed // parsed if parsed else 0))
+                time.sleep(1)
+                job = requests.get(f"{UPLOAD_URL}/jobs/{job_id}", timeout=10).json()
+            
             progress_bar.empty()
+            status_text.empty()
+            if job.get("status") == "completed":
+                ingested_count = job.get("ingested", 0)
+                st.success(f"✅ {uploaded_file.name} をアップロードしました（{ingested_count} 件のデータを追加）")
+            elif job.get("status") == "failed":
+                st.error(f"❌ 取り込みエラー: {job.get('error', '不明なエラー')}")
+            else:
+                st.info(f"⏳ {uploaded_file.name} の取り込みはバックグラウンドで継続中です（ジョブID: {job_id}）")
         else:
             progress_bar.empty()
             status_text.empty()
@@ -1731,7 +1786,7 @@ def upload_csv_file(uploaded_file):
                 st.error(f"❌ アップロードエラー: HTTP {response.status_code}")
                 
     except requests.exceptions.Timeout:
-        st.error("❌ タイムアウトエラー: ファイルの処理に時間がかかりすぎました（10分以上）。ファイルサイズを小さくして再試行してください。")
+        st.error("❌ タイムアウトエラー: サーバーの応答がありません。しばらくしてから再試行してください。")
     except requests.exceptions.ConnectionError:
         st.error("❌ 接続エラー: バックエンドサーバーに接続できません。サーバーが起動しているか確認してください。")
     except Exception as e:
@@ -12,7 +12,7 @@ cd "$SCRIPT_DIR"
 echo "� プロジェクトディレクトリ: $(pwd)"
 
 # 必要なディレクトリ作成
-mkdir -p logs data chroma_db
+mkdir -p logs data chroma_db cache
 
 # Ollamaサービス確認
 echo ""
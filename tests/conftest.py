@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+# tools/ のスクリプトと同じく、リポジトリ直下から backend を import する
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# 埋め込みの軸にする語（同じ語を含む文は同じ向きのベクトルになる）
+VOCABULARY = ("ペットボトル", "アイロン", "電池", "スプレー缶", "新聞", "燃やす", "家庭ごみ", "資源")
+
+
+class KeywordEmbeddings(Embeddings):
+    """Ollama の代わりに語の出現回数で埋め込む（言い換えでも品目名が同じなら近いベクトルになる）"""
+
+    def __init__(self, **kwargs):
+        self.calls: List[List[str]] = []
+
+    @staticmethod
+    def vector(text: str) -> List[float]:
+        return [float(text.count(word)) for word in VOCABULARY] + [0.1]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [self.vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def make_rag(tmp_path, monkeypatch):
+    """
+    一時ディレクトリの CSV から RAG サービスを作る（埋め込みは KeywordEmbeddings）
+    インメモリの Chroma はプロセス内で共有されるため、テストごとに別の永続ディレクトリを使う
+    """
+    from backend.services import rag_service
+
+    def make(csv_text: str):
+        data_dir = tmp_path / "data"
+        data_dir.mkdir(exist_ok=True)
+        (data_dir / "items.csv").write_text(csv_text, encoding="utf-8")
+        monkeypatch.setattr(rag_service, "PERSIST_INDEX", True)
+        monkeypatch.setattr(rag_service, "CHROMA_DIR", str(tmp_path / "chroma"))
+        monkeypatch.setattr(rag_service, "DATA_DIR", str(data_dir))
+        monkeypatch.setattr(rag_service, "EMBED_CACHE_PATH", "")
+        monkeypatch.setattr(rag_service, "OllamaEmbeddings", KeywordEmbeddings)
+        return rag_service.KitakyushuWasteRAGService()
+
+    return make
+
+
+@pytest.fixture
+def stub_llm():
+    """AsyncClient の代わりに固定の回答を返し、呼ばれたプロンプトを記録する"""
+
+    def install(rag, answer: str = "資源化物の日に出してください。"):
+        calls = []
+
+        async def fake_stream(messages, num_ctx):
+            calls.append(messages)
+            yield answer
+
+        rag._astream_llm = fake_stream
+        return calls
+
+    return install
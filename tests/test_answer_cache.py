@@ -0,0 +1,50 @@
+import asyncio
+
+ITEMS_CSV = (
+    "品名,出し方,備考\n"
+    "ペットボトル,資源化物,キャップとラベルを外して\n"
+    "アイロン,家庭ごみ,金属製のものは小物金属回収ボックスへ\n"
+    "乾電池,回収ボックス,\n"
+)
+
+
+def ask_all(rag, questions):
+    async def run():
+        return [await rag.ablocking_query(q) for q in questions]
+    return asyncio.run(run())
+
+
+def test_reworded_exact_queries_share_one_generation(make_rag, stub_llm):
+    rag = make_rag(ITEMS_CSV)
+    calls = stub_llm(rag)
+    questions = [
+        "ペットボトルの捨て方を教えて",
+        "ペットボトルの捨て方",
+        "ペットボトルはどうやって捨てる？",
+        "ペットボトルの捨て方を教えてください",
+    ]
+    results = ask_all(rag, questions)
+
+    # どれも品目名の完全一致で検索を打ち切る（検索では埋め込まない）
+    assert rag.stage_stats.exits["exact"] == len(questions)
+    assert len(calls) == 1
+    assert [r["cached"] for r in results] == [False, True, True, True]
+    assert {r["response"] for r in results} == {results[0]["response"]}
+
+
+def test_different_item_is_not_served_from_cache(make_rag, stub_llm):
+    rag = make_rag(ITEMS_CSV)
+    calls = stub_llm(rag)
+    results = ask_all(rag, ["ペットボトルの捨て方", "アイロンの捨て方", "アイロンを捨てる"])
+    assert len(calls) == 2
+    assert [r["cached"] for r in results] == [False, False, True]
+
+
+def test_no_embedding_without_cached_answers(make_rag, stub_llm):
+    rag = make_rag(ITEMS_CSV)
+    stub_llm(rag)
+    embedder = rag.query_embeddings.inner
+    embedder.calls.clear()
+    ask_all(rag, ["ペットボトルの捨て方"])
+    # 同じ上位文書の回答がまだないので、完全一致の経路は埋め込みを呼ばない
+    assert embedder.calls == []
@@ -0,0 +1,17 @@
+import pytest
+
+from backend.services.rag_service import extract_item_like
+
+
+@pytest.mark.parametrize("query, item", [
+    # パターンは「の捨て方」→「はどう」→「を捨てる」の順に試す（最左の一致ではない）
+    ("アイロンを捨てるときの分別はどう", "アイロンを捨てるとき"),
+    ("ペットボトルの捨て方を教えて", "ペットボトル"),
+    ("電池はどうやって捨てる？", "電池"),
+    ("スプレー缶を捨てる", "スプレー缶"),
+    # どのパターンにも一致しなければクエリ全体
+    ("冷蔵庫", "冷蔵庫"),
+    ("", ""),
+])
+def test_extract_item_like(query, item):
+    assert extract_item_like(query) == item
@@ -0,0 +1,36 @@
+import math
+
+from backend.services.retrieval_planner import PLANNER_MIN_CONFIDENCE, stage_threshold
+
+ITEMS_CSV = (
+    "品名,出し方,備考\n"
+    "ペットボトル,資源化物,キャップとラベルを外して\n"
+    "ペットボトルのキャップ,プラスチック製容器包装,\n"
+    "アイロン,家庭ごみ,金属製のものは小物金属回収ボックスへ\n"
+    "乾電池,回収ボックス,\n"
+    "スプレー缶,資源化物,中身を使い切って\n"
+)
+
+
+def test_lexical_threshold_is_relative_to_its_weight_share():
+    weights = {"vector": 0.6, "lexical": 0.4}
+    # BM25 のみの融合スコアは 0.4 が上限。閾値はその範囲内にある
+    assert 0 < stage_threshold("lexical", weights) <= 0.4
+    assert stage_threshold("hybrid", weights) == PLANNER_MIN_CONFIDENCE
+    # BM25 の重みが 0 なら lexical では打ち切らない
+    assert math.isinf(stage_threshold("lexical", {"vector": 1.0, "lexical": 0.0}))
+
+
+def test_query_exits_at_lexical_stage(make_rag):
+    rag = make_rag(ITEMS_CSV)
+    embedder = rag.query_embeddings.inner
+    embedder.calls.clear()
+
+    # 品目名の完全一致ではないが、BM25 の上位に品目名の合う行がある
+    results = rag.similarity_search_with_scores("使い終わったペットボトル", k=5)
+
+    assert rag.stage_stats.exits["exact"] == 0
+    assert rag.stage_stats.exits["lexical"] == 1
+    assert "ペットボトル" in results[0][0].page_content
+    # lexical で打ち切ったのでクエリは埋め込まない
+    assert embedder.calls == []
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+チャットAPIの同時実行ロードテスト
+- N 本の /api/chat/streaming（または /api/chat/blocking）を同時に投げ、
+  最初のトークンまでの時間（TTFT）・完了時間・全体の所要時間を測る
+- 並行して /api/health を一定間隔で叩き、その応答時間を測る（イベントループが塞がれていれば伸びる）
+- 「重なり度」= 各リクエストの所要時間の合計 / 全体の所要時間
+  生成が交互に進んでいれば N に近づき、直列化されていれば 1 に近づく
+
+起動中のサーバーに対して実行する（質問は tools/questions.csv から順に使う）。
+
+使い方:
+    python tools/bench_chat_concurrency.py                              # 1 / 4 / 8 本の streaming
+    python tools/bench_chat_concurrency.py --concurrency 8 16 --mode blocking
+    python tools/bench_chat_concurrency.py --base-url http://192.168.0.10:8000
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import statistics
+import time
+from pathlib import Path
+
+import httpx
+
+QUESTIONS_CSV = Path(__file__).resolve().parent / "questions.csv"
+
+
+def load_questions(path: Path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [row["question"].strip() for row in csv.DictReader(f) if row.get("question", "").strip()]
+
+
+def p95(values):
+    values = sorted(values)
+    return values[max(0, int(len(values) * 0.95) - 1)] if values else float("nan")
+
+
+async def one_streaming(client: httpx.AsyncClient, base_url: str, prompt: str):
+    t0 = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", f"{base_url}/api/chat/streaming", json={"prompt": prompt}) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            event = json.loads(line[6:])
+            if event.get("type") == "chunk" and ttft is None:
+                ttft = time.perf_counter() - t0
+    total = time.perf_counter() - t0
+    return ttft if ttft is not None else total, total
+
+
+async def one_blocking(client: httpx.AsyncClient, base_url: str, prompt: str):
+    t0 = time.perf_counter()
+    resp = await client.post(f"{base_url}/api/chat/blocking", json={"prompt": prompt})
+    resp.raise_for_status()
+    total = time.perf_counter() - t0
+    return total, total
+
+
+async def probe_health(client: httpx.AsyncClient, base_url: str, interval: float, stop: asyncio.Event, out):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            await client.get(f"{base_url}/api/health")
+            out.append(time.perf_counter() - t0)
+        except httpx.HTTPError:
+            out.append(float("inf"))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_round(args, questions, n: int, offset: int):
+    prompts = [questions[(offset + i) % len(questions)] for i in range(n)]
+    one = one_streaming if args.mode == "streaming" else one_blocking
+    limits = httpx.Limits(max_connections=n + 4)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        health, stop = [], asyncio.Event()
+        prober = asyncio.create_task(probe_health(client, args.base_url, args.health_interval, stop, health))
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(client, args.base_url, p) for p in prompts), return_exceptions=True)
+        wall = time.perf_counter() - t0
+        stop.set()
+        await prober
+
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    errors = len(results) - len(ok)
+    ttfts = [r[0] for r in ok]
+    totals = [r[1] for r in ok]
+    return {
+        "n": n,
+        "errors": errors,
+        "wall_s": wall,
+        "ttft_mean": statistics.mean(ttfts) if ttfts else float("nan"),
+        "ttft_p95": p95(ttfts),
+        "total_mean": statistics.mean(totals) if totals else float("nan"),
+        "overlap": sum(totals) / wall if wall > 0 else float("nan"),
+        "health_p95_ms": p95(health) * 1000,
+        "health_max_ms": max(health) * 1000 if health else float("nan"),
+    }
+
+
+async def main_async(args):
+    questions = load_questions(Path(args.questions))
+    print(f"mode={args.mode} base_url={args.base_url}")
+    print(
+        f"{'N':>4}{'errors':>8}{'wall s':>9}{'TTFT mean':>11}{'TTFT p95':>10}"
+        f"{'total mean':>12}{'overlap':>9}{'health p95 ms':>15}{'health max ms':>15}"
+    )
+    offset = 0
+    for n in args.concurrency:
+        r = await run_round(args, questions, n, offset)
+        # 回答キャッシュ・検索キャッシュに当たらないよう、ラウンドごとに別の質問を使う
+        offset += n
+        print(
+            f"{r['n']:>4}{r['errors']:>8}{r['wall_s']:>9.2f}{r['ttft_mean']:>11.2f}{r['ttft_p95']:>10.2f}"
+            f"{r['total_mean']:>12.2f}{r['overlap']:>9.2f}{r['health_p95_ms']:>15.1f}{r['health_max_ms']:>15.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=["streaming", "blocking"], default="streaming")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--questions", default=str(QUESTIONS_CSV))
+    parser.add_argument("--health-interval", type=float, default=0.05, help="ヘルスチェックの間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CSV → ドキュメント変換のベンチマーク
+- 旧方式: pd.read_csv 一括 + iterrows + 行ごとのテキスト化 + md5
+- 新方式: backend.services.csv_loader.iter_csv_documents（列単位 + chunksize）
+
+使い方:
+    python tools/bench_csv_to_docs.py --rows 200000
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backend.services.csv_loader import iter_csv_documents  # noqa: E402
+
+SAMPLE_CSV = ROOT / "data" / "sample2 - シート1.csv"
+
+
+def make_input(path: str, rows: int, encoding: str) -> None:
+    """サンプルCSVの行を繰り返して rows 行の入力を作る（品名に連番を付けて重複を避ける）"""
+    base = pd.read_csv(SAMPLE_CSV, dtype=str, keep_default_na=False).to_dict("records")
+    with open(path, "w", newline="", encoding=encoding) as f:
+        writer = csv.writer(f)
+        writer.writerow(["品名", "出し方", "備考"])
+        for i in range(rows):
+            r = base[i % len(base)]
+            writer.writerow([f"{r['品名']}{i}", r["出し方"], r["備考"]])
+
+
+def legacy_convert(path: str) -> int:
+    """ベースライン実装（旧 add_csv のループ）"""
+    try:
+        df = pd.read_csv(path, encoding="utf-8")
+    except UnicodeDecodeError:
+        df = pd.read_csv(path, encoding="cp932")
+    n = 0
+    for _, row in df.iterrows():
+        item = row.get("品名") or row.get("品目") or row.get("item") or ""
+        how = row.get("出し方") or row.get("処理方法") or row.get("how") or ""
+        note = row.get("備考") or row.get("注意") or row.get("note") or ""
+        area = row.get("エリア") or row.get("地区") or row.get("area") or ""
+        text = "\n".join([
+            f"品目: {str(item).strip()}",
+            f"出し方: {str(how).strip()}",
+            f"備考: {str(note).strip()}",
+            f"エリア: {str(area).strip()}",
+        ]).strip()
+        hashlib.md5(text.encode("utf-8")).hexdigest()
+        n += 1
+    return n
+
+
+def streaming_convert(path: str, chunksize: int) -> int:
+    n = 0
+    for texts, _ in iter_csv_documents(path, chunksize=chunksize):
+        n += len(texts)
+    return n
+
+
+def measure(fn, *args, memory: bool):
+    if memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    n = fn(*args)
+    elapsed = time.perf_counter() - t0
+    peak = None
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return n, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--chunksize", type=int, default=20_000)
+    parser.add_argument("--encoding", default="utf-8", choices=["utf-8", "cp932"])
+    parser.add_argument("--memory", action="store_true", help="tracemalloc でピークメモリも計測（遅くなる）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        make_input(path, args.rows, args.encoding)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"input: {args.rows} rows, {size_mb:.1f} MB, {args.encoding}")
+
+        for name, fn, extra in (
+            ("legacy (iterrows)", legacy_convert, ()),
+            (f"streaming (chunksize={args.chunksize})", streaming_convert, (args.chunksize,)),
+        ):
+            n, elapsed, peak = measure(fn, path, *extra, memory=args.memory)
+            line = f"{name:<36} {n:>8} rows  {elapsed:7.2f} s  {n / elapsed:>10,.0f} rows/s"
+            if peak is not None:
+                line += f"  peak {peak / 1e6:7.1f} MB"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+語彙検索のベンチマーク（再現率とレイテンシ）
+- 旧: langchain BM25Retriever（空白区切り, rank_bm25 による全件採点）
+- 新: backend.services.lexical_index.IncrementalBM25Index（文字 n-gram + CSR転置リスト）
+
+クエリはサンプルCSVの品名から「〇〇の捨て方」などの形で作り、
+その品名の行が上位k件に入っているか（Recall@k）を測る。
+
+使い方:
+    python tools/bench_lexical.py --queries 300 --scale 1
+    python tools/bench_lexical.py --scale 100     # 約8万文書でレイテンシ比較
+"""
+
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backend.services.csv_loader import iter_csv_documents  # noqa: E402
+from backend.services.lexical_index import IncrementalBM25Index  # noqa: E402
+
+SAMPLE_CSV = ROOT / "data" / "sample2 - シート1.csv"
+TEMPLATES = ["{}の捨て方", "{}はどうやって捨てればいいですか", "{}を捨てたい", "{}"]
+
+
+def load_docs(scale: int):
+    texts = []
+    for chunk, _ in iter_csv_documents(str(SAMPLE_CSV)):
+        texts.extend(chunk)
+    docs = []
+    for rep in range(scale):
+        for i, t in enumerate(texts):
+            # 2周目以降は品名に連番を付けて別文書にする
+            body = t if rep == 0 else t.replace("品目: ", f"品目: {rep}番", 1)
+            docs.append(Document(page_content=body, metadata={"doc_id": f"{rep}-{i}"}))
+    return texts, docs
+
+
+def make_queries(texts, n, seed):
+    rng = random.Random(seed)
+    picked = rng.sample(range(len(texts)), min(n, len(texts)))
+    queries = []
+    for i in picked:
+        item = re.search(r"品目: (.*)", texts[i]).group(1).strip()
+        base = re.sub(r"（.*?）", "", item) or item
+        queries.append((rng.choice(TEMPLATES).format(base), f"0-{i}", item))
+    return queries
+
+
+def evaluate(name, search, queries, k):
+    hits, lat = 0, []
+    for q, target, _ in queries:
+        t0 = time.perf_counter()
+        docs = search(q, k)
+        lat.append((time.perf_counter() - t0) * 1000)
+        hits += any(d.metadata.get("doc_id") == target for d in docs)
+    lat.sort()
+    print(
+        f"{name:<28} Recall@{k} {hits / len(queries):6.1%}  "
+        f"mean {statistics.mean(lat):8.2f} ms  p95 {lat[int(len(lat) * 0.95) - 1]:8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--scale", type=int, default=1, help="サンプルCSVを何倍に増やすか")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts, docs = load_docs(args.scale)
+    queries = make_queries(texts, args.queries, args.seed)
+    print(f"documents: {len(docs)}  queries: {len(queries)}")
+
+    t0 = time.perf_counter()
+    index = IncrementalBM25Index()
+    index.add_many((d.metadata["doc_id"], d) for d in docs)
+    build = time.perf_counter() - t0
+    st = index.stats()
+    print(f"n-gram index build {build:.2f} s | terms {st['terms']} | postings {st['postings']}")
+
+    # 差分更新のコスト（1文書の追加・削除）
+    extra = Document(page_content="品目: ベンチ用\n出し方: 家庭ごみ", metadata={"doc_id": "bench"})
+    t0 = time.perf_counter()
+    index.add("bench", extra)
+    index.remove("bench")
+    print(f"n-gram index add+remove 1 doc {(time.perf_counter() - t0) * 1000:.3f} ms")
+
+    evaluate("n-gram CSR BM25", index.search, queries, args.k)
+
+    try:
+        from langchain_community.retrievers import BM25Retriever
+    except ImportError:
+        print("BM25Retriever (rank_bm25) が無いため比較を省略")
+        return
+    t0 = time.perf_counter()
+    retriever = BM25Retriever.from_documents(docs)
+    print(f"BM25Retriever build {time.perf_counter() - t0:.2f} s")
+
+    def legacy(q, k):
+        retriever.k = k
+        return retriever.invoke(q)
+
+    evaluate("BM25Retriever (whitespace)", legacy, queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プロンプト構成によるプレフィル量の比較（Ollama のプレフィックス KV キャッシュ再利用）
+- 旧: 指示文 + 質問 + 参照データ を1つの user メッセージに入れる（質問が前にあるため、指示文より後ろは毎回作り直し）
+- 新: 固定のシステムプロンプト → 参照データ → 質問（backend.services.rag_service.build_chat_messages）
+各構成で同じ質問列を順に投げ、Ollama が返す prompt_eval_count（実際にプレフィルしたトークン数）と
+prompt_eval_duration を集計する。プレフィックスが再利用されるほど両方が小さくなる。
+
+参照データはサンプルCSVを BM25 で検索した上位文書から作る（埋め込み・Chroma は不要）。
+起動中の Ollama に対して実行する（質問は tools/questions.csv から順に使う）。
+
+使い方:
+    python tools/bench_prompt_prefix.py --questions-limit 30
+    python tools/bench_prompt_prefix.py --host http://192.168.0.10:11434 --model llama3.1:8b
+"""
+
+import argparse
+import csv
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import ollama
+from langchain_core.documents import Document
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backend.services.csv_loader import iter_csv_documents  # noqa: E402
+from backend.services.lexical_index import IncrementalBM25Index  # noqa: E402
+from backend.services.rag_service import (  # noqa: E402
+    LLM_KEEP_ALIVE, LLM_MODEL, build_chat_messages, clean_text, format_context,
+)
+
+SAMPLE_CSV = ROOT / "data" / "sample2 - シート1.csv"
+QUESTIONS_CSV = Path(__file__).resolve().parent / "questions.csv"
+
+# 変更前の1メッセージ構成（比較用にそのまま残す）
+LEGACY_INSTRUCTIONS = (
+    "あなたは北九州市のごみ分別案内の専門AIです。"
+    "以下の参照データの範囲内で、日本語で簡潔かつ正確に回答してください。"
+    "最優先で「出し方」を特定して、そのままの表記で出力する。次に「備考」があれば補足する。"
+    "重要なルール:"
+    "1. 質問された品目に関連する情報のみを回答してください（関係ない品目の情報は含めないでください）"
+    "2. データベースに該当する情報がない場合は「申し訳ございませんが、該当する情報がありません。北九州市のホームページでご確認いただくか、お住まいの区役所にお問い合わせください。」と回答してください"
+    "3. 回答は簡潔で分かりやすく、出し方と備考を含めてください"
+    "4. 推測や一般的なアドバイスは避け、データに基づいた正確な情報のみを提供してください"
+    "5. 複数の関連品目がある場合は、質問に最も関連するもののみを優先して回答してください"
+)
+
+
+def legacy_messages(question: str, context: str):
+    return [{
+        "role": "user",
+        "content": f"{LEGACY_INSTRUCTIONS}\n\n質問:\n{question}\n\n参照データ:\n{context}\n\n回答:",
+    }]
+
+
+LAYOUTS = {"legacy": legacy_messages, "prefix": build_chat_messages}
+
+
+def load_questions(path: Path, limit: int):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        questions = [row["question"].strip() for row in csv.DictReader(f) if row.get("question", "").strip()]
+    return questions[:limit] if limit > 0 else questions
+
+
+def build_index() -> IncrementalBM25Index:
+    index = IncrementalBM25Index()
+    i = 0
+    for chunk, _ in iter_csv_documents(str(SAMPLE_CSV)):
+        for text in chunk:
+            index.add(str(i), Document(page_content=text, metadata={"doc_id": str(i)}))
+            i += 1
+    return index
+
+
+def p50(values):
+    return statistics.median(values) if values else float("nan")
+
+
+def run_layout(client: ollama.Client, args, name: str, cases):
+    build = LAYOUTS[name]
+    counts, evals_ms, walls = [], [], []
+    for question, context in cases:
+        t0 = time.perf_counter()
+        res = client.chat(
+            model=args.model,
+            messages=build(question, context),
+            options={"temperature": 0.1, "num_ctx": args.num_ctx, "num_predict": args.num_predict},
+            keep_alive=args.keep_alive,
+        )
+        walls.append(time.perf_counter() - t0)
+        counts.append(res.get("prompt_eval_count") or 0)
+        evals_ms.append((res.get("prompt_eval_duration") or 0) / 1e6)
+    return {
+        "layout": name,
+        "requests": len(cases),
+        "prompt_eval_count_mean": statistics.mean(counts) if counts else float("nan"),
+        "prompt_eval_count_p50": p50(counts),
+        "prompt_eval_ms_mean": statistics.mean(evals_ms) if evals_ms else float("nan"),
+        "prompt_eval_ms_p50": p50(evals_ms),
+        "wall_ms_mean": statistics.mean(walls) * 1000 if walls else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=None, help="Ollama のURL（既定は OLLAMA_HOST）")
+    parser.add_argument("--model", default=LLM_MODEL)
+    parser.add_argument("--questions", default=str(QUESTIONS_CSV))
+    parser.add_argument("--questions-limit", type=int, default=20)
+    parser.add_argument("--docs", type=int, default=8, help="参照データに入れる文書数")
+    parser.add_argument("--num-ctx", type=int, default=4096)
+    parser.add_argument("--num-predict", type=int, default=16, help="生成トークン数（プレフィルの比較なので少なくてよい）")
+    parser.add_argument("--keep-alive", default=LLM_KEEP_ALIVE)
+    args = parser.parse_args()
+
+    index = build_index()
+    cases = [
+        (clean_text(q), format_context(index.search(q, args.docs), max_docs=args.docs))
+        for q in load_questions(Path(args.questions), args.questions_limit)
+    ]
+    client = ollama.Client(host=args.host) if args.host else ollama.Client()
+    print(f"model={args.model} questions={len(cases)} docs={args.docs} num_ctx={args.num_ctx}")
+
+    # モデルの読み込み時間を計測から外す
+    client.chat(model=args.model, messages=[{"role": "user", "content": "こんにちは"}],
+                options={"num_ctx": args.num_ctx, "num_predict": 1}, keep_alive=args.keep_alive)
+
+    print(
+        f"{'layout':<8}{'requests':>10}{'prefill tok mean':>18}{'prefill tok p50':>17}"
+        f"{'prefill ms mean':>17}{'prefill ms p50':>16}{'wall ms mean':>14}"
+    )
+    for name in LAYOUTS:
+        r = run_layout(client, args, name, cases)
+        print(
+            f"{r['layout']:<8}{r['requests']:>10}{r['prompt_eval_count_mean']:>18.1f}{r['prompt_eval_count_p50']:>17.1f}"
+            f"{r['prompt_eval_ms_mean']:>17.1f}{r['prompt_eval_ms_p50']:>16.1f}{r['wall_ms_mean']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
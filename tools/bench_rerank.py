@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+品目名による再ランキングのマイクロベンチマーク
+- 旧: 候補ごとに正規表現で品目名を抜き出し、clean_text を2回呼び、同義語辞書を全走査する item_match_score
+- 新: backend.services.rerank.RerankFeatures（取り込み時に求めた名前ID・同義語グループIDを
+      文書の整数ID配列で引き、整数比較で採点）
+
+similarity_search と同じく 1クエリあたり「再ランキング2回 + poor 判定1回」を行い、その合計時間を測る。
+両者のスコアが一致することも確認する。
+
+使い方:
+    python tools/bench_rerank.py --queries 300 --candidates 40
+"""
+
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backend.services.csv_loader import iter_csv_documents  # noqa: E402
+from backend.services.rag_service import SYNONYMS_MAP, _synonyms, clean_text, extract_item_like  # noqa: E402
+from backend.services.doc_table import DocumentTable  # noqa: E402
+from backend.services.rerank import RerankFeatures  # noqa: E402
+
+SAMPLE_CSV = ROOT / "data" / "sample2 - シート1.csv"
+
+
+def legacy_item_match_score(txt: str, item: str) -> int:
+    if not txt:
+        return 0
+    m = re.search(r"品目:\s*(.+)", txt)
+    name = (m.group(1) if m else "").strip()
+    if not name:
+        return 0
+    n1 = clean_text(name)
+    n2 = clean_text(item)
+    if n1 == n2:
+        return 3
+    for key, synonyms in SYNONYMS_MAP.items():
+        if (n1 == key and n2 in synonyms) or (n2 == key and n1 in synonyms):
+            return 2
+        if n1 in synonyms and n2 in synonyms:
+            return 2
+    return 1 if (n2 and (n2 in n1 or n1 in n2)) else 0
+
+
+def make_queries(docs, n, rng):
+    surfaces = [s for k, vs in SYNONYMS_MAP.items() for s in (k, *vs)]
+    queries = []
+    for _ in range(n):
+        if rng.random() < 0.3:
+            base = rng.choice(surfaces)
+        else:
+            text = rng.choice(docs).page_content
+            base = re.search(r"品目: (.*)", text).group(1).strip()
+        queries.append(extract_item_like(rng.choice(["{}の捨て方", "{}はどうする", "{}"]).format(base)))
+    return queries
+
+
+def time_rerank(score_fn, candidates, item, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        # similarity_search 内の rerank_by_item ×2 + poor ×1 に相当
+        for _ in range(2):
+            scores = score_fn(candidates, item)
+            sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        any(s > 0 for s in score_fn(candidates, item))
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--candidates", type=int, default=40, help="1回の再ランキング対象件数")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    docs = []
+    for texts, ids in iter_csv_documents(str(SAMPLE_CSV)):
+        docs.extend(Document(page_content=t, metadata={"doc_id": i}) for t, i in zip(texts, ids))
+    t0 = time.perf_counter()
+    table = DocumentTable()
+    doc_ids = table.add_many((d.metadata["doc_id"], d) for d in docs)
+    features = RerankFeatures(clean_text, _synonyms.canonical_id)
+    features.add_many(doc_ids, docs)
+    print(f"documents: {len(docs)} | features build {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    def legacy(candidates, item):
+        return [legacy_item_match_score(d.page_content, item) for d in candidates]
+
+    def compiled(candidate_ids, item):
+        return features.scores(candidate_ids, item)
+
+    legacy_us, new_us, mismatches = [], [], 0
+    for item in make_queries(docs, args.queries, rng):
+        candidates = rng.sample(docs, min(args.candidates, len(docs)))
+        candidate_ids = table.ids_of([d.metadata["doc_id"] for d in candidates])
+        mismatches += legacy(candidates, item) != compiled(candidate_ids, item).tolist()
+        legacy_us.append(time_rerank(legacy, candidates, item, args.repeat))
+        new_us.append(time_rerank(compiled, candidate_ids, item, args.repeat))
+
+    print(f"candidates/query: {args.candidates} | score mismatches: {mismatches}/{args.queries}")
+    for name, lat in (("legacy item_match_score", legacy_us), ("precomputed features", new_us)):
+        lat.sort()
+        print(f"{name:<24} mean {statistics.mean(lat):8.1f} us/query  p95 {lat[int(len(lat) * 0.95) - 1]:8.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
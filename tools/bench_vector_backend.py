@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ベクトル検索バックエンドのベンチマーク（レイテンシ・メモリ・再現率）
+- chroma: langchain_chroma.Chroma（HNSW）に複数クエリ検索を投げる
+- numpy : backend.services.vector_index.NumpyVectorIndex（行列積 + argpartition の厳密検索）
+
+埋め込みは乱数で作る（Ollama 不要）。クエリは既存文書にノイズを加えたもの。
+RSS はバックエンドごとに別プロセスで構築前後の差を測る。
+
+使い方:
+    python tools/bench_vector_backend.py                    # 1k / 10k / 100k, 1024次元
+    python tools/bench_vector_backend.py --sizes 1000 10000 --dim 1024 --batch 8
+"""
+
+import argparse
+import multiprocessing as mp
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backend.services.vector_index import NumpyVectorIndex  # noqa: E402
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize() / 2**20
+    except (OSError, ImportError):
+        return float("nan")
+
+
+def make_data(n: int, dim: int, n_queries: int, seed: int):
+    rng = np.random.default_rng(seed)
+    docs = rng.standard_normal((n, dim), dtype=np.float32)
+    docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+    picked = rng.choice(n, size=n_queries, replace=n < n_queries)
+    queries = docs[picked] + 0.5 * rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim)
+    return docs, queries
+
+
+def exact_topk(docs: np.ndarray, queries: np.ndarray, k: int):
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = q @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def build_numpy(docs):
+    index = NumpyVectorIndex()
+    step = 5000
+    for start in range(0, len(docs), step):
+        end = min(start + step, len(docs))
+        index.add_many(
+            ((str(i), Document(page_content=str(i), metadata={"doc_id": str(i)})) for i in range(start, end)),
+            docs[start:end],
+        )
+
+    def search(batch, k):
+        return [[d.metadata["doc_id"] for d in hits] for hits in index.search_many(batch, k)]
+    return search
+
+
+def build_chroma(docs):
+    from langchain_chroma import Chroma
+    store = Chroma(collection_name=f"bench_{time.time_ns()}")
+    step = 5000
+    for start in range(0, len(docs), step):
+        end = min(start + step, len(docs))
+        store._collection.add(
+            ids=[str(i) for i in range(start, end)],
+            embeddings=docs[start:end].tolist(),
+            documents=[str(i) for i in range(start, end)],
+            metadatas=[{"doc_id": str(i)} for i in range(start, end)],
+        )
+
+    def search(batch, k):
+        res = store._collection.query(query_embeddings=batch.tolist(), n_results=k, include=["metadatas"])
+        return [[m["doc_id"] for m in metas] for metas in res["metadatas"]]
+    return search
+
+
+def run_backend(backend: str, n: int, args, out):
+    docs, queries = make_data(n, args.dim, args.queries, args.seed)
+    truth = exact_topk(docs, queries, args.k)
+    builder = build_numpy if backend == "numpy" else build_chroma
+
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    search = builder(docs)
+    build = time.perf_counter() - t0
+    rss = rss_mb() - rss0
+
+    lat, hits = [], 0
+    for start in range(0, len(queries), args.batch):
+        batch = queries[start:start + args.batch]
+        t0 = time.perf_counter()
+        found = search(batch, args.k)
+        lat.append((time.perf_counter() - t0) * 1000)
+        for i, ids in enumerate(found):
+            expected = {str(x) for x in truth[start + i]}
+            hits += len(expected.intersection(ids))
+    lat.sort()
+    out.put({
+        "backend": backend,
+        "n": n,
+        "build_s": build,
+        "rss_mb": rss,
+        "mean_ms": statistics.mean(lat),
+        "p95_ms": lat[max(0, int(len(lat) * 0.95) - 1)],
+        "recall": hits / (len(queries) * args.k),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1024, help="bge-m3 は 1024 次元")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5, help="1回の検索にまとめるクエリ数（同義語展開の数に相当）")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=["numpy", "chroma"])
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(f"dim={args.dim} queries={args.queries} batch={args.batch} k={args.k}")
+    print(f"{'backend':<8}{'docs':>9}{'build s':>10}{'RSS MB':>10}{'mean ms':>10}{'p95 ms':>10}{'recall':>9}")
+    for n in args.sizes:
+        for backend in args.backends:
+            out = ctx.Queue()
+            proc = ctx.Process(target=run_backend, args=(backend, n, args, out))
+            proc.start()
+            r = out.get()
+            proc.join()
+            print(
+                f"{r['backend']:<8}{r['n']:>9}{r['build_s']:>10.2f}{r['rss_mb']:>10.1f}"
+                f"{r['mean_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['recall']:>9.1%}"
+            )
+
+
+if __name__ == "__main__":
+    main()